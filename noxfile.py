@@ -42,3 +42,10 @@ def generate_protos(session):
     session.install("grpcio-tools")
     session.run(
         "python", "-m", "grpc_tools.protoc", "-Isynthtool/protos", "--python_out=synthtool/protos", "synthtool/protos/metadata.proto")
+
+
+@nox.session(python='3.6')
+def compile_templates(session):
+    session.run('pip', 'install', '-e', '.')
+    session.run(
+        "python", "-c", "from synthtool.gcp import common; common.compile_templates()")
@@ -12,7 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
+import os
+
 import setuptools
+from setuptools.command.build_py import build_py
 
 name = 'gcp-synthtool'
 description = ''
@@ -29,10 +34,110 @@ dependencies = [
 ]
 
 packages = setuptools.find_packages()
+# The `synthtool` command starts in synthtool_client, which hands the run to
+# the daemon (with --use-daemon) before importing synthtool.
+py_modules = ['synthtool_client']
 scripts = [
-    'synthtool=synthtool.__main__:main'
+    'synthtool=synthtool_client:main'
+]
+
+# The bundled templates, and where their precompiled versions go in the
+# package, see synthtool.gcp.common.compile_templates.
+templates_dir = os.path.join('synthtool', 'gcp', 'templates')
+compiled_templates_dir = os.path.join('synthtool', 'gcp', 'compiled_templates')
+# The filters synthtool.sources.templates registers. The compiler only checks
+# that they exist.
+template_filters = [
+    'release_quality_badge', 'language_pretty', 'slugify', 'syntax_highlighter'
 ]
 
+
+def compile_templates(location, target, version):
+    """Does what synthtool.sources.templates.compile_templates does, with
+    jinja2 alone, as synthtool can't be imported while it is being built.
+    Returns the files written."""
+    import jinja2
+    import jinja2.meta
+
+    # The same options as synthtool.sources.templates._make_env.
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(location),
+        autoescape=False,
+        keep_trailing_newline=True,
+    )
+    for filter_name in template_filters:
+        env.filters[filter_name] = lambda value: value
+
+    # Static files are skipped, see synthtool.sources.templates._is_template.
+    markers = [
+        marker.encode('utf-8') for marker in (
+            env.block_start_string,
+            env.variable_start_string,
+            env.comment_start_string,
+        )
+    ]
+    names = []
+    for template_name in env.list_templates():
+        with open(os.path.join(location, template_name), 'rb') as f:
+            contents = f.read()
+        if os.path.splitext(template_name)[1] == '.j2' or any(
+            marker in contents for marker in markers
+        ):
+            names.append(template_name)
+    env.compile_templates(target, filter_func=lambda n: n in names, zip=None)
+
+    manifest = {'version': version, 'jinja2': jinja2.__version__, 'templates': {}}
+    for template_name in names:
+        source, _, _ = env.loader.get_source(env, template_name)
+        ast = env.parse(source)
+        if list(jinja2.meta.find_referenced_templates(ast)):
+            variables = None
+        else:
+            variables = sorted(jinja2.meta.find_undeclared_variables(ast))
+        manifest['templates'][template_name] = {
+            'sha256': hashlib.sha256(source.encode('utf-8')).hexdigest(),
+            'variables': variables,
+        }
+    manifest_file = os.path.join(target, 'manifest.json')
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    files = [os.path.join(target, file_name) for file_name in os.listdir(target)]
+    return [path for path in files if os.path.isfile(path)]
+
+
+class BuildPyWithTemplates(build_py):
+    """Builds the package with its templates precompiled, so that synth runs
+    don't parse them. Each template group is compiled separately, as well as
+    the templates directory as a whole."""
+
+    def run(self):
+        super().run()
+        self.compiled_templates = []
+        try:
+            import jinja2  # noqa: F401
+        except ImportError:
+            self.warn('jinja2 is not installed, not precompiling the templates.')
+            return
+
+        # The version synthtool finds at runtime, normalized like it.
+        version = self.distribution.get_version()
+        target = os.path.join(self.build_lib, compiled_templates_dir)
+        self.mkpath(target)
+        self.compiled_templates += compile_templates(templates_dir, target, version)
+        for group in sorted(os.listdir(templates_dir)):
+            if os.path.isdir(os.path.join(templates_dir, group)):
+                self.compiled_templates += compile_templates(
+                    os.path.join(templates_dir, group),
+                    os.path.join(target, group),
+                    version,
+                )
+
+    def get_outputs(self, include_bytecode=1):
+        outputs = super().get_outputs(include_bytecode)
+        return outputs + getattr(self, 'compiled_templates', [])
+
+
 setuptools.setup(
     name=name,
     version=version,
@@ -52,10 +157,14 @@ setuptools.setup(
     ],
     platforms='Posix; MacOS X; Windows',
     packages=packages,
+    py_modules=py_modules,
     install_requires=dependencies,
     include_package_data=True,
     zip_safe=False,
     entry_points={
         'console_scripts': scripts,
     },
+    cmdclass={
+        'build_py': BuildPyWithTemplates,
+    },
 )
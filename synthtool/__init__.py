@@ -17,12 +17,13 @@
 import sys
 
 from synthtool.transforms import move, replace
+from synthtool.pipeline import Pipeline
 from synthtool import log
 from synthtool import update_check
 
 copy = move
 
-__all__ = ["copy", "move", "replace"]
+__all__ = ["copy", "move", "replace", "Pipeline"]
 
 # Make sure that synthtool is being used instead of running the synth file
 # directly
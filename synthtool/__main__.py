@@ -14,14 +14,23 @@
 
 import os
 import sys
+import time
 import importlib.util
-from typing import List, Sequence
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
 
 import click
 import pkg_resources
 
+import synthtool.batch
+import synthtool.context
+import synthtool.daemon
+import synthtool.freshness
+import synthtool.lock
 import synthtool.log
 import synthtool.metadata
+import synthtool.watch
+import synthtool_client
 
 
 try:
@@ -30,9 +39,6 @@ except pkg_resources.DistributionNotFound:
     VERSION = "0.0.0+dev"
 
 
-_extra_args: List[str] = []
-
-
 def extra_args() -> List[str]:
     """Return any additional arguments specified to synthtool."""
     # Return a copy so these don't get modified.
@@ -52,36 +58,216 @@ def extra_args() -> List[str]:
             # module.
             pass
 
-    return list(_extra_args)
+    return list(synthtool.context.current().extra_args)
 
 
 @click.command()
 @click.version_option(message="%(version)s", version=VERSION)
 @click.argument("synthfile", default="synth.py")
 @click.option("--metadata", default="synth.metadata")
+@click.option(
+    "--skip-if-unchanged",
+    is_flag=True,
+    help="Don't execute the synthfile if none of the inputs recorded in the "
+    "metadata changed since it was written.",
+)
+@click.option(
+    "--locked",
+    is_flag=True,
+    help="Use the git commits and docker images pinned in synth.lock.",
+)
+@click.option(
+    "--update-lock",
+    is_flag=True,
+    help="Pin the git commits and docker images used in synth.lock.",
+)
+@click.option(
+    "--use-daemon",
+    is_flag=True,
+    help="Run in the synthtool daemon, if one is listening (see "
+    "`synthtool daemon`).",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Run again whenever the synthfile, the templates, or the local "
+    "googleapis or generator change.",
+)
 @click.argument("extra_args", nargs=-1)
-def main(synthfile: str, metadata: str, extra_args: Sequence[str]):
-    _extra_args.extend(extra_args)
+def main(
+    synthfile: str,
+    metadata: str,
+    extra_args: Sequence[str],
+    skip_if_unchanged: bool,
+    locked: bool,
+    update_lock: bool,
+    use_daemon: bool,
+    watch: bool,
+):
+    """Runs a synthfile, synth.py by default."""
+    if locked and update_lock:
+        raise click.UsageError("--locked and --update-lock are mutually exclusive.")
 
-    synthtool.metadata.register_exit_hook(outfile=metadata)
+    # A watch is long-lived already, the daemon would save it nothing.
+    if use_daemon and not watch:
+        flags = {
+            "--skip-if-unchanged": skip_if_unchanged,
+            "--locked": locked,
+            "--update-lock": update_lock,
+        }
+        args = [synthfile, "--metadata", metadata]
+        args += [flag for flag, enabled in flags.items() if enabled]
+        exit_code = synthtool_client.submit(args + ["--", *extra_args])
+        if exit_code is not None:
+            sys.exit(exit_code)
+        synthtool.log.debug("Running locally.")
+    if locked or update_lock:
+        lock_file = os.path.join(
+            os.path.dirname(os.path.abspath(synthfile)), "synth.lock"
+        )
+        synthtool.lock.configure(
+            lock_file, synthtool.lock.LOCKED if locked else synthtool.lock.UPDATE
+        )
+
+    if skip_if_unchanged:
+        if extra_args:
+            unchanged, reason = False, "extra arguments were given"
+        else:
+            unchanged, reason = synthtool.freshness.check(synthfile, metadata)
+        if unchanged:
+            synthtool.log.success(f"Not executing {synthfile}, {reason}.")
+            return
+        synthtool.log.debug(f"Executing {synthfile}, {reason}.")
 
     synth_file = os.path.abspath(synthfile)
 
-    if os.path.lexists(synth_file):
-        synthtool.log.debug(f"Executing {synth_file}.")
-        # https://docs.python.org/3/library/importlib.html#importing-a-source-file-directly
-        spec = importlib.util.spec_from_file_location("synth", synth_file)
-        synth_module = importlib.util.module_from_spec(spec)
+    if watch:
+        if not os.path.lexists(synth_file):
+            synthtool.log.error(f"{synth_file} not found.")
+            sys.exit(1)
+        synthtool.watch.watch(
+            lambda: execute(synth_file),
+            synthtool.watch.watched_paths(synth_file),
+            extra_args=extra_args,
+            outfile=metadata,
+        )
+        return
 
-        if spec.loader is None:
-            raise ImportError("Could not import synth.py")
+    synthtool.context.current().extra_args.extend(extra_args)
 
-        spec.loader.exec_module(synth_module)  # type: ignore
+    synthtool.metadata.register_exit_hook(outfile=metadata)
 
+    if os.path.lexists(synth_file):
+        execute(synth_file)
+        synthtool.context.current().succeeded = True
     else:
         synthtool.log.exception(f"{synth_file} not found.")
         sys.exit(1)
 
 
+def execute(synth_file: str) -> None:
+    """Executes a synth file, in the current context."""
+    synthtool.log.debug(f"Executing {synth_file}.")
+    # https://docs.python.org/3/library/importlib.html#importing-a-source-file-directly
+    spec = importlib.util.spec_from_file_location("synth", synth_file)
+    synth_module = importlib.util.module_from_spec(spec)
+
+    if spec.loader is None:
+        raise ImportError("Could not import synth.py")
+
+    spec.loader.exec_module(synth_module)  # type: ignore
+
+
+def _parse_shard(ctx, param, value) -> Optional[Tuple[int, int]]:
+    if value is None:
+        return None
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("expected I/N, such as 1/4.")
+    if not 1 <= index <= count:
+        raise click.BadParameter(f"shard {index} of {count} doesn't exist.")
+    return index, count
+
+
+@click.command()
+@click.argument("repos", nargs=-1, required=True)
+@click.option("--synthfile", default="synth.py", help="Relative to each repo.")
+@click.option("--metadata", default="synth.metadata", help="Relative to each repo.")
+@click.option(
+    "--skip-if-unchanged",
+    is_flag=True,
+    help="Don't execute the synthfiles whose inputs didn't change.",
+)
+@click.option("-j", "--jobs", type=int, default=None, help="Synths to run at once.")
+@click.option(
+    "--shard",
+    callback=_parse_shard,
+    help="Only run shard I (from 1) of N, as I/N. Repos are balanced across "
+    "shards by the durations recorded in their metadata.",
+)
+def batch(
+    repos: Sequence[str],
+    synthfile: str,
+    metadata: str,
+    skip_if_unchanged: bool,
+    jobs: Optional[int],
+    shard: Optional[Tuple[int, int]],
+):
+    """Runs the synthfiles of many repository directories."""
+    if shard is not None:
+        repos = synthtool.batch.shard(repos, *shard, metadata_file=metadata)
+
+    start = time.monotonic()
+    results = synthtool.batch.run_many(
+        repos,
+        synthfile=synthfile,
+        metadata_file=metadata,
+        skip_if_unchanged=skip_if_unchanged,
+        max_workers=jobs,
+    )
+    summary = synthtool.batch.summarize(results, time.monotonic() - start)
+
+    if any(result.status == synthtool.batch.FAILED for result in results):
+        synthtool.log.error(summary)
+        sys.exit(1)
+    synthtool.log.success(summary)
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    default=None,
+    help="Defaults to $SYNTHTOOL_DAEMON_SOCKET, or daemon.sock in the cache.",
+)
+def daemon(socket_path: Optional[str]):
+    """Keeps synthtool loaded, to run the synths of `synthtool --use-daemon`."""
+    synthtool.daemon.serve(None if socket_path is None else Path(socket_path))
+
+
+class _DefaultGroup(click.Group):
+    """Runs `main` unless the first argument names another command, so that
+    `synthtool [synthfile]` works as it always has."""
+
+    def parse_args(self, ctx, args):
+        # `synthtool --help` lists the commands.
+        known = set(self.commands) | set(self.get_help_option_names(ctx))
+        if not args or args[0] not in known:
+            args = ["run"] + list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=_DefaultGroup)
+def cli():
+    """Synthesizes the generated parts of a repository. Without a command,
+    runs `synthtool run`."""
+
+
+cli.add_command(main, "run")
+cli.add_command(batch)
+cli.add_command(daemon)
+
+
 if __name__ == "__main__":
-    main()
+    cli()
@@ -0,0 +1,47 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs blocking synthtool calls from coroutines.
+
+The *_async() versions of the generators, templates and git.clone() run
+their blocking counterparts in the event loop's default executor (a thread
+pool), as the work they wait on is mostly in subprocesses: Docker, git and
+the generators. Coroutines running commands of their own await them with
+shell.run_async instead, which needs no thread.
+"""
+
+import asyncio
+from typing import Any, Callable
+
+from synthtool import context
+from synthtool import metadata
+
+
+async def call(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Awaits func(*args, **kwargs), run in the event loop's default executor.
+
+    The metadata it adds is captured in the executor's thread, and added to
+    the caller's metadata once it returns, so that concurrent calls never
+    add to the same message at once. Their metadata is recorded in the order
+    they finish.
+    """
+
+    def run():
+        with metadata.capture() as captured:
+            return func(*args, **kwargs), captured
+
+    loop = asyncio.get_event_loop()
+    result, captured = await loop.run_in_executor(None, context.bind(run))
+    metadata.merge(captured)
+    return result
@@ -0,0 +1,94 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Project files.
+
+Loads the JSON and YAML files that describe the repository being
+synthesized (.repo-metadata.json, .readme-partials.yml, package.json), each
+read and parsed at most once per run unless it changes on disk.
+"""
+
+import copy
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+import yaml
+
+PathOrStr = Union[str, Path]
+Validator = Callable[[Path, Any], None]
+
+# Use libyaml when PyYAML was built with it, it's much faster.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed files, keyed by absolute path and validated against (mtime, size).
+_files: Dict[str, Tuple[int, int, Any]] = {}
+_lock = threading.Lock()
+
+
+def _load(
+    path: PathOrStr, parse: Callable[[str], Any], validate: Optional[Validator]
+) -> Optional[Any]:
+    path = Path(os.path.abspath(str(path)))
+    try:
+        path_stat = path.stat()
+    except FileNotFoundError:
+        return None
+
+    with _lock:
+        cached = _files.get(str(path))
+    if cached is not None and cached[:2] == (path_stat.st_mtime_ns, path_stat.st_size):
+        return copy.deepcopy(cached[2])
+
+    with open(path) as f:
+        value = parse(f.read())
+    if validate is not None:
+        validate(path, value)
+
+    with _lock:
+        _files[str(path)] = (path_stat.st_mtime_ns, path_stat.st_size, value)
+    # Hand out a copy, callers are free to modify what they get.
+    return copy.deepcopy(value)
+
+
+def load_json(path: PathOrStr, validate: Validator = None) -> Optional[Any]:
+    """Returns the parsed contents of a JSON file, or None if it doesn't exist.
+
+    If given, ``validate`` is called with the path and the parsed value the
+    first time the file is read, and should raise if it is invalid.
+    """
+    return _load(path, json.loads, validate)
+
+
+def load_yaml(path: PathOrStr, validate: Validator = None) -> Optional[Any]:
+    """Returns the parsed contents of a YAML file, or None if it doesn't exist
+    (or is empty: check whether it exists if that matters).
+
+    See load_json.
+    """
+    return _load(path, lambda text: yaml.load(text, Loader=YAML_LOADER), validate)
+
+
+def require_mapping(path: Path, value: Any) -> None:
+    """A validator for files that must hold a single object."""
+    if not isinstance(value, dict):
+        raise RuntimeError(f"{path} must contain an object, not {type(value).__name__}")
+
+
+def reset() -> None:
+    """Forget everything loaded so far."""
+    with _lock:
+        _files.clear()
@@ -19,19 +19,27 @@ This is a bit of a hack.
 
 import pathlib
 
-
-_tracked_paths = []
+from synthtool import context
 
 
 def add(path):
-    _tracked_paths.append(pathlib.Path(path))
-    # Reverse sort the list, so that the deepest paths get matched first.
-    _tracked_paths.sort(key=lambda s: -len(str(s)))
+    current = context.current()
+    with current.lock:
+        current.tracked_paths.append(pathlib.Path(path))
+        # Reverse sort the list, so that the deepest paths get matched first.
+        current.tracked_paths.sort(key=lambda s: -len(str(s)))
+
+
+def get():
+    """Returns the tracked paths of the current context."""
+    current = context.current()
+    with current.lock:
+        return list(current.tracked_paths)
 
 
 def relativize(path):
     path = pathlib.Path(path)
-    for tracked_path in _tracked_paths:
+    for tracked_path in get():
         try:
             return path.relative_to(tracked_path)
         except ValueError:
@@ -0,0 +1,226 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs the synths of many repositories, see `synthtool batch`.
+
+The synths run on a pool of worker processes, each running one synth at a
+time in a SynthContext of its own. The workers are forked from this process
+once, so synthtool is imported (and the update check run) once, and their
+in-memory caches (docker images, parsed protos, compiled templates) carry
+over from one synth to the next. They share the on-disk cache: a clone like
+googleapis is pulled by the first synth that needs it, and reused as is by
+the rest of the batch. Clones are never moved to another commit during a
+batch, as other synths may be generating from them: each committish or
+locked commit gets a clone of its own, see git.get_clone_path().
+"""
+
+import concurrent.futures
+import json
+import multiprocessing.util
+import os
+import time
+import traceback
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from synthtool import context
+from synthtool import freshness
+from synthtool import log
+from synthtool import metadata
+from synthtool.sources import git
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+# The worker process whose default context is closed at exit, see
+# _close_default_at_exit().
+_closing_pid: Optional[int] = None
+
+
+class RepoResult(NamedTuple):
+    repo: str
+    status: str
+    # In seconds.
+    duration: float
+    # Why the synth failed or was skipped.
+    reason: Optional[str] = None
+
+
+def _close_default_at_exit() -> None:
+    """Closes this worker's default context when the worker exits.
+
+    Pool workers exit without running atexit hooks, which would leave behind
+    what lives as long as the process: artman's output root and its warm
+    containers. multiprocessing runs its own finalizers, though.
+    """
+    global _closing_pid
+    if _closing_pid == os.getpid():
+        return
+    _closing_pid = os.getpid()
+    context.default().forget_inherited()
+    multiprocessing.util.Finalize(None, context.default().close, exitpriority=0)
+
+
+def _run_repo(
+    repo: str,
+    synthfile: str,
+    metadata_file: str,
+    skip_if_unchanged: bool,
+    batch_id: str,
+) -> RepoResult:
+    """Runs a repository's synth in this (worker) process."""
+    from synthtool import __main__
+
+    _close_default_at_exit()
+    # Lets the workers pull shared clones once, see git.clone().
+    os.environ[git.BATCH_ID_ENV] = batch_id
+    start = time.monotonic()
+    previous_cwd = os.getcwd()
+    try:
+        os.chdir(repo)
+        if skip_if_unchanged:
+            unchanged, reason = freshness.check(synthfile, metadata_file)
+            if unchanged:
+                return RepoResult(repo, SKIPPED, time.monotonic() - start, reason)
+
+        synth_file = os.path.abspath(synthfile)
+        if not os.path.lexists(synth_file):
+            raise FileNotFoundError(f"{synth_file} not found.")
+
+        with context.SynthContext() as synth_context:
+            with context.activate(synth_context):
+                # Written when the context closes, even if the synth fails,
+                # like the atexit hook of a single synth.
+                metadata.register_exit_hook(outfile=metadata_file)
+                __main__.execute(synth_file)
+                synth_context.succeeded = True
+    except (Exception, SystemExit):
+        error = traceback.format_exc()
+        log.error(f"Synthesizing {repo} failed:\n\n{error}")
+        return RepoResult(repo, FAILED, time.monotonic() - start, error)
+    finally:
+        os.chdir(previous_cwd)
+
+    return RepoResult(repo, SUCCEEDED, time.monotonic() - start)
+
+
+def _recorded_duration(repo: str, metadata_file: str) -> Optional[float]:
+    try:
+        with open(os.path.join(repo, metadata_file)) as f:
+            recorded = json.load(f).get("synthDuration")
+    except (FileNotFoundError, ValueError):
+        return None
+    return float(recorded) if recorded else None
+
+
+def shard(
+    repos: Sequence[str], index: int, count: int, metadata_file: str = "synth.metadata"
+) -> List[str]:
+    """Returns the repositories of shard ``index`` (from 1) of ``count``.
+
+    Repositories are spread by the duration recorded in their metadata by
+    the last run, longest first, each going to the shard with the least
+    total so far. Those without one count as the average. The metadata is
+    checked in, so every node of a CI run computes the same shards.
+    """
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard {index} doesn't exist, there are {count}.")
+
+    durations = {repo: _recorded_duration(repo, metadata_file) for repo in repos}
+    known = [duration for duration in durations.values() if duration is not None]
+    default = sum(known) / len(known) if known else 1.0
+
+    loads = [0.0] * count
+    assigned: Dict[str, int] = {}
+    # Ties are broken by name, to keep the shards the same on every node.
+    ordered = sorted(repos, key=lambda repo: (-(durations[repo] or default), repo))
+    for repo in ordered:
+        target = loads.index(min(loads))
+        loads[target] += durations[repo] or default
+        assigned[repo] = target
+
+    selected = [repo for repo in repos if assigned[repo] == index - 1]
+    log.debug(
+        f"Shard {index}/{count}: {len(selected)} of {len(repos)} repos, "
+        f"about {loads[index - 1]:.0f}s."
+    )
+    return selected
+
+
+def run_many(
+    repos: Sequence[str],
+    synthfile: str = "synth.py",
+    metadata_file: str = "synth.metadata",
+    skip_if_unchanged: bool = False,
+    max_workers: Optional[int] = None,
+) -> List[RepoResult]:
+    """Runs the synth of each repository directory, on a process pool.
+
+    Args:
+        repos: The repository directories.
+        synthfile: The synth file, relative to each repository.
+        metadata_file: The metadata file, relative to each repository.
+        skip_if_unchanged: Skip synths whose inputs didn't change, like
+            `synthtool --skip-if-unchanged`.
+        max_workers: How many synths to run at once, by default the number
+            of CPUs.
+
+    Returns:
+        The result for each repository, in the order of ``repos``.
+    """
+    repos = [os.path.abspath(repo) for repo in repos]
+    batch_id = uuid.uuid4().hex
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(
+                _run_repo,
+                repo,
+                synthfile,
+                metadata_file,
+                skip_if_unchanged,
+                batch_id,
+            )
+            for repo in repos
+        ]
+        results = []
+        for future in futures:
+            result = future.result()
+            log.debug(f"{result.repo} {result.status} in {result.duration:.1f}s.")
+            results.append(result)
+    return results
+
+
+def summarize(results: Sequence[RepoResult], wall_time: float) -> str:
+    """Formats the results as a table, with totals."""
+    width = max([len(result.repo) for result in results] + [4])
+    lines = [f"{'repo'.ljust(width)}  {'status':9}  duration"]
+    for result in results:
+        lines.append(
+            f"{result.repo.ljust(width)}  {result.status:9}  {result.duration:7.1f}s"
+        )
+
+    counts = {
+        status: sum(result.status == status for result in results)
+        for status in (SUCCEEDED, FAILED, SKIPPED)
+    }
+    total = sum(result.duration for result in results)
+    lines.append(
+        f"{counts[SUCCEEDED]} succeeded, {counts[FAILED]} failed, "
+        f"{counts[SKIPPED]} skipped in {wall_time:.1f}s "
+        f"({total:.1f}s of synth time)."
+    )
+    return "\n".join(lines)
@@ -14,8 +14,12 @@
 
 import pathlib
 
+from synthtool import context
+
 
 def get_cache_dir() -> pathlib.Path:
-    cache_dir = pathlib.Path.home() / ".cache" / "synthtool"
+    cache_dir = context.current().cache_dir
+    if cache_dir is None:
+        cache_dir = pathlib.Path.home() / ".cache" / "synthtool"
     cache_dir.mkdir(parents=True, exist_ok=True)
     return cache_dir
@@ -0,0 +1,170 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synth contexts.
+
+The state of a synth run (its metadata, tracked paths, temporary directories,
+cache directory and extra arguments) belongs to a SynthContext. Module
+functions like metadata.add_git_source() or tmp.tmpdir() work on the current
+context: the one activated in this thread (or task), or else the process's
+default context, which is the one `python -m synthtool` uses. Several synths
+can then run in one process, each in a context of its own:
+
+    with context.SynthContext(extra_args=["--foo"]) as ctx:
+        with context.activate(ctx):
+            ...
+
+Threads don't inherit the current context, see bind().
+"""
+
+import atexit
+import contextlib
+import functools
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Union
+
+from synthtool import log
+from synthtool.protos import metadata_pb2
+
+try:
+    import contextvars
+except ImportError:  # Python 3.6
+    contextvars = None  # type: ignore
+
+PathOrStr = Union[str, Path]
+
+
+class SynthContext:
+    def __init__(
+        self, extra_args: Sequence[str] = (), cache_dir: Optional[PathOrStr] = None
+    ):
+        """
+        extra_args: the arguments given to the synth, see extra_args().
+        cache_dir: where clones and other caches go, by default
+          ~/.cache/synthtool.
+        """
+        self.metadata = metadata_pb2.Metadata()
+        self.tracked_paths: List[Path] = []
+        self.tempdirs: List[str] = []
+        self.extra_args = list(extra_args)
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        # Set once the synth ran to the end, see metadata.register_exit_hook().
+        self.succeeded = False
+        # Guards the state above, which is changed from several threads
+        # during concurrent generations.
+        self.lock = threading.RLock()
+        self._exit_hooks: List[Callable[[], Any]] = []
+
+    def add_exit_hook(self, hook: Callable[[], Any]) -> None:
+        """Calls hook() in this context when it closes, before its temporary
+        directories are removed. Hooks run in the reverse order of adding."""
+        with self.lock:
+            self._exit_hooks.append(hook)
+
+    def forget_inherited(self) -> None:
+        """Forgets the temporary directories and exit hooks of a forked
+        process's parent, which closes them itself."""
+        with self.lock:
+            self.tempdirs.clear()
+            self._exit_hooks.clear()
+
+    def remove_tempdirs(self) -> None:
+        with self.lock:
+            tempdirs = list(self.tempdirs)
+            self.tempdirs.clear()
+        for path in tempdirs:
+            shutil.rmtree(path)
+        log.debug(f"Cleaned up {len(tempdirs)} temporary directories.")
+
+    def close(self) -> None:
+        """Runs the exit hooks, and removes the temporary directories."""
+        with self.lock:
+            hooks = list(reversed(self._exit_hooks))
+            self._exit_hooks.clear()
+        with activate(self):
+            for hook in hooks:
+                hook()
+        self.remove_tempdirs()
+
+    def __enter__(self) -> "SynthContext":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _close_default() -> None:
+    # The streams behind the log handlers may already be closed by now, so
+    # the exit hooks and the cleanup don't log.
+    log.logger.disabled = True
+    _default.close()
+
+
+_default = SynthContext()
+atexit.register(_close_default)
+
+if contextvars is not None:
+    _current_var: "contextvars.ContextVar[Optional[SynthContext]]" = (
+        contextvars.ContextVar("synthtool_context", default=None)
+    )
+else:
+    _local = threading.local()
+
+
+def default() -> SynthContext:
+    """Returns the process's default context."""
+    return _default
+
+
+def current() -> SynthContext:
+    """Returns the context activated in this thread, or the default one."""
+    if contextvars is not None:
+        context = _current_var.get()
+    else:
+        context = getattr(_local, "context", None)
+    return _default if context is None else context
+
+
+@contextlib.contextmanager
+def activate(context: SynthContext) -> Iterator[SynthContext]:
+    """Makes ``context`` the current context within the block."""
+    if contextvars is not None:
+        token = _current_var.set(context)
+        try:
+            yield context
+        finally:
+            _current_var.reset(token)
+    else:
+        previous = getattr(_local, "context", None)
+        _local.context = context
+        try:
+            yield context
+        finally:
+            _local.context = previous
+
+
+def bind(func: Callable) -> Callable:
+    """Returns func, made to run in the current context from any thread. For
+    the functions handed to thread pools, which start out in the default
+    context."""
+    context = current()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with activate(context):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,181 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The synthtool daemon, see `synthtool daemon` and `synthtool --use-daemon`.
+
+The daemon imports synthtool and the generators (jinja2, protobuf, yaml,
+...) and compiles the bundled templates once, and listens on a Unix socket.
+`synthtool --use-daemon` sends it the job instead of running the synth
+itself (see synthtool_client, which does so without importing synthtool):
+its working directory, its arguments, its environment, and its stdin,
+stdout and stderr. The daemon
+forks a child per job, which runs the synth with those file descriptors in
+a SynthContext of its own, so jobs don't see each other's state; the
+child's exit code is sent back as the job's. Children start from the
+daemon's memory, compiled templates included, but what they cache in turn
+goes away with them (the on-disk caches are shared, as usual).
+
+Module-level settings, such as SYNTHTOOL_GOOGLEAPIS, are read at import, so
+a job whose SYNTHTOOL_* or AUTOSYNTH_* variables differ from the daemon's is
+refused, and run locally by the client instead.
+"""
+
+import array
+import importlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import traceback
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import synthtool_client
+from synthtool import context
+from synthtool import lock
+from synthtool import log
+
+# Imported by the daemon before it forks any job.
+_PRELOADED_MODULES = [
+    "synthtool.__main__",
+    "synthtool.gcp",
+    "synthtool.languages.java",
+    "synthtool.languages.node",
+    "synthtool.languages.ruby",
+]
+_ENV_PREFIXES = ("SYNTHTOOL_", "AUTOSYNTH_")
+
+
+def _settings(env: Dict[str, str]) -> Dict[str, str]:
+    return {
+        name: value
+        for name, value in env.items()
+        if name.startswith(_ENV_PREFIXES) and name != synthtool_client.SOCKET_ENV
+    }
+
+
+def _receive_job(connection: socket.socket) -> Tuple[Dict[str, Any], List[int]]:
+    fds = array.array("i")
+    data, ancillary, _, _ = connection.recvmsg(
+        65536, socket.CMSG_LEN(len(synthtool_client.STANDARD_FDS) * fds.itemsize)
+    )
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[: len(payload) - (len(payload) % fds.itemsize)])
+    return (
+        json.loads(synthtool_client.read_line(connection, data).decode("utf-8")),
+        list(fds),
+    )
+
+
+def _run_job(job: Dict[str, Any], fds: Sequence[int]) -> int:
+    """Runs a job in this (forked) process, and returns its exit code."""
+    import click
+    from synthtool import __main__
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for target, fd in zip(synthtool_client.STANDARD_FDS, fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    os.chdir(job["cwd"])
+    os.environ.clear()
+    os.environ.update(job["env"])
+    context.default().forget_inherited()
+
+    with context.SynthContext() as synth_context:
+        with context.activate(synth_context):
+            try:
+                __main__.main.main(
+                    job["args"], prog_name="synthtool", standalone_mode=False
+                )
+                exit_code = 0
+            except click.ClickException as exc:
+                exc.show()
+                exit_code = exc.exit_code
+            except SystemExit as exc:
+                exit_code = exc.code if isinstance(exc.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+
+    # This process exits without running atexit hooks, see ForkingMixIn.
+    lock.write()
+    context.default().close()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return exit_code
+
+
+class _JobHandler(socketserver.BaseRequestHandler):
+    server: "_Server"
+
+    def handle(self):
+        job, fds = _receive_job(self.request)
+        if len(fds) != len(synthtool_client.STANDARD_FDS):
+            error = "the job's stdio wasn't received"
+        elif _settings(job["env"]) != self.server.settings:
+            error = "its SYNTHTOOL_* settings differ from the daemon's"
+        else:
+            synthtool_client.send(self.request, {"exit_code": _run_job(job, fds)})
+            return
+
+        for fd in fds:
+            os.close(fd)
+        synthtool_client.send(self.request, {"error": error})
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def __init__(self, socket_path: Path):
+        self.settings = _settings(dict(os.environ))
+        super().__init__(str(socket_path), _JobHandler)
+
+
+def _is_listening(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def serve(socket_path: Optional[Path] = None) -> None:
+    """Runs the daemon until interrupted."""
+    if socket_path is None:
+        socket_path = synthtool_client.get_socket_path()
+
+    for module in _PRELOADED_MODULES:
+        importlib.import_module(module)
+    from synthtool.gcp import common
+
+    common.preload_templates()
+
+    if socket_path.exists():
+        if _is_listening(socket_path):
+            raise RuntimeError(f"A daemon is already listening on {socket_path}.")
+        socket_path.unlink()
+
+    server = _Server(socket_path)
+    log.success(f"Listening on {socket_path}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        socket_path.unlink()
@@ -0,0 +1,196 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks whether a synth's inputs changed since its last run.
+
+The previous run's synth.metadata lists the sources it used: git commits,
+generator images and template versions. If that run succeeded, each source
+still resolves to the same thing, and no file of the repository changed
+since (synth.py, but also the samples, .repo-metadata.json and others that
+templates read), running it again would produce the same output. Inputs that
+aren't recorded, such as a local googleapis or generator, always count as
+changed.
+"""
+
+import concurrent.futures
+import os
+from typing import List, Optional, Tuple
+
+import google.protobuf.json_format
+
+from synthtool import lock
+from synthtool import shell
+from synthtool.protos import metadata_pb2
+from synthtool.sources import git
+
+
+def _git_changed(source: metadata_pb2.GitSource) -> Optional[str]:
+    if not source.remote or not source.sha:
+        return f"the {source.name} git source wasn't fully recorded"
+
+    # git.clone() checks out master by default. Running --locked, this is
+    # the commit in synth.lock.
+    try:
+        sha = git.get_remote_sha(source.remote)
+    except RuntimeError as exc:
+        return str(exc)
+    if sha is None:
+        return f"unable to resolve {source.remote}"
+    if sha != source.sha:
+        return f"{source.name} moved from {source.sha}"
+    return None
+
+
+def _generator_changed(source: metadata_pb2.GeneratorSource) -> Optional[str]:
+    from synthtool.gcp import artman
+    from synthtool.gcp import docker
+
+    if not source.docker_image:
+        return f"the {source.name} generator has no recorded image"
+
+    if source.name == "artman":
+        image = artman.ARTMAN_IMAGE
+    else:
+        repository = source.docker_image.split("@", 1)[0]
+        image = f"{repository}:{source.version or 'latest'}"
+
+    if lock.is_locked():
+        try:
+            digest: Optional[str] = lock.image_digest(image)
+        except RuntimeError as exc:
+            return str(exc)
+    else:
+        # Only the digest resolved by a recent run is trusted, see docker.pull().
+        digest = docker.cached_digest(image)
+        if digest is None:
+            return f"{image} wasn't resolved recently"
+    if digest != source.docker_image:
+        return f"{image} moved from {source.docker_image}"
+    return None
+
+
+def _template_changed(source: metadata_pb2.TemplateSource) -> Optional[str]:
+    from synthtool import __main__
+
+    if source.version != __main__.VERSION:
+        return f"the {source.name} templates changed from version {source.version}"
+    return None
+
+
+def _last_commit_time(path: str) -> int:
+    if os.path.isdir(path):
+        cwd, name = path, "."
+    else:
+        cwd, name = os.path.dirname(path), os.path.basename(path)
+    result = shell.run(
+        ["git", "log", "-1", "--format=%ct", "--", name], cwd=cwd, check=False
+    )
+    return int(result.stdout.strip() or 0) if result.returncode == 0 else 0
+
+
+def _last_modified(directory: str, metadata_file: str) -> float:
+    """The latest mtime of the files under ``directory``, other than
+    ``metadata_file`` and those in hidden directories such as .git."""
+    latest = 0.0
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for name in files:
+            path = os.path.join(root, name)
+            if path != metadata_file:
+                latest = max(latest, os.stat(path).st_mtime)
+    return latest
+
+
+def _uncommitted_files(directory: str) -> Optional[List[str]]:
+    """The changed and untracked files under ``directory``, relative to it.
+    None if it isn't in a git repository."""
+    changed = shell.run(
+        ["git", "diff", "HEAD", "--name-only", "--relative", "--", "."],
+        cwd=directory,
+        check=False,
+    )
+    if changed.returncode:
+        return None
+    untracked = shell.run(
+        ["git", "ls-files", "--others", "--exclude-standard", "--", "."],
+        cwd=directory,
+        check=False,
+    )
+    return (changed.stdout + untracked.stdout).splitlines()
+
+
+def _repo_changed(directory: str, metadata_file: str) -> bool:
+    """Whether a file in the repository at ``directory`` was changed after
+    synth.metadata was written. Besides synth.py, templates read the
+    repository's own files: samples, .repo-metadata.json, package.json..."""
+    written = os.stat(metadata_file).st_mtime
+    uncommitted = _uncommitted_files(directory)
+    if uncommitted is None:
+        return _last_modified(directory, metadata_file) > written
+
+    # The last run's output is left uncommitted too, but it was written
+    # before synth.metadata.
+    for name in uncommitted:
+        path = os.path.join(directory, name)
+        if not os.path.exists(path) or os.stat(path).st_mtime > written:
+            return True
+    # Checkouts don't preserve mtimes, so compare commits instead.
+    return _last_commit_time(directory) > _last_commit_time(metadata_file)
+
+
+def check(synth_file: str, metadata_file: str) -> Tuple[bool, str]:
+    """Returns whether the inputs of ``synth_file`` are the same as when
+    ``metadata_file`` was written, and why."""
+    synth_file = os.path.abspath(synth_file)
+    metadata_file = os.path.abspath(metadata_file)
+
+    if not os.path.exists(metadata_file):
+        return False, f"{metadata_file} doesn't exist"
+    if os.environ.get("SYNTHTOOL_GOOGLEAPIS") or os.environ.get("SYNTHTOOL_GENERATOR"):
+        return False, "a local googleapis or generator is used"
+    repo = os.path.dirname(synth_file)
+    if _repo_changed(repo, metadata_file):
+        return False, f"{repo} changed since {metadata_file} was written"
+
+    previous = metadata_pb2.Metadata()
+    with open(metadata_file) as f:
+        google.protobuf.json_format.Parse(
+            f.read(), previous, ignore_unknown_fields=True
+        )
+    if not previous.synth_succeeded:
+        # The sources of a failed run are only those it got to.
+        return False, f"the run that wrote {metadata_file} failed"
+    if not previous.sources:
+        return False, f"{metadata_file} has no sources"
+
+    checks = {
+        "git": _git_changed,
+        "generator": _generator_changed,
+        "template": _template_changed,
+    }
+
+    def changed(source: metadata_pb2.Source) -> Optional[str]:
+        kind = source.WhichOneof("source")
+        if kind is None:
+            return "an unknown source was recorded"
+        return checks[kind](getattr(source, kind))
+
+    # Remotes are resolved concurrently, they are network round trips.
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        reasons = list(executor.map(changed, previous.sources))
+    for reason in reasons:
+        if reason is not None:
+            return False, reason
+
+    return True, f"none of the {len(reasons)} sources in {metadata_file} changed"
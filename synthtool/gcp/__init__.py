@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import batch
 from . import gapic_generator
 from . import gapic_microgenerator
 from . import discogapic_generator
@@ -21,6 +22,7 @@ DiscoGAPICGenerator = discogapic_generator.DiscoGAPICGenerator
 GAPICGenerator = gapic_generator.GAPICGenerator
 GAPICMicrogenerator = gapic_microgenerator.GAPICMicrogenerator
 CommonTemplates = common.CommonTemplates
+GenerationSpec = batch.GenerationSpec
 
 
 __all__ = (
@@ -28,4 +30,5 @@ __all__ = (
     "DiscoGAPICGenerator",
     "GAPICGenerator",
     "GAPICMicrogenerator",
+    "GenerationSpec",
 )
@@ -12,36 +12,61 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import functools
-import json
 import os
 import platform
 import tempfile
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
 
+from synthtool import context
 from synthtool import log
 from synthtool import metadata
 from synthtool import shell
+from synthtool import tmp
+from synthtool.gcp import docker
 
 ARTMAN_VERSION = os.environ.get("SYNTHTOOL_ARTMAN_VERSION", "latest")
+ARTMAN_IMAGE = f"googleapis/artman:{ARTMAN_VERSION}"
+# Set SYNTHTOOL_ARTMAN_WARM_CONTAINER=1 to reuse one artman container for
+# every generation against the same googleapis checkout.
+WARM_CONTAINER = os.environ.get("SYNTHTOOL_ARTMAN_WARM_CONTAINER") == "1"
+
+# Running warm containers, keyed by (image, root_dir, generator_dir).
+_warm_containers: Dict[Tuple[str, str, str], str] = {}
+_warm_containers_lock = threading.Lock()
+
+# Every run() generates into its own directory under this one, which is
+# created on first use and mounted into every artman container.
+_output_root: Optional[Path] = None
+_output_root_lock = threading.Lock()
 
 
 class Artman:
-    def __init__(self):
+    def __init__(self, warm: bool = None):
+        """
+        If warm is true (by default, if SYNTHTOOL_ARTMAN_WARM_CONTAINER=1),
+        artman runs in a long-lived container that is started by the first
+        run() and reached through `docker exec` by the ones after it, instead
+        of a new container per run(). Warm containers are removed at exit.
+        """
         # Docker on mac by default cannot use the default temp file location
         # # instead use the more standard *nix /tmp location\
         if platform.system() == "Darwin":
             tempfile.tempdir = "/tmp"
+        self._warm = WARM_CONTAINER if warm is None else warm
         self._ensure_dependencies_installed()
         self._install_artman()
         self._report_metadata()
 
-    @functools.lru_cache()
     def _docker_image_info(self):
-        result = shell.run(
-            ["docker", "inspect", f"googleapis/artman:{ARTMAN_VERSION}"],
-            hide_output=True,
-        )
-        return json.loads(result.stdout)[0]
+        info = docker.inspect(self._docker_digest)
+        if info is None:
+            raise RuntimeError(
+                f"The artman image {self._docker_digest} is not present."
+            )
+        return info
 
     @property
     def version(self) -> str:
@@ -56,7 +81,7 @@ class Artman:
 
     @property
     def docker_image(self) -> str:
-        return self._docker_image_info()["RepoDigests"][0]
+        return self._docker_digest
 
     def run(
         self, image, root_dir, config, *args, generator_dir=None, generator_args=None
@@ -83,49 +108,20 @@ class Artman:
         Returns:
             The output directory with artman-generated files.
         """
-        container_name = "artman-docker"
-        output_dir = root_dir / "artman-genfiles"
+        # Each run gets its own output directory and container name, so that
+        # runs can happen concurrently, in one process or several.
+        output_root = _get_output_root()
+        output_dir = Path(
+            tempfile.mkdtemp(prefix="artman-genfiles-", dir=str(output_root))
+        )
 
-        additional_flags = []
+        additional_flags = ["--output-dir", str(output_dir)]
 
         if generator_args:
             additional_flags.append(
                 "--generator-args='{}'".format(" ".join(generator_args))
             )
 
-        docker_cmd = ["docker", "run", "--name", container_name, "--rm", "-i"]
-
-        # Environment variables
-        docker_cmd.extend(
-            [
-                "-e",
-                f"HOST_USER_ID={os.getuid()}",
-                "-e",
-                f"HOST_GROUP_ID={os.getgid()}",
-                "-e",
-                "RUNNING_IN_ARTMAN_DOCKER=True",
-            ]
-        )
-
-        # Local directories to mount as volumes (and set working directory -w)
-        docker_cmd.extend(
-            [
-                "-v",
-                f"{root_dir}:{root_dir}",
-                "-v",
-                f"{output_dir}:{output_dir}",
-                "-w",
-                root_dir,
-            ]
-        )
-
-        # Use local copy of GAPIC generator to generate, if path provided
-        if generator_dir:
-            docker_cmd.extend(["-v", f"{generator_dir}:/toolkit"])
-
-        # Run /bin/bash in the image and then provide the shell command to run
-        docker_cmd.extend([image, "/bin/bash", "-c"])
-
         artman_command = " ".join(
             map(
                 str,
@@ -136,7 +132,22 @@ class Artman:
             )
         )
 
-        cmd = docker_cmd + [artman_command]
+        if self._warm:
+            container_name = _warm_container(
+                image, root_dir, output_root, generator_dir
+            )
+            # Unlike `docker run`, this skips the image's entrypoint, which
+            # would switch to HOST_USER_ID; without --user, the generated
+            # files would be owned by root.
+            cmd = ["docker", "exec", "-i", "-w", str(root_dir)]
+            cmd.extend(["--user", f"{os.getuid()}:{os.getgid()}", container_name])
+            cmd.extend(["/bin/bash", "-c", artman_command])
+        else:
+            container_name = _container_name()
+            cmd = ["docker", "run", "--name", container_name, "--rm", "-i"]
+            cmd.extend(_container_options(root_dir, output_root, generator_dir))
+            # Run /bin/bash in the image and then provide the shell command to run
+            cmd.extend([image, "/bin/bash", "-c", artman_command])
 
         shell.run(cmd, cwd=root_dir)
 
@@ -158,12 +169,92 @@ class Artman:
             )
 
     def _install_artman(self):
-        log.debug("Pulling artman image.")
-        shell.run(
-            ["docker", "pull", f"googleapis/artman:{ARTMAN_VERSION}"], hide_output=False
-        )
+        log.debug("Ensuring artman image.")
+        self._docker_digest = docker.pull(ARTMAN_IMAGE)
 
     def _report_metadata(self):
         metadata.add_generator_source(
             name="artman", version=self.version, docker_image=self.docker_image
         )
+
+
+def _get_output_root() -> Path:
+    global _output_root
+    with _output_root_lock:
+        if _output_root is None:
+            # Warm containers outlive the synths (and contexts) that start
+            # them, so their output root lasts as long as the process.
+            with context.activate(context.default()):
+                _output_root = tmp.tmpdir()
+        return _output_root
+
+
+def _container_name() -> str:
+    """Returns a container name that is unique on this host."""
+    return f"artman-{uuid.uuid4().hex[:12]}"
+
+
+def _container_options(root_dir, output_root, generator_dir):
+    """Returns the `docker run` options shared by all artman containers."""
+    # Environment variables
+    options = [
+        "-e",
+        f"HOST_USER_ID={os.getuid()}",
+        "-e",
+        f"HOST_GROUP_ID={os.getgid()}",
+        "-e",
+        "RUNNING_IN_ARTMAN_DOCKER=True",
+    ]
+
+    # Local directories to mount as volumes (and set working directory -w)
+    options.extend(
+        [
+            "-v",
+            f"{root_dir}:{root_dir}",
+            "-v",
+            f"{output_root}:{output_root}",
+            "-w",
+            str(root_dir),
+        ]
+    )
+
+    # Use local copy of GAPIC generator to generate, if path provided
+    if generator_dir:
+        options.extend(["-v", f"{generator_dir}:/toolkit"])
+
+    return options
+
+
+def _warm_container(image, root_dir, output_root, generator_dir) -> str:
+    """Returns the name of the warm artman container for these mounts,
+    starting it if it isn't running yet."""
+    key = (image, str(root_dir), str(generator_dir or ""))
+    with _warm_containers_lock:
+        if key in _warm_containers:
+            return _warm_containers[key]
+
+        container_name = _container_name()
+        log.debug(f"Starting artman container {container_name}.")
+        cmd = ["docker", "run", "--name", container_name, "--rm", "-d"]
+        cmd.extend(_container_options(root_dir, output_root, generator_dir))
+        # Keep the container idle until it is told to generate.
+        cmd.extend([image, "/bin/bash", "-c", "sleep infinity"])
+        shell.run(cmd, cwd=root_dir)
+
+        if not _warm_containers:
+            # Removed with the process's temporary directories, before the
+            # output root they mount.
+            context.default().add_exit_hook(stop_warm_containers)
+        _warm_containers[key] = container_name
+        return container_name
+
+
+def stop_warm_containers() -> None:
+    """Removes all warm artman containers started by this process."""
+    with _warm_containers_lock:
+        container_names = list(_warm_containers.values())
+        _warm_containers.clear()
+
+    if container_names:
+        shell.run(["docker", "rm", "-f"] + container_names, check=False)
+        log.debug(f"Stopped {len(container_names)} artman containers.")
@@ -0,0 +1,72 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batch generation.
+
+Runs many generations of a GAPIC generator concurrently, such as every
+version of an API, while keeping results and metadata in the order given.
+"""
+
+import concurrent.futures
+import os
+from pathlib import Path
+from typing import Any, Callable, List, Mapping, NamedTuple, Sequence
+
+from synthtool import context
+from synthtool import metadata
+
+
+class GenerationSpec(NamedTuple):
+    """A single generation: the arguments of, say, py_library()."""
+
+    service: str
+    version: str
+    language: str
+    # Keyword arguments, such as config_path or proto_path.
+    options: Mapping[str, Any] = {}
+
+
+def generate_many(
+    generate: Callable[..., Path],
+    specs: Sequence[GenerationSpec],
+    max_workers: int = None,
+) -> List[Path]:
+    """Calls generate(service, version, language, **options) for each spec.
+
+    Args:
+        generate: A generator's _generate_code method.
+        specs: What to generate.
+        max_workers: How many generations to run at once, by default the
+            number of CPUs.
+
+    Returns:
+        The generated code directories, in the order of ``specs``. Metadata is
+        recorded in that order too, no matter which generation ends first.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    def run(spec: GenerationSpec):
+        with metadata.capture() as captured:
+            genfiles = generate(
+                spec.service, spec.version, spec.language, **spec.options
+            )
+        return genfiles, captured
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        results = list(executor.map(context.bind(run), specs))
+
+    for _, captured in results:
+        metadata.merge(captured)
+    return [genfiles for genfiles, _ in results]
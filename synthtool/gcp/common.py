@@ -12,61 +12,200 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import collections
+import concurrent.futures
+import copy
 import os
 import re
 import yaml
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Tuple, Union
 
 from synthtool.languages import node
 from synthtool.sources import templates
 from synthtool import __main__
+from synthtool import _async
+from synthtool import _project_files
 from synthtool import _tracked_paths
 from synthtool import metadata
 
 
+PathOrStr = Union[str, Path]
+
 _TEMPLATES_DIR = Path(__file__).parent / "templates"
-_RE_SAMPLE_COMMENT_START = r"\[START \w+_quickstart\w*]"
-_RE_SAMPLE_COMMENT_END = r"\[END \w+_quickstart\w*]"
+# Built into the package by setup.py's build_py, and in development checkouts
+# by `nox -s compile_templates`, see compile_templates(). Without it, the
+# templates are parsed on first use.
+_COMPILED_TEMPLATES_DIR = Path(__file__).parent / "compiled_templates"
+_RE_SAMPLE_FILE = re.compile(r"[\w.]+\.js$")
+_RE_SAMPLE_COMMENT_START = re.compile(r"\[START \w+_quickstart\w*]")
+_RE_SAMPLE_COMMENT_END = re.compile(r"\[END \w+_quickstart\w*]")
+_RE_SAMPLE_METADATA = re.compile(
+    r"(?P<metadata>// *sample-metadata:([^\n]+|\n//)+)", re.DOTALL
+)
+_RE_SAMPLE_METADATA_PREFIX = re.compile(r"((#|//) ?)")
+
+# Scanned samples, keyed by path and validated against (mtime, size).
+_scanned_samples = {}  # type: Dict[str, Tuple[int, int, str, Dict]]
+
+templates.register_precompiled(
+    _TEMPLATES_DIR, _COMPILED_TEMPLATES_DIR, __main__.VERSION
+)
+
+
+def compile_templates(target: Path = _COMPILED_TEMPLATES_DIR) -> None:
+    """
+    precompiles the bundled templates, so that synth runs don't have to parse
+    them. Each template group is compiled separately, as well as the
+    templates directory as a whole (used by CommonTemplates.render).
+    """
+    templates.compile_templates(_TEMPLATES_DIR, target, __main__.VERSION)
+    for directory in sorted(_TEMPLATES_DIR.iterdir()):
+        if directory.is_dir():
+            templates.compile_templates(
+                directory, target / directory.name, __main__.VERSION
+            )
+
+
+def preload_templates() -> None:
+    """
+    compiles the bundled templates in this process, like compile_templates()
+    but in memory, see templates.preload().
+    """
+    templates.preload(_TEMPLATES_DIR)
+    for directory in sorted(_TEMPLATES_DIR.iterdir()):
+        if directory.is_dir():
+            templates.preload(directory)
 
 
 class CommonTemplates:
-    def __init__(self):
+    def __init__(self, destination: Optional[PathOrStr] = None):
+        """
+        If a destination is given, the *_library() methods render straight
+        into it (writing only files whose contents changed) and return it,
+        instead of returning a temporary directory to move() from.
+        """
         self._templates = templates.Templates(_TEMPLATES_DIR)
         self.excludes = []  # type: List[str]
+        self.destination = None if destination is None else Path(destination)
 
-    def _generic_library(self, directory: str, **kwargs) -> Path:
+    def _generic_library(
+        self, directory: str, excludes: List[str] = None, **kwargs
+    ) -> Path:
+        # Excludes are per call, not added to self.excludes, so that the
+        # *_library_async() methods of an instance can run concurrently.
+        excludes = list(self.excludes if excludes is None else excludes)
         # load common repo meta information (metadata that's not language specific).
         if "metadata" in kwargs:
             self._load_generic_metadata(kwargs["metadata"])
             # if no samples were found, don't attempt to render a
             # samples/README.md.
             if not kwargs["metadata"]["samples"]:
-                self.excludes.append("samples/README.md")
+                excludes.append("samples/README.md")
 
-        t = templates.TemplateGroup(_TEMPLATES_DIR / directory, self.excludes)
-        result = t.render(**kwargs)
-        _tracked_paths.add(result)
+        t = templates.TemplateGroup(_TEMPLATES_DIR / directory, excludes)
+        if self.destination is not None:
+            # Already in place; tracking the destination (usually the repo
+            # itself) would make move() copy it onto itself.
+            result = t.render_into(self.destination.resolve(), **kwargs)
+        else:
+            result = t.render(**kwargs)
+            _tracked_paths.add(result)
         metadata.add_template_source(
             name=directory, origin="synthtool.gcp", version=__main__.VERSION
         )
         return result
 
+    def _generic_library_many(
+        self,
+        directory: str,
+        targets: Sequence[Tuple[Path, Dict, List[str]]],
+        max_workers: int = None,
+    ) -> List[Path]:
+        """
+        renders a template group into many packages at once, such as the
+        packages of a monorepo. Each target is a (package directory, template
+        parameters, excludes) tuple; repo metadata is read from the package
+        directory, and the output is rendered straight into it.
+        """
+        # Targets sharing the same excludes share a single TemplateGroup pass.
+        batches = collections.OrderedDict()  # type: Dict[Tuple[str, ...], List]
+        for index, (root, params, excludes) in enumerate(targets):
+            if "metadata" in params:
+                self._load_generic_metadata(params["metadata"], root)
+                if not params["metadata"]["samples"]:
+                    excludes = excludes + ["samples/README.md"]
+            batches.setdefault(tuple(excludes), []).append((index, root, params))
+
+        rendered = {}  # type: Dict[int, Path]
+        for batch_excludes, batch in batches.items():
+            t = templates.TemplateGroup(
+                _TEMPLATES_DIR / directory, list(batch_excludes)
+            )
+            batch_results = t.render_many(
+                [(root, params) for _, root, params in batch], max_workers
+            )
+            for (index, _, _), result in zip(batch, batch_results):
+                rendered[index] = result
+
+        # Rendered in place, so not tracked, see _generic_library.
+        results = [rendered[index] for index in range(len(targets))]
+        metadata.add_template_source(
+            name=directory, origin="synthtool.gcp", version=__main__.VERSION
+        )
+        return results
+
     def py_library(self, **kwargs) -> Path:
         return self._generic_library("python_library", **kwargs)
 
+    def py_library_many(
+        self, targets: Sequence[Tuple[PathOrStr, Dict]], max_workers: int = None
+    ) -> List[Path]:
+        """
+        renders the python_library templates into each of the given
+        (package directory, parameters) pairs. See _generic_library_many.
+        """
+        return self._generic_library_many(
+            "python_library",
+            [
+                (Path(root).resolve(), dict(params), list(self.excludes))
+                for root, params in targets
+            ],
+            max_workers,
+        )
+
     def node_library(self, **kwargs) -> Path:
+        excludes = self._node_library_params(Path("."), kwargs, list(self.excludes))
+        return self._generic_library("node_library", excludes, **kwargs)
+
+    def node_library_many(
+        self, targets: Sequence[Tuple[PathOrStr, Dict]], max_workers: int = None
+    ) -> List[Path]:
+        """
+        renders the node_library templates into each of the given
+        (package directory, parameters) pairs. See _generic_library_many.
+        """
+        jobs = []
+        for root, params in targets:
+            root = Path(root).resolve()
+            params = dict(params)
+            excludes = self._node_library_params(root, params, list(self.excludes))
+            jobs.append((root, params, excludes))
+        return self._generic_library_many("node_library", jobs, max_workers)
+
+    def _node_library_params(
+        self, root: Path, kwargs: Dict, excludes: List[str]
+    ) -> List[str]:
         # TODO: once we've migrated all Node.js repos to either having
         #  .repo-metadata.json, or excluding README.md, we can remove this.
-        if not os.path.exists("./.repo-metadata.json"):
-            self.excludes.append("README.md")
-            if "samples/README.md" not in self.excludes:
-                self.excludes.append("samples/README.md")
+        if _load_repo_metadata(root) is None:
+            excludes.append("README.md")
+            if "samples/README.md" not in excludes:
+                excludes.append("samples/README.md")
 
-        kwargs["metadata"] = node.read_metadata()
+        kwargs["metadata"] = node.read_metadata(str(root))
         kwargs["publish_token"] = node.get_publish_token(kwargs["metadata"]["name"])
-        return self._generic_library("node_library", **kwargs)
+        return excludes
 
     def php_library(self, **kwargs) -> Path:
         return self._generic_library("php_library", **kwargs)
@@ -77,22 +216,38 @@ class CommonTemplates:
             kwargs["metadata"] = {}
         return self._generic_library("ruby_library", **kwargs)
 
+    # Coroutine versions of the *_library() methods, run in the event loop's
+    # executor (see synthtool._async), for synth scripts that await several
+    # generations (or clones, or templates) at once.
+
+    async def py_library_async(self, **kwargs) -> Path:
+        return await _async.call(self.py_library, **kwargs)
+
+    async def node_library_async(self, **kwargs) -> Path:
+        return await _async.call(self.node_library, **kwargs)
+
+    async def php_library_async(self, **kwargs) -> Path:
+        return await _async.call(self.php_library, **kwargs)
+
+    async def ruby_library_async(self, **kwargs) -> Path:
+        return await _async.call(self.ruby_library, **kwargs)
+
     def render(self, template_name: str, **kwargs) -> Path:
         return self._templates.render(template_name, **kwargs)
 
-    def _load_generic_metadata(self, metadata: Dict):
+    def _load_generic_metadata(self, metadata: Dict, root: Path = None):
         """
         loads additional meta information from .repo-metadata.json.
         """
-        self._load_samples(metadata)
-        self._load_partials(metadata)
+        if root is None:
+            root = Path(os.getcwd())
+
+        self._load_samples(metadata, root)
+        self._load_partials(metadata, root)
 
-        metadata["repo"] = {}
-        if os.path.exists("./.repo-metadata.json"):
-            with open("./.repo-metadata.json") as f:
-                metadata["repo"] = json.load(f)
+        metadata["repo"] = _load_repo_metadata(root) or {}
 
-    def _load_samples(self, metadata: Dict):
+    def _load_samples(self, metadata: Dict, root: Path = None):
         """
         walks samples directory and builds up samples data-structure:
 
@@ -101,71 +256,33 @@ class CommonTemplates:
             "file": "requesterPays.js"
         }
         """
+        if root is None:
+            root = Path(os.getcwd())
+
         metadata["samples"] = []
-        samples_dir = Path(os.getcwd()) / "samples"
-        if os.path.exists(samples_dir):
-            files = os.listdir(samples_dir)
-            files.sort()
-            for file in files:
-                if re.match(r"[\w.]+\.js$", file):
-                    if file == "quickstart.js":
-                        metadata["quickstart"] = self._read_quickstart(samples_dir)
-                    # only add quickstart file to samples list if code sample is found.
-                    if file == "quickstart.js" and not metadata.get("quickstart", None):
-                        continue
-                    sample_metadata = {"title": decamelize(file[:-3]), "file": file}
-                    sample_metadata.update(
-                        self._read_sample_metadata_comment(samples_dir, file)
-                    )
-                    metadata["samples"].append(sample_metadata)
-
-    def _read_sample_metadata_comment(self, samples_dir: Path, file: str) -> Dict:
-        """
-        Additional meta-information can be provided through embedded comments:
+        samples_dir = root / "samples"
+        if not os.path.exists(samples_dir):
+            return
 
-        // sample-metadata:
-        //   title: ACL (Access Control)
-        //   description: Demonstrates setting access control rules.
-        //   usage: node iam.js --help
-        """
-        sample_metadata = {}  # type: Dict[str, str]
-        with open(samples_dir / file) as f:
-            contents = f.read()
-            match = re.search(
-                r"(?P<metadata>// *sample-metadata:([^\n]+|\n//)+)", contents, re.DOTALL
+        files = sorted(
+            file for file in os.listdir(samples_dir) if _RE_SAMPLE_FILE.match(file)
+        )
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            scanned = list(
+                executor.map(_scan_sample, (samples_dir / file for file in files))
             )
-            if match:
-                # the metadata yaml is stored in a comments, remove the
-                # prefix so that we can parse the yaml contained.
-                sample_metadata_string = re.sub(
-                    r"((#|//) ?)", "", match.group("metadata")
-                )
-                sample_metadata = yaml.load(
-                    sample_metadata_string, Loader=yaml.SafeLoader
-                )["sample-metadata"]
-        return sample_metadata
-
-    def _read_quickstart(self, samples_dir: Path) -> str:
-        """
-        quickstart is a special case, it should be read from disk and displayed
-        in README.md rather than pushed into samples array.
-        """
-        reading = False
-        quickstart = ""
-
-        with open(samples_dir / "quickstart.js") as f:
-            while True:
-                line = f.readline()
-                if not line or re.search(_RE_SAMPLE_COMMENT_END, line):
-                    break
-                if reading:
-                    quickstart += line
-                if re.search(_RE_SAMPLE_COMMENT_START, line):
-                    reading = True
-
-        return quickstart
-
-    def _load_partials(self, metadata: Dict):
+
+        for file, (quickstart, comment_metadata) in zip(files, scanned):
+            if file == "quickstart.js":
+                metadata["quickstart"] = quickstart
+                # only add quickstart file to samples list if code sample is found.
+                if not quickstart:
+                    continue
+            sample_metadata = {"title": decamelize(file[:-3]), "file": file}
+            sample_metadata.update(comment_metadata)
+            metadata["samples"].append(sample_metadata)
+
+    def _load_partials(self, metadata: Dict, root: Path = None):
         """
         hand-crafted artisinal markdown can be provided in a .readme-partials.yml.
         The following fields are currently supported:
@@ -176,16 +293,74 @@ class CommonTemplates:
         introduction: a more thorough introduction than metadata["description"].
         title: provide markdown to use as a custom title.
         """
-        cwd_path = Path(os.getcwd())
-        partials_file = None
+        if root is None:
+            root = Path(os.getcwd())
+
         for file in [".readme-partials.yml", ".readme-partials.yaml"]:
-            if os.path.exists(cwd_path / file):
-                partials_file = cwd_path / file
+            # An empty file loads as None, and still counts.
+            if (root / file).exists():
+                metadata["partials"] = _project_files.load_yaml(root / file)
                 break
-        if not partials_file:
-            return
-        with open(partials_file) as f:
-            metadata["partials"] = yaml.load(f, Loader=yaml.SafeLoader)
+
+
+def _load_repo_metadata(root: Path) -> Optional[Dict]:
+    """ loads .repo-metadata.json, if the repository has one. """
+    return _project_files.load_json(
+        root / ".repo-metadata.json", validate=_project_files.require_mapping
+    )
+
+
+def _scan_sample(path: Path) -> Tuple[str, Dict]:
+    """
+    reads a sample once, extracting both its quickstart block (the code
+    between the [START ..._quickstart] and [END ..._quickstart] markers,
+    displayed in README.md) and any meta-information provided through an
+    embedded comment:
+
+    // sample-metadata:
+    //   title: ACL (Access Control)
+    //   description: Demonstrates setting access control rules.
+    //   usage: node iam.js --help
+
+    Results are cached until the file's mtime or size changes.
+    """
+    path_stat = path.stat()
+    cached = _scanned_samples.get(str(path))
+    if cached is not None and cached[:2] == (path_stat.st_mtime_ns, path_stat.st_size):
+        return cached[2], copy.deepcopy(cached[3])
+
+    with open(path) as f:
+        contents = f.read()
+
+    quickstart = ""
+    reading = False
+    for line in contents.splitlines(keepends=True):
+        if _RE_SAMPLE_COMMENT_END.search(line):
+            break
+        if reading:
+            quickstart += line
+        if _RE_SAMPLE_COMMENT_START.search(line):
+            reading = True
+
+    sample_metadata = {}  # type: Dict[str, str]
+    match = _RE_SAMPLE_METADATA.search(contents)
+    if match:
+        # the metadata yaml is stored in a comments, remove the
+        # prefix so that we can parse the yaml contained.
+        sample_metadata_string = _RE_SAMPLE_METADATA_PREFIX.sub(
+            "", match.group("metadata")
+        )
+        sample_metadata = yaml.load(
+            sample_metadata_string, Loader=_project_files.YAML_LOADER
+        )["sample-metadata"]
+
+    _scanned_samples[str(path)] = (
+        path_stat.st_mtime_ns,
+        path_stat.st_size,
+        quickstart,
+        sample_metadata,
+    )
+    return quickstart, copy.deepcopy(sample_metadata)
 
 
 def decamelize(value: str):
@@ -0,0 +1,188 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parsed protos, shared by the generator plugins of every language.
+
+protoc parses an API's protos (and everything they import) into a
+FileDescriptorSet once, which is cached by the contents of those protos.
+Each generator plugin is then handed a CodeGeneratorRequest built from it,
+so generating an API for several languages parses its protos only once.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from google.protobuf import descriptor_pb2
+from google.protobuf.compiler import plugin_pb2
+
+from synthtool import cache
+from synthtool import log
+from synthtool import shell
+from synthtool.gcp import generation_cache
+
+# Parsed descriptor sets for this process, keyed like the cache files, along
+# with the hashes of the files they were parsed from.
+_descriptor_sets: Dict[str, Tuple[Dict[str, str], descriptor_pb2.FileDescriptorSet]] = (
+    {}
+)
+_locks: Dict[str, threading.Lock] = collections.defaultdict(threading.Lock)
+_locks_lock = threading.Lock()
+_protoc_version: Optional[str] = None
+
+
+def _get_cache_dir() -> Path:
+    cache_dir = cache.get_cache_dir() / "descriptors"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def _get_protoc_version() -> str:
+    global _protoc_version
+    if _protoc_version is None:
+        _protoc_version = shell.run(["protoc", "--version"]).stdout.strip()
+    return _protoc_version
+
+
+def _hash_sources(
+    googleapis: Path, descriptor_set: descriptor_pb2.FileDescriptorSet
+) -> Dict[str, str]:
+    """Hashes every file of the set found in googleapis. The others, like
+    google/protobuf/*.proto, come with protoc (which is part of the key)."""
+    hashes = {}
+    for proto in descriptor_set.file:
+        path = googleapis / proto.name
+        if path.is_file():
+            hashes[proto.name] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return hashes
+
+
+def _is_current(googleapis: Path, hashes: Mapping[str, str]) -> bool:
+    for name, digest in hashes.items():
+        path = googleapis / name
+        if not path.is_file():
+            return False
+        if hashlib.sha256(path.read_bytes()).hexdigest() != digest:
+            return False
+    return True
+
+
+def _protos(googleapis: Path, proto_path: Path) -> List[str]:
+    return sorted(
+        str(proto.relative_to(googleapis))
+        for proto in (googleapis / proto_path).glob("*.proto")
+    )
+
+
+def descriptor_set(
+    googleapis: Path, proto_path: Path
+) -> descriptor_pb2.FileDescriptorSet:
+    """Returns the parsed protos in ``proto_path`` and all of their imports.
+
+    The key covers the protos in ``proto_path`` and the protoc version; the
+    imports are checked against the hashes recorded when the set was built.
+    """
+    key = generation_cache.make_key(
+        protoc=_get_protoc_version(),
+        proto_path=str(proto_path),
+        inputs=generation_cache.hash_tree(googleapis, [proto_path]),
+    )
+    with _locks_lock:
+        lock = _locks[key]
+
+    with lock:
+        cached = _descriptor_sets.get(key)
+        if cached is not None and _is_current(googleapis, cached[0]):
+            return cached[1]
+
+        cache_file = _get_cache_dir() / f"{key}.pb"
+        hashes_file = _get_cache_dir() / f"{key}.json"
+        try:
+            hashes = json.loads(hashes_file.read_text())
+            if _is_current(googleapis, hashes):
+                result = descriptor_pb2.FileDescriptorSet.FromString(
+                    cache_file.read_bytes()
+                )
+                log.debug(f"Using parsed protos for {proto_path} from the cache.")
+                _descriptor_sets[key] = (hashes, result)
+                return result
+        except (FileNotFoundError, ValueError):
+            pass
+
+        log.debug(f"Parsing protos in {proto_path}.")
+        partial_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        shell.run(
+            [
+                "protoc",
+                f"--proto_path={googleapis}",
+                "--include_imports",
+                "--include_source_info",
+                f"--descriptor_set_out={partial_file}",
+            ]
+            + _protos(googleapis, proto_path),
+            cwd=googleapis,
+        )
+        result = descriptor_pb2.FileDescriptorSet.FromString(partial_file.read_bytes())
+        hashes = _hash_sources(googleapis, result)
+
+        # The hashes go first, so that a set is never read with missing ones.
+        hashes_file.write_text(json.dumps(hashes, indent=2, sort_keys=True))
+        os.replace(str(partial_file), str(cache_file))
+        _descriptor_sets[key] = (hashes, result)
+        return result
+
+
+def run_plugin(
+    plugin: Path,
+    googleapis: Path,
+    proto_path: Path,
+    output_dir: Path,
+    parameter: str = "",
+) -> None:
+    """Generates code for the protos in ``proto_path`` with a protoc plugin,
+    into ``output_dir``, the way `protoc --plugin` would."""
+    request = plugin_pb2.CodeGeneratorRequest(
+        file_to_generate=_protos(googleapis, proto_path), parameter=parameter
+    )
+    request.proto_file.extend(descriptor_set(googleapis, proto_path).file)
+
+    result = subprocess.run(
+        [str(plugin)],
+        input=request.SerializeToString(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode:
+        log.error(f"Failed executing {plugin}:\n\n{result.stderr.decode('utf-8')}")
+        raise subprocess.CalledProcessError(
+            result.returncode, result.args, result.stdout, result.stderr
+        )
+
+    response = plugin_pb2.CodeGeneratorResponse.FromString(result.stdout)
+    if response.error:
+        raise RuntimeError(f"{plugin} failed: {response.error}")
+
+    for generated in response.file:
+        if generated.insertion_point:
+            raise RuntimeError(
+                f"{plugin} uses insertion points, which aren't supported."
+            )
+        path = output_dir / generated.name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(generated.content.encode("utf-8"))
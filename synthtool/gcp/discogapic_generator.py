@@ -27,6 +27,7 @@ DISCOVERY_ARTIFACT_MANAGER_URL: str = git.make_repo_clone_url(
 class DiscoGAPICGenerator:
     def __init__(self):
         self._clone_discovery_artifact_manager()
+        self._artman = None
 
     def py_library(self, service: str, version: str, **kwargs) -> Path:
         """
@@ -91,8 +92,10 @@ class DiscoGAPICGenerator:
             )
 
         log.debug(f"Running generator for {config_path}.")
-        output_root = artman.Artman().run(
-            f"googleapis/artman:{artman.ARTMAN_VERSION}",
+        if self._artman is None:
+            self._artman = artman.Artman()
+        output_root = self._artman.run(
+            self._artman.docker_image,
             self.discovery_artifact_manager,
             config_path,
             gapic_language_arg,
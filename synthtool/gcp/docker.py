@@ -0,0 +1,165 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Docker image resolution.
+
+Pulling an image is a registry round trip even when nothing changed, so
+this remembers which digest each image resolved to, and when. Within the
+TTL, an image that is still present locally at that digest isn't pulled
+again; neither is an image pinned by digest that is already present.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from synthtool import cache
+from synthtool import lock
+from synthtool import log
+from synthtool import shell
+
+# How long, in seconds, a resolved tag is trusted before pulling again.
+IMAGE_TTL = int(os.environ.get("SYNTHTOOL_DOCKER_IMAGE_TTL", 60 * 60))
+
+# `docker image inspect` results for this process.
+_inspected: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+
+def _get_cache_file():
+    return cache.get_cache_dir() / "docker-images.json"
+
+
+def _read_cache() -> Dict[str, Dict[str, Any]]:
+    try:
+        return json.loads(_get_cache_file().read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_cache(entries: Dict[str, Dict[str, Any]]) -> None:
+    cache_file = _get_cache_file()
+    partial_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    partial_file.write_text(json.dumps(entries, indent=2, sort_keys=True))
+    os.replace(str(partial_file), str(cache_file))
+
+
+def _repo_digest(image: str, info: Dict[str, Any]) -> str:
+    """Picks the digest reference (repo@sha256:...) matching ``image``."""
+    repository = image.split("@", 1)[0]
+    if ":" in repository.rsplit("/", 1)[-1]:
+        repository = repository.rsplit(":", 1)[0]
+
+    repo_digests = info.get("RepoDigests") or []
+    for repo_digest in repo_digests:
+        if repo_digest.split("@", 1)[0] == repository:
+            return repo_digest
+    if repo_digests:
+        return repo_digests[0]
+    return info["Id"]
+
+
+def inspect(image: str) -> Optional[Dict[str, Any]]:
+    """Returns the local image's `docker image inspect` info, or None if the
+    image isn't present locally."""
+    with _lock:
+        if image in _inspected:
+            return _inspected[image]
+
+    result = shell.run(["docker", "image", "inspect", image], check=False)
+    if result.returncode:
+        return None
+
+    info = json.loads(result.stdout)[0]
+    with _lock:
+        _inspected[image] = info
+    return info
+
+
+def cached_digest(image: str, ttl: int = None) -> Optional[str]:
+    """Returns the digest ``image`` last resolved to, if that was within the
+    TTL. Doesn't touch docker or the network."""
+    if ttl is None:
+        ttl = IMAGE_TTL
+
+    entry = _read_cache().get(image)
+    if entry is None or time.time() - entry["resolved"] >= ttl:
+        return None
+    return entry["digest"]
+
+
+def pull(image: str, ttl: int = None) -> str:
+    """Makes sure ``image`` is present locally, pulling only if needed.
+
+    Args:
+        image: An image reference, by tag or by digest.
+        ttl: How long, in seconds, to trust a previous resolution of a tag.
+            Defaults to IMAGE_TTL (SYNTHTOOL_DOCKER_IMAGE_TTL).
+
+    Returns:
+        The digest reference (repo@sha256:...) of the image.
+    """
+    digest = _pull(image, ttl)
+    # Whichever way it was resolved, so that --update-lock records it.
+    lock.record_image_digest(image, digest)
+    return digest
+
+
+def _pull(image: str, ttl: Optional[int]) -> str:
+    locked_digest = lock.image_digest(image)
+    if locked_digest is not None:
+        return _pull_locked(image, locked_digest)
+
+    if "@" in image:
+        info = inspect(image)
+        if info is not None:
+            log.debug(f"Image {image} is already present, not pulling.")
+            return _repo_digest(image, info)
+    else:
+        digest = cached_digest(image, ttl)
+        info = inspect(image)
+        if (
+            digest is not None
+            and info is not None
+            and digest in (info.get("RepoDigests") or [])
+        ):
+            log.debug(f"Image {image} resolved to {digest} recently, not pulling.")
+            return digest
+
+    log.debug(f"Pulling Docker image: {image}")
+    shell.run(["docker", "pull", image], hide_output=False)
+
+    with _lock:
+        _inspected.pop(image, None)
+    info = inspect(image)
+    if info is None:
+        raise RuntimeError(f"Pulled {image}, but docker can't find it.")
+
+    digest = _repo_digest(image, info)
+    if "@" not in image:
+        with _lock:
+            entries = _read_cache()
+            entries[image] = {"digest": digest, "resolved": time.time()}
+            _write_cache(entries)
+    return digest
+
+
+def _pull_locked(image: str, digest: str) -> str:
+    """Makes sure the digest locked for ``image`` is present locally."""
+    if inspect(digest) is None:
+        log.debug(f"Pulling Docker image: {digest} (locked for {image})")
+        shell.run(["docker", "pull", digest], hide_output=False)
+    return digest
@@ -13,13 +13,21 @@
 # limitations under the License.
 
 import os
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Sequence
 
+import yaml
+
+from synthtool import _async
 from synthtool import _tracked_paths
 from synthtool import log
 from synthtool import metadata
+from synthtool import pipeline
 from synthtool.gcp import artman
+from synthtool.gcp import batch
+from synthtool.gcp import generation_cache
+from synthtool.gcp import proto_index
 from synthtool.sources import git
 
 GOOGLEAPIS_URL: str = git.make_repo_clone_url("googleapis/googleapis")
@@ -32,6 +40,8 @@ class GAPICGenerator:
     def __init__(self):
         self._googleapis = None
         self._googleapis_private = None
+        # Guards the clones, generate_many() generates from several threads.
+        self._clone_lock = threading.Lock()
         self._artman = artman.Artman()
 
     def py_library(self, service: str, version: str, **kwargs) -> Path:
@@ -57,6 +67,27 @@ class GAPICGenerator:
     def java_library(self, service: str, version: str, **kwargs) -> Path:
         return self._generate_code(service, version, "java", **kwargs)
 
+    # Coroutine versions of the *_library() methods, run in the event loop's
+    # executor (see synthtool._async), for synth scripts that await several
+    # generations (or clones, or templates) at once.
+
+    async def py_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.py_library, service, version, **kwargs)
+
+    async def node_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.node_library, service, version, **kwargs)
+
+    nodejs_library_async = node_library_async
+
+    async def ruby_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.ruby_library, service, version, **kwargs)
+
+    async def php_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.php_library, service, version, **kwargs)
+
+    async def java_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.java_library, service, version, **kwargs)
+
     def _generate_code(
         self,
         service,
@@ -100,43 +131,54 @@ class GAPICGenerator:
 
         # Run the code generator.
         # $ artman --config path/to/artman_api.yaml generate python_gapic
-        if config_path is None:
-            config_path = (
-                Path("google/cloud") / service / f"artman_{service}_{version}.yaml"
-            )
-        elif Path(config_path).is_absolute():
-            config_path = Path(config_path).relative_to("/")
-        else:
-            config_path = Path("google/cloud") / service / Path(config_path)
+        config_path = _config_path(service, version, config_path)
 
         if not (googleapis / config_path).exists():
             raise FileNotFoundError(
                 f"Unable to find configuration yaml file: {(googleapis / config_path)}."
             )
 
-        log.debug(f"Running generator for {config_path}.")
-
-        output_root = self._artman.run(
-            f"googleapis/artman:{artman.ARTMAN_VERSION}",
-            googleapis,
-            config_path,
-            gapic_language_arg,
-            generator_dir=generator_dir,
-            generator_args=generator_args,
-        )
-
         # Expect the output to be in the artman-genfiles directory.
         # example: /artman-genfiles/python/speech-v1
         if artman_output_name is None:
             artman_output_name = f"{service}-{version}"
-        genfiles = output_root / gen_language / artman_output_name
 
-        if not genfiles.exists():
-            raise FileNotFoundError(
-                f"Unable to find generated output of artman: {genfiles}."
+        # Generation is deterministic, so if this exact generation (same
+        # image, inputs and options) ran before, restore its output instead.
+        # Local generators are under development, so are never cached.
+        cache_key = None
+        cache_status = ""
+        genfiles = None
+        if generator_dir is None and generation_cache.ENABLED:
+            cache_key = self._make_cache_key(
+                googleapis, config_path, language, artman_output_name, generator_args
             )
+            genfiles = generation_cache.restore(cache_key)
+            cache_status = "miss" if genfiles is None else "hit"
+
+        if genfiles is None:
+            log.debug(f"Running generator for {config_path}.")
+
+            output_root = self._artman.run(
+                self._artman.docker_image,
+                googleapis,
+                config_path,
+                gapic_language_arg,
+                generator_dir=generator_dir,
+                generator_args=generator_args,
+            )
+
+            genfiles = output_root / gen_language / artman_output_name
 
-        log.success(f"Generated code into {genfiles}.")
+            if not genfiles.exists():
+                raise FileNotFoundError(
+                    f"Unable to find generated output of artman: {genfiles}."
+                )
+
+            log.success(f"Generated code into {genfiles}.")
+
+            if cache_key is not None:
+                generation_cache.store(cache_key, genfiles)
 
         # Get the *.protos files and put them in a protos dir in the output
         if include_protos:
@@ -165,37 +207,145 @@ class GAPICGenerator:
             language=language,
             generator="gapic",
             config=str(config_path),
+            generation_cache=cache_status,
         )
 
         _tracked_paths.add(genfiles)
         return genfiles
 
+    def _make_cache_key(
+        self, googleapis, config_path, language, artman_output_name, generator_args
+    ) -> str:
+        return generation_cache.make_key(
+            generator="artman",
+            image=self._artman.docker_image,
+            inputs=generation_cache.hash_tree(
+                googleapis, _artman_inputs(googleapis, config_path)
+            ),
+            language=language,
+            config=str(config_path),
+            generator_args=generator_args,
+            output_name=artman_output_name,
+        )
+
+    def generation_state(
+        self,
+        service,
+        version,
+        language,
+        config_path=None,
+        artman_output_name=None,
+        private=False,
+        include_protos=False,
+        generator_args=None,
+    ) -> Optional[str]:
+        """
+        returns what the output of _generate_code() with these arguments
+        depends on beyond them, the artman image and the googleapis files it
+        reads, as a key of the generation cache. None with a local generator,
+        whose output can't be known in advance.
+        """
+        if LOCAL_GENERATOR is not None:
+            return None
+        if not private:
+            googleapis = self._clone_googleapis()
+        else:
+            googleapis = self._clone_googleapis_private()
+        config_path = _config_path(service, version, config_path)
+        if googleapis is None or not (googleapis / config_path).exists():
+            return None
+        return self._make_cache_key(
+            googleapis,
+            config_path,
+            language,
+            artman_output_name or f"{service}-{version}",
+            generator_args,
+        )
+
+    def generate_many(
+        self, specs: Sequence[batch.GenerationSpec], max_workers: int = None
+    ) -> List[Path]:
+        """
+        runs many generations concurrently, such as every version of an API,
+        and returns their output directories in the order of ``specs``.
+        See batch.generate_many.
+        """
+        return batch.generate_many(self._generate_code, specs, max_workers)
+
     def _clone_googleapis(self):
-        if self._googleapis is not None:
-            return self._googleapis
+        with self._clone_lock:
+            if self._googleapis is not None:
+                return self._googleapis
 
-        if LOCAL_GOOGLEAPIS:
-            self._googleapis = Path(LOCAL_GOOGLEAPIS).expanduser()
-            log.debug(f"Using local googleapis at {self._googleapis}")
+            if LOCAL_GOOGLEAPIS:
+                self._googleapis = Path(LOCAL_GOOGLEAPIS).expanduser()
+                log.debug(f"Using local googleapis at {self._googleapis}")
 
-        else:
-            log.debug("Cloning googleapis.")
-            self._googleapis = git.clone(GOOGLEAPIS_URL, depth=1)
+            else:
+                log.debug("Cloning googleapis.")
+                self._googleapis = git.clone(GOOGLEAPIS_URL, depth=1)
 
-        return self._googleapis
+            return self._googleapis
 
     def _clone_googleapis_private(self):
-        if self._googleapis_private is not None:
-            return self._googleapis_private
+        with self._clone_lock:
+            if self._googleapis_private is not None:
+                return self._googleapis_private
 
-        if LOCAL_GOOGLEAPIS:
-            self._googleapis_private = Path(LOCAL_GOOGLEAPIS).expanduser()
-            log.debug(
-                f"Using local googleapis at {self._googleapis_private} for googleapis-private"
-            )
+            if LOCAL_GOOGLEAPIS:
+                self._googleapis_private = Path(LOCAL_GOOGLEAPIS).expanduser()
+                log.debug(
+                    f"Using local googleapis at {self._googleapis_private} for googleapis-private"
+                )
+
+            else:
+                log.debug("Cloning googleapis-private.")
+                self._googleapis_private = git.clone(GOOGLEAPIS_PRIVATE_URL, depth=1)
+
+            return self._googleapis_private
 
-        else:
-            log.debug("Cloning googleapis-private.")
-            self._googleapis_private = git.clone(GOOGLEAPIS_PRIVATE_URL, depth=1)
 
-        return self._googleapis_private
+# Generations depend on the googleapis files and the image they use.
+pipeline.add_generation_state(
+    {
+        GAPICGenerator.py_library: "python",
+        GAPICGenerator.node_library: "nodejs",
+        GAPICGenerator.ruby_library: "ruby",
+        GAPICGenerator.php_library: "php",
+        GAPICGenerator.java_library: "java",
+    }
+)
+
+
+def _config_path(service, version, config_path) -> Path:
+    """Returns the artman configuration's path relative to googleapis."""
+    if config_path is None:
+        return Path("google/cloud") / service / f"artman_{service}_{version}.yaml"
+    elif Path(config_path).is_absolute():
+        return Path(config_path).relative_to("/")
+    else:
+        return Path("google/cloud") / service / Path(config_path)
+
+
+def _artman_inputs(googleapis: Path, config_path: Path) -> List[Path]:
+    """Returns the paths, relative to googleapis, that an artman generation
+    reads: the configuration's own directory, any proto paths it names
+    outside of it, and every proto those import."""
+    inputs = [config_path.parent]
+
+    with open(googleapis / config_path) as f:
+        config = yaml.load(f, Loader=yaml.SafeLoader) or {}
+    common = config.get("common") or {}
+    for src_proto_path in common.get("src_proto_paths") or []:
+        path = Path(os.path.normpath(config_path.parent / src_proto_path))
+        if not path.parts or path.parts[0] == "..":
+            continue
+        if config_path.parent not in path.parents:
+            inputs.append(path)
+
+    imports = [
+        Path(proto)
+        for proto in proto_index.import_closure(googleapis, inputs)
+        if not any(directory in Path(proto).parents for directory in inputs)
+    ]
+    return inputs + imports
@@ -13,20 +13,33 @@
 # limitations under the License.
 
 from pathlib import Path
-from typing import Mapping, Optional, Union
+from typing import List, Mapping, Optional, Sequence, Set, Tuple, Union
 import os
 import platform
+import shutil
 import tempfile
+import threading
 
+from synthtool import _async
 from synthtool import _tracked_paths
 from synthtool import log
 from synthtool import metadata
+from synthtool import pipeline
 from synthtool import shell
+from synthtool.gcp import batch
+from synthtool.gcp import descriptors
+from synthtool.gcp import docker
+from synthtool.gcp import generation_cache
+from synthtool.gcp import proto_index
 from synthtool.sources import git
 
 GOOGLEAPIS_URL: str = git.make_repo_clone_url("googleapis/googleapis")
 GOOGLEAPIS_PRIVATE_URL: str = git.make_repo_clone_url("googleapis/googleapis-private")
 LOCAL_GOOGLEAPIS: Optional[str] = os.environ.get("SYNTHTOOL_GOOGLEAPIS")
+# How generators run: "docker" runs the published generator images, "native"
+# runs protoc with locally installed generator plugins.
+BACKEND: str = os.environ.get("SYNTHTOOL_GAPIC_BACKEND", "docker")
+BACKENDS = ("docker", "native")
 
 
 class GAPICMicrogenerator:
@@ -36,14 +49,29 @@ class GAPICMicrogenerator:
     generation specification defined at https://aip.dev/client-libraries
     """
 
-    def __init__(self):
+    def __init__(self, backend: str = None, plugins: Mapping[str, str] = None):
+        """
+        backend: "docker" (the default, or SYNTHTOOL_GAPIC_BACKEND) or
+          "native". The native backend parses the protos in the googleapis
+          checkout with protoc, and runs the plugins itself, without docker.
+        plugins: maps languages to the generator plugins used by the native
+          backend, 'python': '/usr/local/bin/protoc-gen-python_gapic'. By
+          default, it is read from SYNTHTOOL_GAPIC_GENERATOR_{LANGUAGE}.
+        """
         # Docker on mac by default cannot use the default temp file location
         # instead use the more standard *nix /tmp location.
         if platform.system() == "Darwin":
             tempfile.tempdir = "/tmp"
+        self._backend = backend or BACKEND
+        if self._backend not in BACKENDS:
+            raise ValueError(f"Unknown generator backend: {self._backend}.")
+        self._plugins = dict(plugins or {})
         self._ensure_dependencies_installed()
         self._googleapis = None
         self._googleapis_private = None
+        # Guards the clones, generate_many() generates from several threads.
+        self._clone_lock = threading.Lock()
+        self._reported_generators: Set[Tuple[str, str, str]] = set()
 
     def py_library(self, service: str, version: str, **kwargs) -> Path:
         """
@@ -60,6 +88,19 @@ class GAPICMicrogenerator:
     def kotlin_library(self, service: str, version: str, **kwargs) -> Path:
         return self._generate_code(service, version, "kotlin", **kwargs)
 
+    # Coroutine versions of the *_library() methods, run in the event loop's
+    # executor (see synthtool._async), for synth scripts that await several
+    # generations (or clones, or templates) at once.
+
+    async def py_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.py_library, service, version, **kwargs)
+
+    async def go_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.go_library, service, version, **kwargs)
+
+    async def kotlin_library_async(self, service: str, version: str, **kwargs) -> Path:
+        return await _async.call(self.kotlin_library, service, version, **kwargs)
+
     def _generate_code(
         self,
         service: str,
@@ -86,29 +127,25 @@ class GAPICMicrogenerator:
                 "is unavailable."
             )
 
-        # Pull the code generator for the requested language.
-        # If a code generator version was specified, honor that.
-        log.debug(
-            "Pulling Docker image: gapic-generator-{language}:{generator_version}"
-        )
-        shell.run(
-            [
-                "docker",
-                "pull",
-                f"gcr.io/gapic-images/gapic-generator-{language}:{generator_version}",
-            ],
-            hide_output=False,
-        )
+        if self._backend == "docker":
+            # Pull the code generator for the requested language.
+            # If a code generator version was specified, honor that.
+            image = (
+                f"gcr.io/gapic-images/gapic-generator-{language}:{generator_version}"
+            )
+            image_digest = docker.pull(image)
+            self._report_generator(
+                f"gapic-generator-{language}", generator_version, image_digest
+            )
+        else:
+            plugin = self._find_plugin(language)
+            # Without an image, there's nothing to tell which plugin this was.
+            self._report_generator(f"gapic-generator-{language}", str(plugin), "")
 
         # Determine where the protos we are generating actually live.
         # We can sometimes (but not always) determine this from the service
         # and version; in other cases, the user must provide it outright.
-        if proto_path:
-            proto_path = Path(proto_path)
-            if proto_path.is_absolute():
-                proto_path = proto_path.relative_to("/")
-        else:
-            proto_path = Path("google/cloud") / service / version
+        proto_path = _proto_path(service, version, proto_path)
 
         # Sanity check: Do we have protos where we think we should?
         if not (googleapis / proto_path).exists():
@@ -126,9 +163,100 @@ class GAPICMicrogenerator:
             output_dir = tempfile.mkdtemp()
         output_dir = Path(output_dir).resolve()
 
-        # The time has come, the walrus said, to talk of actually running
-        # the code generator.
-        log.debug(f"Generating code for: {proto_path}.")
+        # The generator only sees the protos in proto_path and their imports,
+        # so if this image already generated code for these exact protos,
+        # restore that instead.
+        # Locally installed plugins may change at any time, so are never cached.
+        cache_key = None
+        cache_status = ""
+        if self._backend == "docker" and generation_cache.ENABLED:
+            cache_key = _make_cache_key(
+                image_digest, googleapis, proto_path, language, generator_args
+            )
+            restored = generation_cache.restore(cache_key, output_dir)
+            cache_status = "miss" if restored is None else "hit"
+
+        if cache_status != "hit":
+            # The time has come, the walrus said, to talk of actually running
+            # the code generator.
+            log.debug(f"Generating code for: {proto_path}.")
+            if self._backend == "docker":
+                self._run_docker(image_digest, googleapis, proto_path, output_dir)
+            else:
+                self._run_native(
+                    plugin, googleapis, proto_path, output_dir, generator_args
+                )
+
+            # Sanity check: Does the output location have code in it?
+            # If not, complain.
+            if not tuple(output_dir.iterdir()):
+                raise RuntimeError(
+                    f"Code generation seemed to succeed, but {output_dir} is empty."
+                )
+
+            # Huzzah, it worked.
+            log.success(f"Generated code into {output_dir}.")
+
+            if cache_key is not None:
+                generation_cache.store(cache_key, output_dir)
+
+        # Record this in the synthtool metadata.
+        metadata.add_client_destination(
+            source="googleapis" if not private else "googleapis-private",
+            api_name=service,
+            api_version=version,
+            language=language,
+            generator=f"gapic-generator-{language}",
+            generation_cache=cache_status,
+        )
+
+        _tracked_paths.add(output_dir)
+        return output_dir
+
+    def generation_state(
+        self,
+        service: str,
+        version: str,
+        language: str,
+        *,
+        private: bool = False,
+        proto_path: Optional[Union[str, Path]] = None,
+        output_dir: Optional[Union[str, Path]] = None,
+        generator_version: str = "latest",
+        generator_args: Optional[Mapping[str, str]] = None,
+    ) -> Optional[str]:
+        """Returns what the output of _generate_code() with these arguments
+        depends on beyond them, the generator image and the googleapis files
+        it reads, as a key of the generation cache. None with the native
+        backend, whose plugins may change at any time."""
+        if self._backend != "docker":
+            return None
+        if not private:
+            googleapis = self._clone_googleapis()
+        else:
+            googleapis = self._clone_googleapis_private()
+        proto_path = _proto_path(service, version, proto_path)
+        if googleapis is None or not (googleapis / proto_path).exists():
+            return None
+        image_digest = docker.pull(
+            f"gcr.io/gapic-images/gapic-generator-{language}:{generator_version}"
+        )
+        return _make_cache_key(
+            image_digest, googleapis, proto_path, language, generator_args
+        )
+
+    def _report_generator(self, name: str, version: str, docker_image: str) -> None:
+        with self._clone_lock:
+            if (name, version, docker_image) in self._reported_generators:
+                return
+            self._reported_generators.add((name, version, docker_image))
+        metadata.add_generator_source(
+            name=name, version=version, docker_image=docker_image
+        )
+
+    def _run_docker(
+        self, image: str, googleapis: Path, proto_path: Path, output_dir: Path
+    ) -> None:
         sep = os.path.sep
         shell.run(
             [
@@ -141,66 +269,92 @@ class GAPICMicrogenerator:
                 "--rm",
                 "--user",
                 str(os.getuid()),
-                f"gcr.io/gapic-images/gapic-generator-{language}",
+                image,
             ]
         )
 
-        # Sanity check: Does the output location have code in it?
-        # If not, complain.
-        if not tuple(output_dir.iterdir()):
-            raise RuntimeError(
-                f"Code generation seemed to succeed, but {output_dir} is empty."
+    def _run_native(
+        self,
+        plugin: Path,
+        googleapis: Path,
+        proto_path: Path,
+        output_dir: Path,
+        generator_args: Optional[Mapping[str, str]],
+    ) -> None:
+        # The protos are parsed once, and the result is shared by every
+        # language generated for them.
+        parameter = ""
+        if generator_args:
+            parameter = ",".join(f"{k}={v}" for k, v in generator_args.items())
+        descriptors.run_plugin(plugin, googleapis, proto_path, output_dir, parameter)
+
+    def _find_plugin(self, language: str) -> Path:
+        """Returns the generator plugin for ``language``, for the native backend."""
+        plugin = self._plugins.get(language) or os.environ.get(
+            f"SYNTHTOOL_GAPIC_GENERATOR_{language.upper()}"
+        )
+        if not plugin:
+            raise EnvironmentError(
+                f"No {language} generator plugin configured, set "
+                f"SYNTHTOOL_GAPIC_GENERATOR_{language.upper()}."
             )
 
-        # Huzzah, it worked.
-        log.success(f"Generated code into {output_dir}.")
-
-        # Record this in the synthtool metadata.
-        metadata.add_client_destination(
-            source="googleapis" if not private else "googleapis-private",
-            api_name=service,
-            api_version=version,
-            language=language,
-            generator=f"gapic-generator-{language}",
-        )
+        found = shutil.which(plugin)
+        if found is None:
+            raise FileNotFoundError(
+                f"Unable to find the {language} generator plugin: {plugin}."
+            )
+        return Path(found)
 
-        _tracked_paths.add(output_dir)
-        return output_dir
+    def generate_many(
+        self, specs: Sequence[batch.GenerationSpec], max_workers: int = None
+    ) -> List[Path]:
+        """
+        runs many generations concurrently, such as every version of an API,
+        and returns their output directories in the order of ``specs``.
+        See batch.generate_many.
+        """
+        return batch.generate_many(self._generate_code, specs, max_workers)
 
     def _clone_googleapis(self):
-        if self._googleapis is not None:
-            return self._googleapis
+        with self._clone_lock:
+            if self._googleapis is not None:
+                return self._googleapis
 
-        if LOCAL_GOOGLEAPIS:
-            self._googleapis = Path(LOCAL_GOOGLEAPIS).expanduser()
-            log.debug(f"Using local googleapis at {self._googleapis}")
+            if LOCAL_GOOGLEAPIS:
+                self._googleapis = Path(LOCAL_GOOGLEAPIS).expanduser()
+                log.debug(f"Using local googleapis at {self._googleapis}")
 
-        else:
-            log.debug("Cloning googleapis.")
-            self._googleapis = git.clone(GOOGLEAPIS_URL, depth=1)
+            else:
+                log.debug("Cloning googleapis.")
+                self._googleapis = git.clone(GOOGLEAPIS_URL, depth=1)
 
-        return self._googleapis
+            return self._googleapis
 
     def _clone_googleapis_private(self):
-        if self._googleapis_private is not None:
-            return self._googleapis_private
+        with self._clone_lock:
+            if self._googleapis_private is not None:
+                return self._googleapis_private
 
-        if LOCAL_GOOGLEAPIS:
-            self._googleapis_private = Path(LOCAL_GOOGLEAPIS).expanduser()
-            log.debug(
-                f"Using local googleapis at {self._googleapis_private} for googleapis-private"
-            )
+            if LOCAL_GOOGLEAPIS:
+                self._googleapis_private = Path(LOCAL_GOOGLEAPIS).expanduser()
+                log.debug(
+                    f"Using local googleapis at {self._googleapis_private} for googleapis-private"
+                )
 
-        else:
-            log.debug("Cloning googleapis-private.")
-            self._googleapis_private = git.clone(GOOGLEAPIS_PRIVATE_URL, depth=1)
+            else:
+                log.debug("Cloning googleapis-private.")
+                self._googleapis_private = git.clone(GOOGLEAPIS_PRIVATE_URL, depth=1)
 
-        return self._googleapis_private
+            return self._googleapis_private
 
     def _ensure_dependencies_installed(self):
         log.debug("Ensuring dependencies.")
 
-        dependencies = ["docker", "git"]
+        if self._backend == "docker":
+            dependencies = ["docker", "git"]
+        else:
+            dependencies = ["protoc", "git"]
         failed_dependencies = []
         for dependency in dependencies:
             return_code = shell.run(["which", dependency], check=False).returncode
@@ -211,3 +365,45 @@ class GAPICMicrogenerator:
             raise EnvironmentError(
                 f"Dependencies missing: {', '.join(failed_dependencies)}"
             )
+
+
+# Generations depend on the googleapis files and the image they use.
+pipeline.add_generation_state(
+    {
+        GAPICMicrogenerator.py_library: "python",
+        GAPICMicrogenerator.go_library: "go",
+        GAPICMicrogenerator.kotlin_library: "kotlin",
+    }
+)
+
+
+def _proto_path(
+    service: str, version: str, proto_path: Optional[Union[str, Path]]
+) -> Path:
+    """Returns the directory of the protos to generate, relative to googleapis."""
+    if proto_path:
+        proto_path = Path(proto_path)
+        if proto_path.is_absolute():
+            proto_path = proto_path.relative_to("/")
+        return proto_path
+    return Path("google/cloud") / service / version
+
+
+def _make_cache_key(
+    image_digest: str,
+    googleapis: Path,
+    proto_path: Path,
+    language: str,
+    generator_args: Optional[Mapping[str, str]],
+) -> str:
+    return generation_cache.make_key(
+        generator=f"gapic-generator-{language}",
+        image=image_digest,
+        inputs=generation_cache.hash_tree(
+            googleapis,
+            [proto_path, *proto_index.import_closure(googleapis, [proto_path])],
+        ),
+        language=language,
+        proto_path=str(proto_path),
+        generator_args=generator_args,
+    )
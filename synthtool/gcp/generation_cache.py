@@ -0,0 +1,130 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generation output cache.
+
+Code generation is the slowest step of most synth runs, and its output is a
+pure function of the generator image and its inputs. Generated code is
+stored under the synthtool cache directory, keyed by a hash of everything
+that went into it, so that an unchanged API can be restored instead of
+starting a container.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Iterable, Optional, Union
+
+from synthtool import cache
+from synthtool import log
+from synthtool import tmp
+
+PathOrStr = Union[str, Path]
+
+# Set SYNTHTOOL_GENERATION_CACHE=0 to always run the generators.
+ENABLED = os.environ.get("SYNTHTOOL_GENERATION_CACHE", "1") != "0"
+
+
+def _get_cache_dir() -> Path:
+    cache_dir = cache.get_cache_dir() / "generated"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def hash_tree(root: Path, paths: Iterable[PathOrStr]) -> str:
+    """Hashes the names and contents of every file under ``paths``, which
+    are relative to ``root``. Paths that don't exist are skipped."""
+    digest = hashlib.sha256()
+    for path in sorted(str(path) for path in paths):
+        top = root / path
+        if top.is_file():
+            files = [top]
+        else:
+            files = sorted(p for p in top.glob("**/*") if p.is_file())
+
+        for file in files:
+            digest.update(str(file.relative_to(root)).encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(hashlib.sha256(file.read_bytes()).digest())
+
+    return digest.hexdigest()
+
+
+def make_key(**parts: Any) -> str:
+    """Builds a cache key out of the given (JSON-serializable) parts."""
+    serialized = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def restore(key: str, destination: PathOrStr = None) -> Optional[Path]:
+    """Copies the output cached under ``key`` into ``destination``.
+
+    Args:
+        key: The cache key, see make_key.
+        destination: Where to restore to, a new temporary directory if not
+            given. It is filled, not replaced, if it already exists.
+
+    Returns:
+        The restored directory, or None on a cache miss.
+    """
+    if not ENABLED:
+        return None
+
+    cached = _get_cache_dir() / key
+    if not cached.is_dir():
+        log.debug(f"Generation cache miss for {key}.")
+        return None
+
+    if destination is None:
+        destination = tmp.tmpdir()
+    destination = Path(destination)
+
+    for entry in cached.iterdir():
+        if entry.is_dir():
+            shutil.copytree(str(entry), str(destination / entry.name), symlinks=True)
+        else:
+            shutil.copy2(str(entry), str(destination / entry.name))
+
+    log.success(f"Restored generated code from the generation cache ({key}).")
+    return destination
+
+
+def store(key: str, source: PathOrStr) -> None:
+    """Stores a copy of the ``source`` directory under ``key``.
+
+    The copy is made next to its final location and renamed into place, so
+    concurrent runs never see a partial entry.
+    """
+    if not ENABLED:
+        return
+
+    cache_dir = _get_cache_dir()
+    cached = cache_dir / key
+    if cached.exists():
+        return
+
+    staging = Path(tempfile.mkdtemp(dir=str(cache_dir), prefix=f".{key}."))
+    try:
+        shutil.copytree(str(source), str(staging / "output"), symlinks=True)
+        os.rename(str(staging / "output"), str(cached))
+        log.debug(f"Stored generated code in the generation cache ({key}).")
+    except OSError:
+        # Most likely another run stored the same key first.
+        if not cached.exists():
+            raise
+    finally:
+        shutil.rmtree(str(staging), ignore_errors=True)
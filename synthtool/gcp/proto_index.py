@@ -0,0 +1,299 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An index of the protos in a googleapis checkout.
+
+Records each proto's package and imports, and which artman configurations
+(and so which API versions) generate from which protos. It is kept in the
+synthtool cache and brought up to date from `git diff` as the checkout
+moves, so that it can tell which APIs a googleapis change affects.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import yaml
+
+from synthtool import cache
+from synthtool import log
+from synthtool import shell
+
+# Bump when the format of the index changes.
+_INDEX_VERSION = 1
+
+_RE_IMPORT = re.compile(r'^\s*import\s+(?:public\s+|weak\s+)?"([^"]+)"\s*;', re.M)
+_RE_PACKAGE = re.compile(r"^\s*package\s+([\w.]+)\s*;", re.M)
+_RE_ARTMAN_CONFIG = re.compile(r"(^|/)artman_[^/]*\.yaml$")
+
+Api = Tuple[str, str]
+
+
+class ProtoIndex:
+    def __init__(
+        self,
+        sha: str,
+        protos: Dict[str, Dict[str, Any]],
+        configs: Dict[str, Dict[str, Any]],
+    ):
+        # The googleapis commit indexed.
+        self.sha = sha
+        # proto path -> {"package": ..., "imports": [...]}
+        self.protos = protos
+        # artman config path -> {"api_name": ..., "api_version": ...,
+        #   "proto_dirs": [...]}
+        self.configs = configs
+
+    def apis(self) -> Set[Api]:
+        """Returns every (service, version) with an artman configuration."""
+        return {
+            (config["api_name"], config["api_version"])
+            for config in self.configs.values()
+        }
+
+    def dependents(self, protos: Iterable[str]) -> Set[str]:
+        """Returns ``protos`` and every proto importing them, directly or not."""
+        importers = {}  # type: Dict[str, List[str]]
+        for name, proto in self.protos.items():
+            for imported in proto["imports"]:
+                importers.setdefault(imported, []).append(name)
+
+        result = set()  # type: Set[str]
+        pending = list(protos)
+        while pending:
+            name = pending.pop()
+            if name not in result:
+                result.add(name)
+                pending.extend(importers.get(name, []))
+        return result
+
+    def affected(self, changed: Iterable[str]) -> Set[Api]:
+        """Returns the (service, version) pairs generated from any of the
+        changed files, or from protos importing them.
+
+        Any file under an API's proto directories counts, not just protos:
+        GAPIC yaml, service yaml and gRPC service configs live there too. So
+        do the files next to its artman configuration.
+        """
+        changed = list(changed)
+        protos = self.dependents(path for path in changed if path.endswith(".proto"))
+        dirs = {posixpath.dirname(path) for path in changed}
+        dirs.update(posixpath.dirname(proto) for proto in protos)
+
+        result = set()
+        for config_path, config in self.configs.items():
+            proto_dirs = config["proto_dirs"]
+            if (
+                posixpath.dirname(config_path) in dirs
+                or any(_is_within(path, proto_dirs) for path in changed)
+                or dirs & set(proto_dirs)
+            ):
+                result.add((config["api_name"], config["api_version"]))
+        return result
+
+    def reindex(self, googleapis: Path, paths: Iterable[str]) -> None:
+        """Updates ``paths`` in the index from the working tree, which may
+        differ from the commit indexed. The index isn't saved."""
+        for path in paths:
+            _index_file(googleapis, path, self)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "version": _INDEX_VERSION,
+            "sha": self.sha,
+            "protos": self.protos,
+            "configs": self.configs,
+        }
+
+
+def _is_within(path: str, directories: Iterable[str]) -> bool:
+    return any(path.startswith(f"{directory}/") for directory in directories)
+
+
+def _parse_proto(path: Path) -> Dict[str, Any]:
+    contents = path.read_text(encoding="utf-8", errors="replace")
+    package = _RE_PACKAGE.search(contents)
+    return {
+        "package": package.group(1) if package else "",
+        "imports": _RE_IMPORT.findall(contents),
+    }
+
+
+def import_closure(googleapis: Path, roots: Iterable[Path]) -> List[str]:
+    """Returns the protos of the checkout that the protos in ``roots`` (files
+    or directories relative to googleapis) import, directly or not, read
+    from the working tree. Imports from outside the checkout, such as
+    google/protobuf/*.proto, are left out."""
+    pending = []
+    for root in roots:
+        top = googleapis / root
+        protos = [top] if top.is_file() else list(top.glob("**/*.proto"))
+        pending.extend(proto.relative_to(googleapis).as_posix() for proto in protos)
+
+    closure = set()  # type: Set[str]
+    while pending:
+        name = pending.pop()
+        if name in closure or not (googleapis / name).is_file():
+            continue
+        closure.add(name)
+        pending.extend(_parse_proto(googleapis / name)["imports"])
+    return sorted(closure)
+
+
+def _parse_config(googleapis: Path, config_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(googleapis / config_path) as f:
+            config = yaml.load(f, Loader=yaml.SafeLoader) or {}
+    except yaml.YAMLError:
+        log.debug(f"Unable to parse {config_path}, not indexing it.")
+        return None
+
+    common = config.get("common") or {}
+    if not common.get("api_name"):
+        return None
+
+    config_dir = posixpath.dirname(config_path)
+    return {
+        "api_name": common["api_name"],
+        "api_version": common.get("api_version", ""),
+        "proto_dirs": sorted(
+            posixpath.normpath(posixpath.join(config_dir, path))
+            for path in common.get("src_proto_paths") or []
+        ),
+    }
+
+
+def _index_file(googleapis: Path, path: str, index: ProtoIndex) -> None:
+    """Adds, updates or removes ``path`` in ``index``."""
+    index.protos.pop(path, None)
+    index.configs.pop(path, None)
+    if not (googleapis / path).is_file():
+        return
+
+    if path.endswith(".proto"):
+        index.protos[path] = _parse_proto(googleapis / path)
+    elif _RE_ARTMAN_CONFIG.search(path):
+        config = _parse_config(googleapis, path)
+        if config is not None:
+            index.configs[path] = config
+
+
+def _head(googleapis: Path) -> str:
+    return shell.run(["git", "rev-parse", "HEAD"], cwd=str(googleapis)).stdout.strip()
+
+
+def changed_files(googleapis: Path, old_sha: str, new_sha: str) -> Optional[List[str]]:
+    """Returns the files changed between two commits, or None if either
+    isn't in the checkout (say, a shallow clone)."""
+    result = shell.run(
+        # Without renames, so that both the old and new names are listed.
+        ["git", "diff", "--name-only", "--no-renames", old_sha, new_sha],
+        cwd=str(googleapis),
+        check=False,
+    )
+    if result.returncode:
+        return None
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def build(googleapis: Path) -> ProtoIndex:
+    """Indexes a googleapis checkout from scratch."""
+    index = ProtoIndex(_head(googleapis), {}, {})
+    for dirpath, dirnames, filenames in os.walk(str(googleapis)):
+        dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith(".")]
+        for filename in filenames:
+            path = Path(dirpath, filename).relative_to(googleapis).as_posix()
+            _index_file(googleapis, path, index)
+    return index
+
+
+def _get_index_file(googleapis: Path) -> Path:
+    checkout = hashlib.sha256(str(googleapis.resolve()).encode("utf-8")).hexdigest()
+    index_dir = cache.get_cache_dir() / "proto-index"
+    index_dir.mkdir(parents=True, exist_ok=True)
+    return index_dir / f"{checkout[:16]}.json"
+
+
+def load(googleapis: Path) -> ProtoIndex:
+    """Returns the index of the checkout at its current commit.
+
+    The index saved for the checkout is updated with just the files changed
+    since the commit it was built at; it is rebuilt if that commit is gone.
+    """
+    index_file = _get_index_file(googleapis)
+    head = _head(googleapis)
+
+    saved = None  # type: Optional[ProtoIndex]
+    try:
+        contents = json.loads(index_file.read_text())
+        if contents.get("version") == _INDEX_VERSION:
+            saved = ProtoIndex(contents["sha"], contents["protos"], contents["configs"])
+    except (FileNotFoundError, ValueError):
+        pass
+
+    if saved is not None and saved.sha == head:
+        return saved
+
+    changed = None
+    if saved is not None:
+        changed = changed_files(googleapis, saved.sha, head)
+
+    if saved is None or changed is None:
+        log.debug(f"Indexing the protos in {googleapis}.")
+        index = build(googleapis)
+    else:
+        log.debug(f"Updating the proto index with {len(changed)} changed files.")
+        index = saved
+        for path in changed:
+            _index_file(googleapis, path, index)
+        index.sha = head
+
+    partial_file = index_file.with_name(f"{index_file.name}.{os.getpid()}.tmp")
+    partial_file.write_text(json.dumps(index.to_json(), sort_keys=True))
+    os.replace(str(partial_file), str(index_file))
+    return index
+
+
+def load_working_tree(googleapis: Path) -> ProtoIndex:
+    """Returns the index of the checkout as it is on disk: the index of its
+    current commit, updated with the files edited, added or removed since.
+    Those aren't saved."""
+    index = load(googleapis)
+    edited = shell.run(
+        ["git", "diff", "--name-only", "--no-renames", "HEAD"], cwd=str(googleapis)
+    ).stdout.splitlines()
+    added = shell.run(
+        ["git", "ls-files", "--others", "--exclude-standard"], cwd=str(googleapis)
+    ).stdout.splitlines()
+    index.reindex(googleapis, [path for path in edited + added if path])
+    return index
+
+
+def affected_apis(googleapis: Path, old_sha: str, new_sha: str = "HEAD") -> Set[Api]:
+    """Returns the (service, version) pairs affected by the changes between
+    two googleapis commits. The checkout should be at ``new_sha``.
+
+    If ``old_sha`` isn't in the checkout (say, a shallow clone), every API is
+    considered affected.
+    """
+    index = load(googleapis)
+    changed = changed_files(googleapis, old_sha, new_sha)
+    if changed is None:
+        log.debug(f"{old_sha} isn't in {googleapis}, all APIs may be affected.")
+        return index.apis()
+    return index.affected(changed)
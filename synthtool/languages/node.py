@@ -12,34 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import os
+from synthtool import _project_files
 from synthtool.sources import git
 
 _REQUIRED_FIELDS = ["name", "repository"]
 
 
-def read_metadata():
+def read_metadata(directory: str = "."):
     """
     read package name and repository in package.json from a Node library.
 
+    Args:
+        directory: Directory of the Node library, defaults to the current one.
     Returns:
         data - package.json file as a dict.
     """
-    with open("./package.json") as f:
-        data = json.load(f)
+    path = os.path.join(directory, "package.json")
+    data = _project_files.load_json(path, validate=_validate_package_json)
+    if data is None:
+        raise FileNotFoundError(f"{path} not found.")
+
+    repo = git.parse_repo_url(data["repository"])
 
-        if not all(key in data for key in _REQUIRED_FIELDS):
-            raise RuntimeError(
-                f"package.json is missing required fields {_REQUIRED_FIELDS}"
-            )
+    data["repository"] = f'{repo["owner"]}/{repo["name"]}'
+    data["repository_name"] = repo["name"]
+    data["lib_install_cmd"] = f'npm install {data["name"]}'
 
-        repo = git.parse_repo_url(data["repository"])
+    return data
 
-        data["repository"] = f'{repo["owner"]}/{repo["name"]}'
-        data["repository_name"] = repo["name"]
-        data["lib_install_cmd"] = f'npm install {data["name"]}'
 
-        return data
+def _validate_package_json(path, data) -> None:
+    _project_files.require_mapping(path, data)
+    if not all(key in data for key in _REQUIRED_FIELDS):
+        raise RuntimeError(
+            f"package.json is missing required fields {_REQUIRED_FIELDS}"
+        )
 
 
 def get_publish_token(package_name: str):
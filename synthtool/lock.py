@@ -0,0 +1,126 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""synth.lock: pinned git commits and docker image digests.
+
+By default, every run resolves branches and image tags (master, latest)
+over the network. With --update-lock, what they resolved to is written to
+synth.lock. With --locked, synth.lock is read instead, and the run uses
+exactly the commits and images it lists, without resolving anything.
+"""
+
+import atexit
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from synthtool import log
+
+# No lock file is used.
+OFF = "off"
+# Sources are resolved as usual, and recorded in the lock file.
+UPDATE = "update"
+# Sources are read from the lock file.
+LOCKED = "locked"
+
+_mode = OFF
+_path: Optional[str] = None
+# git: {url: {committish: sha}}, images: {image: digest}.
+_entries: Dict[str, Dict[str, Any]] = {"git": {}, "images": {}}
+_lock = threading.Lock()
+
+
+def configure(path: str, mode: str) -> None:
+    """Uses the lock file at ``path`` in the given mode for this run."""
+    global _mode, _path
+
+    if mode not in (OFF, UPDATE, LOCKED):
+        raise ValueError(f"Unknown lock mode: {mode}.")
+
+    _mode = mode
+    _path = path
+    _entries["git"].clear()
+    _entries["images"].clear()
+
+    if mode == LOCKED:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} doesn't exist, use --update-lock first.")
+        with open(path) as f:
+            entries = json.load(f)
+        _entries["git"].update(entries.get("git", {}))
+        _entries["images"].update(entries.get("images", {}))
+        log.debug(f"Using the sources locked in {path}.")
+    elif mode == UPDATE:
+        atexit.register(write)
+
+
+def is_locked() -> bool:
+    return _mode == LOCKED
+
+
+def _get(kind: str, key: str, committish: str = None) -> Optional[str]:
+    if _mode != LOCKED:
+        return None
+    with _lock:
+        value = _entries[kind].get(key)
+        if committish is not None:
+            value = value.get(committish) if isinstance(value, dict) else None
+    if not isinstance(value, str):
+        name = key if committish is None else f"{key} at {committish}"
+        raise RuntimeError(f"{name} isn't in {_path}, update it with --update-lock.")
+    return value
+
+
+def git_sha(url: str, committish: str) -> Optional[str]:
+    """Returns the commit locked for the repository at ``committish``, if
+    running --locked."""
+    return _get("git", url, committish)
+
+
+def record_git_sha(url: str, committish: str, sha: str) -> None:
+    if _mode != UPDATE:
+        return
+    with _lock:
+        _entries["git"].setdefault(url, {})[committish] = sha
+
+
+def image_digest(image: str) -> Optional[str]:
+    """Returns the digest locked for the image, if running --locked."""
+    return _get("images", image)
+
+
+def record_image_digest(image: str, digest: str) -> None:
+    if _mode != UPDATE:
+        return
+    with _lock:
+        _entries["images"][image] = digest
+
+
+def write() -> None:
+    """Writes out the lock file, when updating it."""
+    if _mode != UPDATE or _path is None:
+        return
+
+    with _lock:
+        if not any(_entries.values()):
+            # Nothing was resolved, say the synth was skipped or failed early;
+            # keep the lock file as it is.
+            log.debug(f"Nothing to lock, not writing {_path}.")
+            return
+        contents = json.dumps(_entries, indent=2, sort_keys=True)
+    with open(_path, "w") as fh:
+        fh.write(contents + "\n")
+
+    log.debug(f"Wrote lock file to {_path}.")
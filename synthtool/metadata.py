@@ -12,53 +12,98 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import atexit
+import contextlib
 import datetime
 import functools
+import json
+import threading
+import time
+from typing import Iterator
 
 import google.protobuf.json_format
 
+from synthtool import context
 from synthtool import log
 from synthtool.protos import metadata_pb2
 
 
-_metadata = metadata_pb2.Metadata()
+# Set by capture(), for the threads capturing their metadata separately.
+_local = threading.local()
 
 
 def reset() -> None:
     """Clear all metadata so far."""
-    global _metadata
-    _metadata = metadata_pb2.Metadata()
+    current = context.current()
+    with current.lock:
+        current.metadata = metadata_pb2.Metadata()
 
 
 def get():
-    return _metadata
+    return context.current().metadata
+
+
+@contextlib.contextmanager
+def _editing() -> Iterator[metadata_pb2.Metadata]:
+    """Yields the metadata to add to: this thread's captured metadata, or else
+    the current context's, locked."""
+    captured = getattr(_local, "captured", None)
+    if captured is not None:
+        yield captured
+        return
+
+    current = context.current()
+    with current.lock:
+        yield current.metadata
+
+
+@contextlib.contextmanager
+def capture() -> Iterator[metadata_pb2.Metadata]:
+    """Collects the metadata added by this thread into a new message, instead
+    of the current metadata. See merge()."""
+    previous = getattr(_local, "captured", None)
+    _local.captured = metadata_pb2.Metadata()
+    try:
+        yield _local.captured
+    finally:
+        _local.captured = previous
+
+
+def merge(captured: metadata_pb2.Metadata) -> None:
+    """Adds captured metadata to the current metadata."""
+    with _editing() as current:
+        current.MergeFrom(captured)
 
 
 def add_git_source(**kwargs) -> None:
     """Adds a git source to the current metadata."""
-    _metadata.sources.add(git=metadata_pb2.GitSource(**kwargs))
+    with _editing() as current:
+        current.sources.add(git=metadata_pb2.GitSource(**kwargs))
 
 
 def add_generator_source(**kwargs) -> None:
     """Adds a generator source to the current metadata."""
-    _metadata.sources.add(generator=metadata_pb2.GeneratorSource(**kwargs))
+    with _editing() as current:
+        current.sources.add(generator=metadata_pb2.GeneratorSource(**kwargs))
 
 
 def add_template_source(**kwargs) -> None:
     """Adds a template source to the current metadata."""
-    _metadata.sources.add(template=metadata_pb2.TemplateSource(**kwargs))
+    with _editing() as current:
+        current.sources.add(template=metadata_pb2.TemplateSource(**kwargs))
 
 
 def add_client_destination(**kwargs) -> None:
     """Adds a client library destination to the current metadata."""
-    _metadata.destinations.add(client=metadata_pb2.ClientDestination(**kwargs))
+    with _editing() as current:
+        current.destinations.add(client=metadata_pb2.ClientDestination(**kwargs))
 
 
 def write(outfile: str = "synth.metadata") -> None:
     """Writes out the metadata to a file."""
-    _metadata.update_time.FromDatetime(datetime.datetime.utcnow())
-    jsonified = google.protobuf.json_format.MessageToJson(_metadata)
+    current = context.current()
+    with current.lock:
+        current.metadata.update_time.FromDatetime(datetime.datetime.utcnow())
+        jsonified = google.protobuf.json_format.MessageToJson(current.metadata)
 
     with open(outfile, "w") as fh:
         fh.write(jsonified)
@@ -66,5 +111,32 @@ def write(outfile: str = "synth.metadata") -> None:
     log.debug(f"Wrote metadata to {outfile}.")
 
 
+def _recorded_duration(outfile: str) -> float:
+    try:
+        with open(outfile) as fh:
+            return float(json.load(fh).get("synthDuration", 0))
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_at_exit(started: float, outfile: str = "synth.metadata") -> None:
+    current = context.current()
+    if current.succeeded:
+        duration = round(time.monotonic() - started, 1)
+    else:
+        # A failed synth stopped early, its duration would mislead sharding.
+        duration = _recorded_duration(outfile)
+    with current.lock:
+        current.metadata.synth_duration = duration
+        current.metadata.synth_succeeded = current.succeeded
+    write(outfile=outfile)
+
+
 def register_exit_hook(**kwargs) -> None:
-    atexit.register(functools.partial(write, **kwargs))
+    """Writes out the metadata when the current context closes, at exit for
+    the default context, along with whether the synth succeeded (see
+    SynthContext.succeeded) and if so, how long it took since. A failed synth
+    keeps the duration recorded before."""
+    context.current().add_exit_hook(
+        functools.partial(_write_at_exit, time.monotonic(), **kwargs)
+    )
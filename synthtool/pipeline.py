@@ -0,0 +1,497 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synth pipelines.
+
+An optional, declarative alternative to a top-to-bottom synth.py. Steps are
+plain functions (generators, templates, move, replace, ...) along with the
+files they read and write, and the steps whose results they use:
+
+    pipeline = Pipeline()
+    library = pipeline.step(gapic.py_library, "speech", "v1")
+    pipeline.step(s.move, library, outputs=["google/cloud/speech_v1"])
+    pipeline.step(
+        s.replace, "google/cloud/speech_v1/*.py", "before", "after",
+        outputs=["google/cloud/speech_v1"],
+    )
+    pipeline.run()
+
+Independent steps run concurrently. Each step is fingerprinted from its
+function, arguments, input files and the fingerprints of the steps it
+depends on; a step whose fingerprint, outputs and result are unchanged
+since the last run is skipped, and its result and metadata reused. Results
+in temporary directories, such as generated code, are copied next to the
+pipeline's saved state so that the next run can reuse them.
+"""
+
+import concurrent.futures
+import functools
+import hashlib
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Union
+
+from synthtool import _tracked_paths
+from synthtool import cache
+from synthtool import context
+from synthtool import log
+from synthtool import metadata
+from synthtool.protos import metadata_pb2
+from synthtool.sources import git
+
+PathOrStr = Union[str, Path]
+
+# Bump when the format of the saved state changes.
+_STATE_VERSION = 3
+
+
+def _clone_state(
+    url: str,
+    dest: Path = None,
+    committish: str = "master",
+    force: bool = False,
+    depth: int = None,
+) -> Optional[str]:
+    remote_sha = git.get_remote_sha(url, committish)
+    clone = git.get_clone_path(url, dest, committish)
+    # The clone may be shared, and checked out at another commit since.
+    if remote_sha is not None and clone.exists():
+        local_sha, _ = git.get_latest_commit(clone)
+        if local_sha != remote_sha:
+            return None
+    return remote_sha
+
+
+# Functions whose results depend on more than their arguments and inputs,
+# such as the state of a remote. Each is mapped to a function of the same
+# arguments returning that state, or None when it can't be known, in which
+# case the step always runs. Methods are mapped by their function, and the
+# instance is passed first.
+_EXTERNAL_STATE: Dict[Callable, Callable[..., Optional[str]]] = {
+    git.clone: _clone_state
+}
+
+
+def _generation_state(language: str) -> Callable[..., Optional[str]]:
+    def generation_state(generator, service, version, **kwargs):
+        return generator.generation_state(service, version, language, **kwargs)
+
+    return generation_state
+
+
+def add_generation_state(methods: Dict[Callable, str]) -> None:
+    """Registers the external state of code generators' *_library(service,
+    version, **kwargs) methods, mapped to the language they generate: the
+    generator's generation_state(service, version, language, **kwargs)."""
+    for method, language in methods.items():
+        _EXTERNAL_STATE[method] = _generation_state(language)
+
+
+def _get_external_state(func: Callable) -> Optional[Callable[..., Optional[str]]]:
+    external_state = _EXTERNAL_STATE.get(func)
+    method = getattr(func, "__func__", None)
+    if external_state is None and method in _EXTERNAL_STATE:
+        external_state = functools.partial(
+            _EXTERNAL_STATE[method], func.__self__  # type: ignore
+        )
+    return external_state
+
+
+class Step:
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        args: Sequence[Any],
+        kwargs: Dict[str, Any],
+        inputs: Sequence[PathOrStr],
+        outputs: Sequence[PathOrStr],
+        dependencies: Set["Step"],
+    ):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.inputs = [Path(path).absolute() for path in inputs]
+        self.outputs = [Path(path).absolute() for path in outputs]
+        self.dependencies = dependencies
+        # Set by Pipeline.run().
+        self.fingerprint = None  # type: Optional[str]
+        self.result = None  # type: Any
+        self.skipped = False
+
+    def __repr__(self) -> str:
+        return f"Step({self.name!r})"
+
+
+def _steps_in(value: Any) -> Iterable[Step]:
+    if isinstance(value, Step):
+        yield value
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            yield from _steps_in(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _steps_in(item)
+
+
+def _resolve(value: Any) -> Any:
+    """Replaces the steps in an argument with their results."""
+    if isinstance(value, Step):
+        return value.result
+    if isinstance(value, (list, tuple, set)):
+        return type(value)(_resolve(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _resolve(item) for key, item in value.items()}
+    return value
+
+
+def _describe(value: Any) -> Optional[str]:
+    """Returns a stable description of an argument, for fingerprinting, or
+    None if it has none (say, an object with an address in its repr)."""
+    if isinstance(value, Step):
+        # Its fingerprint is part of the depending step's.
+        return f"Step({value.name!r})"
+    if value is None or isinstance(value, (str, int, float, bool, Path)):
+        return repr(value)
+    if isinstance(value, (list, tuple, set)):
+        items = [_describe(item) for item in value]
+        if None in items:
+            return None
+        if isinstance(value, set):
+            items.sort()
+        return f"{type(value).__name__}({', '.join(items)})"  # type: ignore
+    if isinstance(value, dict):
+        entries = [(_describe(k), _describe(v)) for k, v in value.items()]
+        if any(k is None or v is None for k, v in entries):
+            return None
+        return "{" + ", ".join(f"{k}: {v}" for k, v in sorted(entries)) + "}"
+    description = repr(value)
+    return None if " at 0x" in description else description
+
+
+def _hash_paths(paths: Iterable[Path]) -> str:
+    """Hashes the names and contents of the files at or under ``paths``."""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        files = [path] if path.is_file() else sorted(path.glob("**/*"))
+        for file in files:
+            if file.is_file():
+                digest.update(str(file).encode("utf-8") + b"\0")
+                digest.update(hashlib.sha256(file.read_bytes()).digest())
+    return digest.hexdigest()
+
+
+def _replace_paths(value: Any, replace: Callable[[Path], Path]) -> Any:
+    if isinstance(value, Path):
+        return replace(value)
+    if isinstance(value, (list, tuple, set)):
+        return type(value)(_replace_paths(item, replace) for item in value)
+    if isinstance(value, dict):
+        return {key: _replace_paths(item, replace) for key, item in value.items()}
+    return value
+
+
+def _temporary_dirs() -> List[Path]:
+    """Returns the directories removed when the current or the default
+    context closes."""
+    dirs = []  # type: List[Path]
+    for synth_context in (context.current(), context.default()):
+        with synth_context.lock:
+            dirs.extend(Path(path) for path in synth_context.tempdirs)
+    return dirs
+
+
+def _is_within(path: Path, directories: Iterable[Path]) -> bool:
+    return any(path == d or d in path.parents for d in directories)
+
+
+def _paths_in(value: Any) -> Iterable[Path]:
+    if isinstance(value, Path):
+        yield value
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            yield from _paths_in(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _paths_in(item)
+
+
+def _overlaps(a: Iterable[Path], b: Iterable[Path]) -> bool:
+    b = list(b)
+    for path in a:
+        for other in b:
+            if path == other or path in other.parents or other in path.parents:
+                return True
+    return False
+
+
+class Pipeline:
+    def __init__(self, name: str = "synth", max_workers: int = None):
+        """
+        name: identifies the pipeline's saved state, together with the
+          working directory.
+        max_workers: how many steps run at once, by default the number of CPUs.
+        """
+        self.name = name
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.steps: List[Step] = []
+
+    def step(
+        self,
+        func: Callable,
+        *args: Any,
+        name: str = None,
+        inputs: Sequence[PathOrStr] = (),
+        outputs: Sequence[PathOrStr] = (),
+        after: Sequence[Step] = (),
+        **kwargs: Any,
+    ) -> Step:
+        """Adds a step calling func(*args, **kwargs).
+
+        Arguments that are steps are replaced by their results, and make this
+        step depend on them.
+
+        Args:
+            func: The step's body, such as move or a generator's py_library.
+            name: A name unique within the pipeline, by default the name of
+                the function, numbered if needed.
+            inputs: Files or directories the step reads, beyond its arguments.
+                Their contents are part of its fingerprint.
+            outputs: Files or directories the step writes. It is re-run if
+                they changed since its last run.
+            after: Steps to run this one after, beyond those in its arguments.
+
+        Steps reading or writing paths written by earlier steps, or writing
+        paths read by earlier steps, run after them.
+        """
+        taken = {step.name for step in self.steps}
+        if name is None:
+            base = name = getattr(func, "__name__", "step")
+            number = 2
+            while name in taken:
+                name = f"{base}-{number}"
+                number += 1
+        elif name in taken:
+            raise ValueError(f"A step named {name} already exists.")
+
+        dependencies = set(after)
+        dependencies.update(_steps_in(args))
+        dependencies.update(_steps_in(kwargs))
+        if not dependencies <= set(self.steps):
+            raise ValueError(f"{name} depends on steps of another pipeline.")
+        step = Step(name, func, args, kwargs, inputs, outputs, dependencies)
+        for earlier in self.steps:
+            if _overlaps(step.inputs + step.outputs, earlier.outputs) or _overlaps(
+                step.outputs, earlier.inputs
+            ):
+                dependencies.add(earlier)
+
+        self.steps.append(step)
+        return step
+
+    def _get_state_file(self) -> Path:
+        key = hashlib.sha256(f"{os.getcwd()}\0{self.name}".encode("utf-8"))
+        state_dir = cache.get_cache_dir() / "pipelines"
+        state_dir.mkdir(parents=True, exist_ok=True)
+        return state_dir / f"{key.hexdigest()[:16]}.pickle"
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._get_state_file(), "rb") as f:
+                state = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return {}
+        if state.get("version") != _STATE_VERSION:
+            return {}
+        return state["steps"]
+
+    def _save_state(self, steps: Dict[str, Dict[str, Any]]) -> None:
+        state_file = self._get_state_file()
+        partial_file = state_file.with_name(f"{state_file.name}.{os.getpid()}.tmp")
+        with open(partial_file, "wb") as f:
+            pickle.dump({"version": _STATE_VERSION, "steps": steps}, f)
+        os.replace(str(partial_file), str(state_file))
+
+    def _get_results_dir(self, step: Step) -> Path:
+        state_file = self._get_state_file()
+        key = hashlib.sha256(step.name.encode("utf-8")).hexdigest()[:16]
+        return state_file.with_name(state_file.stem) / key
+
+    def _keep_results(self, step: Step, tracked: List[Path]) -> List[Path]:
+        """Replaces the paths in temporary directories in the step's result
+        with copies that outlive them, for later runs to reuse. Returns its
+        tracked paths, with the same replacements."""
+        temporary = _temporary_dirs()
+        candidates = [
+            path.absolute()
+            for path in tracked + list(_paths_in(step.result))
+            if _is_within(path.absolute(), temporary)
+        ]
+        # Copy the outermost paths, so that results stay within the paths
+        # tracked with them.
+        roots = []  # type: List[Path]
+        for path in sorted(candidates, key=lambda path: len(path.parts)):
+            if not _is_within(path, roots):
+                roots.append(path)
+        if not roots:
+            return tracked
+
+        results_dir = self._get_results_dir(step)
+        shutil.rmtree(str(results_dir), ignore_errors=True)
+        results_dir.mkdir(parents=True)
+        copies = {}
+        for number, root in enumerate(roots):
+            copies[root] = results_dir / str(number)
+            if root.is_dir():
+                shutil.copytree(str(root), str(copies[root]), symlinks=True)
+            elif root.exists():
+                shutil.copy2(str(root), str(copies[root]))
+
+        def replace(path: Path) -> Path:
+            for root, copy in copies.items():
+                if _is_within(path.absolute(), [root]):
+                    return copy / path.absolute().relative_to(root)
+            return path
+
+        step.result = _replace_paths(step.result, replace)
+        kept = [replace(path) for path in tracked]
+        for path in kept:
+            _tracked_paths.add(path)
+        return kept
+
+    def _fingerprint(self, step: Step) -> Optional[str]:
+        from synthtool import __main__
+
+        arguments = _describe((list(step.args), step.kwargs))
+        upstream = sorted(
+            str(dependency.fingerprint) for dependency in step.dependencies
+        )
+        if arguments is None or "None" in upstream:
+            return None
+        func = f"{getattr(step.func, '__module__', '')}." + getattr(
+            step.func, "__qualname__", repr(step.func)
+        )
+        parts = [__main__.VERSION, func, arguments, _hash_paths(step.inputs)]
+
+        external_state = _get_external_state(step.func)
+        if external_state is not None:
+            state = external_state(*_resolve(list(step.args)), **_resolve(step.kwargs))
+            if state is None:
+                return None
+            parts.append(state)
+
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8") + b"\0")
+        for part in upstream:
+            digest.update(part.encode("utf-8") + b"\0")
+        return digest.hexdigest()
+
+    def _run_step(self, step: Step, previous: Optional[Dict[str, Any]]):
+        """Runs a step, unless it can be skipped. Returns its new state."""
+        step.fingerprint = self._fingerprint(step)
+        if (
+            step.fingerprint is not None
+            and previous is not None
+            and previous["fingerprint"] == step.fingerprint
+            # As the last step writing them left them, see run().
+            and previous["outputs"] == _hash_paths(step.outputs)
+            and all(path.exists() for path in _paths_in(previous["result"]))
+            # Without declared outputs, there's no telling whether the steps
+            # that ran before it changed the files it works on.
+            and (step.outputs or all(d.skipped for d in step.dependencies))
+        ):
+            log.debug(f"Skipping {step.name}, it is unchanged.")
+            # Later steps may move files out of the paths it tracked.
+            for path in previous["tracked_paths"]:
+                _tracked_paths.add(path)
+            step.result = previous["result"]
+            step.skipped = True
+            return previous
+
+        log.debug(f"Running {step.name}.")
+        tracked_before = set(_tracked_paths.get())
+        with metadata.capture() as captured:
+            step.result = step.func(*_resolve(list(step.args)), **_resolve(step.kwargs))
+        # Concurrent steps' paths may be included too, which is harmless:
+        # they're tracked in this run either way.
+        tracked = [path for path in _tracked_paths.get() if path not in tracked_before]
+
+        try:
+            pickle.dumps(step.result)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # Without its result, the step can't be skipped next time.
+            step.fingerprint = None
+        if step.fingerprint is not None:
+            tracked = self._keep_results(step, tracked)
+        return {
+            "fingerprint": step.fingerprint,
+            "result": step.result if step.fingerprint is not None else None,
+            "metadata": captured.SerializeToString(),
+            "tracked_paths": tracked,
+        }
+
+    def run(self) -> Dict[str, Any]:
+        """Runs the pipeline's steps, and returns their results by name."""
+        previous_state = self._load_state()
+        state = {}  # type: Dict[str, Dict[str, Any]]
+        pending = list(self.steps)
+        done = set()  # type: Set[Step]
+        running = {}  # type: Dict[concurrent.futures.Future, Step]
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+                while pending or running:
+                    for step in [s for s in pending if s.dependencies <= done]:
+                        pending.remove(step)
+                        future = executor.submit(
+                            context.bind(self._run_step),
+                            step,
+                            previous_state.get(step.name),
+                        )
+                        running[future] = step
+
+                    finished, _ = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        step = running.pop(future)
+                        state[step.name] = future.result()
+                        done.add(step)
+        finally:
+            # Later steps may write a step's outputs again (a move, then a
+            # replace), so they are recorded as the run left them, which is
+            # how the next run finds them. Unless a step writing them didn't
+            # finish, leaving them in no known state.
+            unfinished = [s for s in self.steps if s.name not in state]
+            for step in self.steps:
+                if step.name in state:
+                    outputs = None  # type: Optional[str]
+                    if not any(_overlaps(step.outputs, s.outputs) for s in unfinished):
+                        outputs = _hash_paths(step.outputs)
+                    state[step.name] = {**state[step.name], "outputs": outputs}
+            self._save_state({**previous_state, **state})
+
+        # Record metadata in the order the steps were defined, whether they
+        # ran or not.
+        for step in self.steps:
+            captured = metadata_pb2.Metadata.FromString(state[step.name]["metadata"])
+            metadata.merge(captured)
+
+        skipped = sum(step.skipped for step in self.steps)
+        log.success(f"Ran {len(self.steps) - skipped} steps, skipped {skipped}.")
+        return {step.name: step.result for step in self.steps}
@@ -12,11 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import subprocess
 
 from synthtool import log
 
 
+def _log_failure(args, output):
+    log.error(f"Failed executing {' '.join((str(arg) for arg in args))}:\n\n{output}")
+
+
 def run(args, *, cwd=None, check=True, hide_output=True):
     if hide_output:
         stdout = subprocess.PIPE
@@ -33,7 +38,28 @@ def run(args, *, cwd=None, check=True, hide_output=True):
             encoding="utf-8",
         )
     except subprocess.CalledProcessError as exc:
-        log.error(
-            f"Failed executing {' '.join((str(arg) for arg in args))}:\n\n{exc.stdout}"
-        )
+        _log_failure(args, exc.stdout)
         raise exc
+
+
+async def run_async(args, *, cwd=None, check=True, hide_output=True):
+    """Like run(), but awaits the process instead of blocking on it."""
+    if hide_output:
+        stdout = asyncio.subprocess.PIPE
+    else:
+        stdout = None
+
+    process = await asyncio.create_subprocess_exec(
+        *[str(arg) for arg in args],
+        stdout=stdout,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=None if cwd is None else str(cwd),
+    )
+    output, _ = await process.communicate()
+    if output is not None:
+        output = output.decode("utf-8")
+
+    if check and process.returncode:
+        _log_failure(args, output)
+        raise subprocess.CalledProcessError(process.returncode, args, output)
+    return subprocess.CompletedProcess(args, process.returncode, output)
@@ -12,15 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
 import os
 import pathlib
 import re
 import shutil
 import subprocess
-from typing import Dict, Tuple
+from typing import Dict, Iterator, Optional, Tuple
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+from synthtool import _async
 from synthtool import _tracked_paths
 from synthtool import cache
+from synthtool import lock
+from synthtool import log
 from synthtool import metadata
 from synthtool import shell
 
@@ -30,6 +39,9 @@ REPO_REGEX = (
 
 USE_SSH = os.environ.get("AUTOSYNTH_USE_SSH", False)
 
+# Set by `synthtool batch` for its workers.
+BATCH_ID_ENV = "SYNTHTOOL_BATCH_ID"
+
 
 def make_repo_clone_url(repo: str) -> str:
     """Returns a fully-qualified repo URL on GitHub from a string containing
@@ -51,33 +63,40 @@ def clone(
     force: bool = False,
     depth: int = None,
 ) -> pathlib.Path:
-    if dest is None:
-        dest = cache.get_cache_dir()
-
-    dest = dest / pathlib.Path(url).stem
-
-    if force and dest.exists():
-        shutil.rmtree(dest)
-
-    if not dest.exists():
-        cmd = ["git", "clone", url, dest]
-        if depth is not None:
-            cmd.extend(["--depth", str(depth)])
-        shell.run(cmd)
-    else:
-        shell.run(["git", "pull"], cwd=str(dest))
-
-    shell.run(["git", "reset", "--hard", committish], cwd=str(dest))
+    dest = get_clone_path(url, dest, committish)
+
+    with _locked(dest):
+        if force and dest.exists():
+            shutil.rmtree(dest)
+
+        locked_sha = lock.git_sha(url, committish)
+        if locked_sha is not None:
+            _checkout_locked(url, dest, locked_sha, depth)
+        elif _updated_in_batch(dest, committish):
+            log.debug(f"{dest.name} was already updated in this batch.")
+        else:
+            if not dest.exists():
+                cmd = ["git", "clone", url, dest]
+                if depth is not None:
+                    cmd.extend(["--depth", str(depth)])
+                shell.run(cmd)
+            else:
+                shell.run(["git", "pull"], cwd=str(dest))
+
+            shell.run(["git", "reset", "--hard", committish], cwd=str(dest))
+            _mark_updated_in_batch(dest, committish)
+
+        sha, message = get_latest_commit(dest)
 
     # track all git repositories
     _tracked_paths.add(dest)
 
     # add repo to metadata
-    sha, message = get_latest_commit(dest)
+    lock.record_git_sha(url, committish, sha)
     commit_metadata = extract_commit_message_metadata(message)
 
     metadata.add_git_source(
-        name=dest.name,
+        name=pathlib.Path(url).stem,
         remote=url,
         sha=sha,
         internal_ref=commit_metadata.get("PiperOrigin-RevId"),
@@ -86,6 +105,96 @@ def clone(
     return dest
 
 
+def get_clone_path(
+    url: str, dest: pathlib.Path = None, committish: str = "master"
+) -> pathlib.Path:
+    """Returns where clone() clones ``url`` at ``committish``.
+
+    The synths of a batch use the clones in the cache at the same time, so
+    during a batch a clone is never moved to another commit once checked
+    out: committishes other than master, and commits locked in synth.lock,
+    get clones of their own.
+    """
+    if dest is None:
+        dest = cache.get_cache_dir()
+
+    name = pathlib.Path(url).stem
+    if os.environ.get(BATCH_ID_ENV):
+        locked_sha = lock.git_sha(url, committish)
+        if locked_sha is not None:
+            name = f"{name}@{locked_sha[:12]}"
+        elif committish != "master":
+            safe_committish = re.sub(r"[^\w.-]", "_", committish)
+            name = f"{name}@{safe_committish}"
+    return dest / name
+
+
+@contextlib.contextmanager
+def _locked(dest: pathlib.Path) -> Iterator[None]:
+    """Holds an exclusive lock on a clone, so that processes sharing the cache
+    (say, a batch's workers) don't update it at the same time."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with open(dest.parent / f".{dest.name}.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _batch_stamp(dest: pathlib.Path) -> pathlib.Path:
+    return dest / ".git" / "synthtool-batch"
+
+
+def _updated_in_batch(dest: pathlib.Path, committish: str) -> bool:
+    """Whether another synth of this batch already brought the clone up to
+    date; its repositories are only pulled once per batch."""
+    batch_id = os.environ.get(BATCH_ID_ENV)
+    if not batch_id or not _batch_stamp(dest).exists():
+        return False
+    return _batch_stamp(dest).read_text() == f"{batch_id} {committish}"
+
+
+def _mark_updated_in_batch(dest: pathlib.Path, committish: str) -> None:
+    batch_id = os.environ.get(BATCH_ID_ENV)
+    if batch_id:
+        _batch_stamp(dest).write_text(f"{batch_id} {committish}")
+
+
+async def clone_async(
+    url: str,
+    dest: pathlib.Path = None,
+    committish: str = "master",
+    force: bool = False,
+    depth: int = None,
+) -> pathlib.Path:
+    """Like clone(), but run in the event loop's executor, see
+    synthtool._async."""
+    return await _async.call(clone, url, dest, committish, force, depth)
+
+
+def _checkout_locked(
+    url: str, dest: pathlib.Path, sha: str, depth: Optional[int]
+) -> None:
+    """Checks out a locked commit, fetching only if it isn't already there."""
+    if not dest.exists():
+        # As shallow as an unlocked clone; the locked commit is fetched below
+        # if the default branch has moved past it.
+        cmd = ["git", "clone", "--no-checkout", url, dest]
+        if depth is not None:
+            cmd.extend(["--depth", str(depth)])
+        shell.run(cmd)
+
+    present = shell.run(
+        ["git", "cat-file", "-e", f"{sha}^{{commit}}"], cwd=str(dest), check=False
+    )
+    if present.returncode:
+        cmd = ["git", "fetch", "origin", sha]
+        if depth is not None:
+            cmd.extend(["--depth", str(depth)])
+        shell.run(cmd, cwd=str(dest))
+
+    shell.run(["git", "reset", "--hard", sha], cwd=str(dest))
+
+
 def parse_repo_url(url: str) -> Dict[str, str]:
     """
     Parses a GitHub url and returns a dict with:
@@ -120,6 +229,29 @@ def get_latest_commit(repo: pathlib.Path = None) -> Tuple[str, str]:
     return commit, message
 
 
+def get_remote_sha(url: str, committish: str = "master") -> Optional[str]:
+    """Returns the commit ``committish`` resolves to in the remote repository
+    (or synth.lock, if running --locked), without cloning it. None if it isn't
+    a commit, branch or tag of the remote."""
+    locked_sha = lock.git_sha(url, committish)
+    if locked_sha is not None:
+        return locked_sha
+    if re.fullmatch(r"[0-9a-f]{40}", committish):
+        return committish
+
+    result = shell.run(["git", "ls-remote", url, committish], check=False)
+    if result.returncode:
+        return None
+    refs = {}
+    for line in result.stdout.splitlines():
+        sha, _, ref = line.partition("\t")
+        refs[ref] = sha
+    for ref in (committish, f"refs/heads/{committish}", f"refs/tags/{committish}"):
+        if ref in refs:
+            return refs[ref]
+    return None
+
+
 def extract_commit_message_metadata(message: str) -> Dict[str, str]:
     """Extract extended metadata stored in the Git commit message.
 
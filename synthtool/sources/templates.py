@@ -12,24 +12,164 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Union, List
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple, Union
 from pathlib import Path
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
 
 import jinja2
+import jinja2.meta
 import re
 
+from synthtool import cache
 from synthtool import log
 from synthtool import tmp
 
-
 PathOrStr = Union[str, Path]
 
+# Rendered output, keyed by the template source and the values of only the
+# variables that the template actually reads. See _render_key.
+_rendered: Dict[str, str] = {}
+# Locks held while a render key is looked up and rendered, so that threads
+# rendering the same key render it once. Keys share a fixed number of them,
+# see _render_lock.
+_render_locks: List[threading.Lock] = [threading.Lock() for _ in range(64)]
+# Entries of the on-disk render cache unused for this long are removed, at
+# most once a day. See _prune_render_cache.
+_RENDER_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+_RENDER_CACHE_PRUNE_INTERVAL = 24 * 60 * 60
+# Render cache directories pruned (or found recently pruned) by this process.
+_pruned: Set[str] = set()
+# Variables referenced by a template, keyed by a hash of its source.
+_variables: Dict[str, Optional[FrozenSet[str]]] = {}
+# Template directories that have precompiled counterparts, mapped to the
+# directory holding them and the version they must be built by. See
+# register_precompiled.
+_precompiled_roots: Dict[Path, Tuple[Path, str]] = {}
+# Environments shared by every Templates and TemplateGroup in the process,
+# keyed by their resolved location. See _get_env.
+_environments: Dict[str, jinja2.Environment] = {}
+_environments_lock = threading.Lock()
+# Whether a file in a template directory needs Jinja, keyed by its path and
+# validated against its (mtime, size).
+_classified: Dict[str, Tuple[int, int, bool]] = {}
+
+
+class _PrecompiledLoader(jinja2.FileSystemLoader):
+    """Loads templates from modules built by compile_templates, falling back
+    to parsing the source for any template that changed since."""
+
+    def __init__(self, location: Path, compiled_dir: Path, hashes: Dict[str, str]):
+        super().__init__(str(location))
+        self._modules = jinja2.ModuleLoader(str(compiled_dir))
+        self._hashes = hashes
+
+    def load(self, environment, name, globals=None):
+        source, _, _ = self.get_source(environment, name)
+        source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        if self._hashes.get(name) == source_hash:
+            return self._modules.load(environment, name, globals)
+        return super().load(environment, name, globals)
+
+
+def register_precompiled(
+    source_root: PathOrStr, compiled_root: PathOrStr, version: str
+) -> None:
+    """Registers ``compiled_root`` as holding precompiled versions of the
+    template directories under ``source_root``, laid out the same way. Those
+    compiled for another ``version`` (see compile_templates) are ignored."""
+    _precompiled_roots[Path(source_root)] = (Path(compiled_root), version)
+
+
+def _find_precompiled(location: Path) -> Optional[Tuple[Path, Dict[str, str]]]:
+    """Returns the precompiled directory for ``location`` and the source hash
+    of each template in it, if one was built for the registered version and
+    by this version of Jinja."""
+    for source_root, (compiled_root, version) in _precompiled_roots.items():
+        try:
+            compiled_dir = compiled_root / location.relative_to(source_root)
+        except ValueError:
+            continue
+
+        manifest_file = compiled_dir / "manifest.json"
+        if not manifest_file.exists():
+            return None
+
+        manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+        if (manifest["version"], manifest["jinja2"]) != (version, jinja2.__version__):
+            log.debug(f"Ignoring stale precompiled templates in {compiled_dir}.")
+            return None
+
+        hashes = {}
+        for name, entry in manifest["templates"].items():
+            hashes[name] = entry["sha256"]
+            # Saves _template_variables from parsing the template.
+            variables = entry["variables"]
+            _variables.setdefault(
+                entry["sha256"], None if variables is None else frozenset(variables)
+            )
+
+        return compiled_dir, hashes
+
+    return None
+
+
+def compile_templates(location: PathOrStr, target: PathOrStr, version: str) -> None:
+    """Compiles the templates in ``location`` into Python modules in
+    ``target``, along with a manifest describing them. They are only used
+    where registered with the same ``version``, see register_precompiled.
+
+    Static files are skipped, as they are never rendered.
+    """
+    location = Path(location)
+    target = Path(target)
+    env = _make_env(location)
+
+    names = [
+        name for name in env.list_templates() if _is_template(env, location / name)
+    ]
+    env.compile_templates(str(target), filter_func=lambda name: name in names, zip=None)
+
+    manifest: Dict[str, Any] = {
+        "version": version,
+        "jinja2": jinja2.__version__,
+        "templates": {},
+    }
+    for name in names:
+        source, _, _ = env.loader.get_source(env, name)
+        source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        variables = _template_variables(env, source_hash, source)
+        manifest["templates"][name] = {
+            "sha256": source_hash,
+            "variables": None if variables is None else sorted(variables),
+        }
+
+    (target / "manifest.json").write_text(
+        json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8"
+    )
+    log.debug(f"Compiled {len(names)} templates from {location} into {target}.")
+
 
 def _make_env(location):
+    location = Path(location)
+    precompiled = _find_precompiled(location)
+    if precompiled is not None:
+        loader: jinja2.BaseLoader = _PrecompiledLoader(location, *precompiled)
+    else:
+        loader = jinja2.FileSystemLoader(str(location))
+
     env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(str(location)),
+        loader=loader,
         autoescape=False,
         keep_trailing_newline=True,
+        # Never evict compiled templates; a template directory is small.
+        cache_size=-1,
     )
     env.filters["release_quality_badge"] = release_quality_badge
     env.filters["language_pretty"] = language_pretty
@@ -38,41 +178,321 @@ def _make_env(location):
     return env
 
 
-def _render_to_path(env, template_name, dest, params):
-    template = env.get_template(template_name)
+def _get_env(location: PathOrStr) -> jinja2.Environment:
+    """Returns the process-wide environment for a template location.
+
+    Jinja caches compiled templates per environment, so sharing one between
+    every user of a location means each template is compiled at most once
+    per process, however many times it is rendered.
+    """
+    key = str(Path(location).resolve())
+    with _environments_lock:
+        env = _environments.get(key)
+        if env is None:
+            env = _make_env(location)
+            _environments[key] = env
+    return env
+
+
+def preload(location: PathOrStr) -> int:
+    """Compiles the templates in ``location`` into its shared environment (see
+    _get_env), and finds the variables they read, for the renders of this
+    process and of processes forked from it. Returns how many there are."""
+    location = Path(location)
+    env = _get_env(location)
+    names = [
+        name for name in env.list_templates() if _is_template(env, location / name)
+    ]
+    loader = env.loader
+    assert loader is not None
+    for name in names:
+        env.get_template(name)
+        source, _, _ = loader.get_source(env, name)
+        source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        _template_variables(env, source_hash, source)
+    return len(names)
+
+
+def _get_render_cache_dir() -> Path:
+    cache_dir = cache.get_cache_dir() / "rendered-templates"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    if str(cache_dir) not in _pruned:
+        _pruned.add(str(cache_dir))
+        _prune_render_cache(cache_dir)
+    return cache_dir
+
+
+def _prune_render_cache(cache_dir: Path) -> None:
+    """Removes the entries of the render cache that weren't used (see
+    _read_cache_file) for _RENDER_CACHE_MAX_AGE, unless that was done less
+    than _RENDER_CACHE_PRUNE_INTERVAL ago."""
+    stamp = cache_dir / ".pruned"
+    now = time.time()
+    try:
+        if now - stamp.stat().st_mtime < _RENDER_CACHE_PRUNE_INTERVAL:
+            return
+    except FileNotFoundError:
+        pass
+    stamp.touch()
+
+    removed = 0
+    for entry in cache_dir.iterdir():
+        try:
+            if entry != stamp and now - entry.stat().st_mtime > _RENDER_CACHE_MAX_AGE:
+                entry.unlink()
+                removed += 1
+        except FileNotFoundError:
+            # Removed by a concurrent run.
+            pass
+    log.debug(f"Removed {removed} unused entries from {cache_dir}.")
+
+
+def _read_cache_file(path: Path) -> Optional[str]:
+    """Returns the contents of a render cache entry, marking it as used, or
+    None if there is none."""
+    try:
+        text = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(str(path))
+    except OSError:
+        # Only delays its pruning.
+        pass
+    return text
+
+
+def _write_cache_file(path: Path, text: str) -> None:
+    # Write to a scratch file first so that a concurrent reader never sees a
+    # partially written entry.
+    partial_path = path.with_name(
+        f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    partial_path.write_text(text, encoding="utf-8")
+    os.replace(str(partial_path), str(path))
 
-    output = template.stream(**params)
 
+_fingerprint: Optional[str] = None
+
+
+def _renderer_fingerprint() -> str:
+    """Identifies the code that renders templates.
+
+    The filters registered in _make_env live in this module, so a change to
+    this file (or to Jinja itself) invalidates everything on disk.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha256(Path(__file__).read_bytes())
+        digest.update(jinja2.__version__.encode("utf-8"))
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
+
+
+def _template_variables(env, source_hash: str, source: str):
+    """Returns the names of the variables a template reads.
+
+    Returns None if the template pulls in other templates (``include``,
+    ``extends``, ``import``), as its output then depends on more than its
+    own source and can't be cached by it.
+    """
+    if source_hash in _variables:
+        return _variables[source_hash]
+
+    variables_file = _get_render_cache_dir() / f"{source_hash}.vars.json"
+    stored_text = _read_cache_file(variables_file)
+    if stored_text is not None:
+        stored = json.loads(stored_text)
+        variables = None if stored is None else frozenset(stored)
+    else:
+        ast = env.parse(source)
+        if list(jinja2.meta.find_referenced_templates(ast)):
+            variables = None
+        else:
+            variables = frozenset(jinja2.meta.find_undeclared_variables(ast))
+        stored = None if variables is None else sorted(variables)
+        _write_cache_file(variables_file, json.dumps(stored))
+
+    _variables[source_hash] = variables
+    return variables
+
+
+def _render_key(
+    template_name: str,
+    source_hash: str,
+    variables: FrozenSet[str],
+    params: Dict[str, Any],
+) -> Optional[str]:
+    """Builds the cache key for a render.
+
+    Only the values of ``variables`` take part, so a template that reads
+    nothing from ``params`` has a single key regardless of the context.
+    Returns None if a value can't be serialized stably.
+    """
+    values = {name: params[name] for name in sorted(variables) if name in params}
+    try:
+        serialized = json.dumps(values, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+    digest = hashlib.sha256()
+    for part in (_renderer_fingerprint(), template_name, source_hash, serialized):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _render(env, template_name: str, params: Dict[str, Any]) -> Tuple[str, str]:
+    """Renders a template, reusing previous output when the template and
+    every variable it reads are unchanged.
+
+    Returns the rendered text and the filename of the template source.
+    """
+    source, filename, _ = env.loader.get_source(env, template_name)
+    source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    variables = _template_variables(env, source_hash, source)
+    key = None
+    if variables is not None:
+        key = _render_key(template_name, source_hash, variables, params)
+
+    if key is None:
+        return env.get_template(template_name).render(**params), filename
+
+    with _render_lock(key):
+        if key in _rendered:
+            return _rendered[key], filename
+
+        cached_file = _get_render_cache_dir() / key
+        cached_text = _read_cache_file(cached_file)
+        if cached_text is not None:
+            _rendered[key] = cached_text
+            return cached_text, filename
+
+        text = env.get_template(template_name).render(**params)
+        _rendered[key] = text
+        _write_cache_file(cached_file, text)
+
+    return text, filename
+
+
+def _render_lock(key: str) -> threading.Lock:
+    # Keys are hex digests, so they spread evenly over the locks.
+    return _render_locks[int(key[:8], 16) % len(_render_locks)]
+
+
+def _output_name(template_name: str) -> str:
     if template_name.endswith(".j2"):
-        template_name = template.name[:-3]
+        return template_name[:-3]
+    return template_name
+
+
+def _render_to_path(env, template_name, dest, params):
+    text, filename = _render(env, template_name, params)
 
-    dest = dest / template_name
+    dest = dest / _output_name(template_name)
     dest.parent.mkdir(parents=True, exist_ok=True)
 
     with dest.open("w") as fh:
-        output.dump(fh)
+        fh.write(text)
 
     # Copy file mode over
-    source_path = Path(template.filename)
+    source_path = Path(filename)
     mode = source_path.stat().st_mode
     dest.chmod(mode)
 
     return dest
 
 
+def _is_template(env, path: Path) -> bool:
+    """Returns whether a file has to go through Jinja.
+
+    Files ending in ``.j2`` always do. Anything else only does if it contains
+    one of the environment's block, variable or comment start markers;
+    plain files (licenses, CI configs, ...) can be copied as-is.
+    """
+    if path.suffix == ".j2":
+        return True
+
+    path_stat = path.stat()
+    cached = _classified.get(str(path))
+    if cached is not None and cached[:2] == (
+        path_stat.st_mtime_ns,
+        path_stat.st_size,
+    ):
+        return cached[2]
+
+    contents = path.read_bytes()
+    markers = (
+        env.block_start_string,
+        env.variable_start_string,
+        env.comment_start_string,
+    )
+    is_template = any(marker.encode("utf-8") in contents for marker in markers)
+
+    _classified[str(path)] = (path_stat.st_mtime_ns, path_stat.st_size, is_template)
+    return is_template
+
+
+def _copy_to_path(source_dir: Path, file_name: str, dest: Path) -> Path:
+    """Copies a static file from a template directory, preserving its mode.
+
+    This deliberately copies rather than hardlinks: synth scripts edit
+    generated files in place (see transforms.replace), which would otherwise
+    write through to the installed templates.
+    """
+    dest = dest / file_name
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # copyfile uses the kernel's zero-copy path where one is available.
+    shutil.copyfile(str(source_dir / file_name), str(dest))
+    shutil.copymode(str(source_dir / file_name), str(dest))
+    return dest
+
+
+def _write_if_changed(dest: Path, contents: bytes, mode: int) -> bool:
+    """Writes ``contents`` to ``dest`` unless it already holds exactly those
+    bytes, so that unchanged files keep their mtime.
+
+    Returns: True if the file was written, False otherwise.
+    """
+    try:
+        unchanged = dest.read_bytes() == contents
+    except FileNotFoundError:
+        unchanged = False
+
+    if unchanged:
+        if stat.S_IMODE(dest.stat().st_mode) != stat.S_IMODE(mode):
+            dest.chmod(mode)
+        return False
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    dest.write_bytes(contents)
+    dest.chmod(mode)
+    return True
+
+
 class Templates:
     def __init__(self, location: PathOrStr) -> None:
-        self.env = _make_env(location)
+        self.env = _get_env(location)
         self.source_path = Path(location)
         self.dir = tmp.tmpdir()
 
     def render(self, template_name: str, **kwargs) -> Path:
         return _render_to_path(self.env, template_name, self.dir, kwargs)
 
+    def render_into(self, template_name: str, destination: PathOrStr, **kwargs) -> Path:
+        """Renders a template directly into ``destination``, writing it only if
+        its contents changed."""
+        text, filename = _render(self.env, template_name, kwargs)
+        dest = Path(destination) / _output_name(template_name)
+        _write_if_changed(dest, text.encode("utf-8"), Path(filename).stat().st_mode)
+        return dest
+
 
 class TemplateGroup:
     def __init__(self, location: PathOrStr, excludes: List[str] = []) -> None:
-        self.env = _make_env(location)
+        self.env = _get_env(location)
+        self.source_path = Path(location)
         self.dir = tmp.tmpdir()
         self.excludes = excludes
 
@@ -80,12 +500,91 @@ class TemplateGroup:
         for template_name in self.env.list_templates():
             if template_name not in self.excludes:
                 print(template_name)
-                _render_to_path(self.env, template_name, self.dir, kwargs)
+                if _is_template(self.env, self.source_path / template_name):
+                    _render_to_path(self.env, template_name, self.dir, kwargs)
+                else:
+                    _copy_to_path(self.source_path, template_name, self.dir)
             else:
                 print(f"Skipping: {template_name}")
 
         return self.dir
 
+    def render_into(self, destination: PathOrStr, **kwargs) -> Path:
+        """Renders the group directly into ``destination``.
+
+        Unlike render(), nothing is staged in a temporary directory: each file
+        is rendered in memory and written only if it differs from what is
+        already at the destination. A template is skipped if either its name
+        or its output name is in ``excludes``.
+
+        Returns: The destination directory.
+        """
+        return self._render_plan_into(self._plan(), Path(destination), kwargs)
+
+    def render_many(
+        self,
+        targets: Sequence[Tuple[PathOrStr, Dict[str, Any]]],
+        max_workers: int = None,
+    ) -> List[Path]:
+        """Renders the group into several destinations, each with its own
+        parameters, as render_into() would.
+
+        The template set is listed and classified once for all targets, the
+        targets are rendered in parallel, and a template whose variables come
+        out the same for two targets is only rendered once.
+
+        Returns: The destination directories, in the order of ``targets``.
+        """
+        plan = self._plan()
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self._render_plan_into, plan, Path(destination), dict(params)
+                )
+                for destination, params in targets
+            ]
+            return [future.result() for future in futures]
+
+    def _plan(self) -> List[Tuple[str, str, Optional[bytes], int]]:
+        """Lists what the group renders, honoring excludes.
+
+        Returns: (template name, output name, contents, mode) tuples, where
+            contents is None for files that need rendering.
+        """
+        plan = []
+        for template_name in self.env.list_templates():
+            output_name = _output_name(template_name)
+            if template_name in self.excludes or output_name in self.excludes:
+                print(f"Skipping: {template_name}")
+                continue
+
+            print(template_name)
+            source = self.source_path / template_name
+            contents = None
+            if not _is_template(self.env, source):
+                contents = source.read_bytes()
+            plan.append((template_name, output_name, contents, source.stat().st_mode))
+
+        return plan
+
+    def _render_plan_into(
+        self,
+        plan: List[Tuple[str, str, Optional[bytes], int]],
+        destination: Path,
+        params: Dict[str, Any],
+    ) -> Path:
+        written = 0
+        for template_name, output_name, contents, mode in plan:
+            if contents is None:
+                text, _ = _render(self.env, template_name, params)
+                contents = text.encode("utf-8")
+
+            if _write_if_changed(destination / output_name, contents, mode):
+                written += 1
+
+        log.debug(f"Rendered {self.source_path}, {written} file(s) changed.")
+        return destination
+
 
 def release_quality_badge(input: str) -> str:
     """Generates a markdown badge for displaying a "Release Quality'."""
@@ -12,28 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import atexit
 from pathlib import Path
-import shutil
 import tempfile
-from typing import List
 
-from synthtool import log
-
-
-_tempdirs: List[str] = []
+from synthtool import context
 
 
 def tmpdir() -> Path:
+    """Returns a new temporary directory, removed when the current context
+    closes (at exit, for the default context)."""
     path = tempfile.mkdtemp()
-    _tempdirs.append(path)
+    current = context.current()
+    with current.lock:
+        current.tempdirs.append(path)
     return Path(path)
 
 
 def cleanup():
-    for path in _tempdirs:
-        shutil.rmtree(str(path))
-    log.debug(f"Cleaned up {len(_tempdirs)} temporary directories.")
-
-
-atexit.register(cleanup)
+    context.current().remove_tempdirs()
@@ -146,6 +146,12 @@ def move(
     copied = False
 
     for source in _expand_paths(sources):
+        # Templates rendered straight into the repo are already in place.
+        in_place = Path(destination) if destination is not None else Path.cwd()
+        if source.resolve() == in_place.resolve():
+            log.warning(f"{source} is its own destination, not moving it.")
+            continue
+
         if destination is None:
             canonical_destination = _tracked_paths.relativize(source)
         else:
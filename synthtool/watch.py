@@ -0,0 +1,179 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Watch mode, see `synthtool --watch`.
+
+Runs a synth, then runs it again whenever synth.py, the templates, a local
+googleapis (SYNTHTOOL_GOOGLEAPIS) or a local generator (SYNTHTOOL_GENERATOR)
+change. Each change re-runs the whole synth, in the same process, so what
+didn't change is reused rather than redone: templates stay compiled and
+unchanged renders come from the render cache, generations whose protos
+(and their imports) didn't change are restored from the generation cache,
+and unchanged Pipeline steps are skipped.
+"""
+
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from synthtool import context
+from synthtool import log
+from synthtool import metadata
+
+# How often, in seconds, the watched paths are checked for changes.
+INTERVAL = float(os.environ.get("SYNTHTOOL_WATCH_INTERVAL", 1.0))
+
+Snapshot = Dict[str, Tuple[int, int]]
+
+
+def watched_paths(synth_file: str) -> List[Path]:
+    """Returns the synth file, the templates, and the local googleapis and
+    generator, if any."""
+    from synthtool.gcp import common
+
+    paths = [Path(synth_file), common._TEMPLATES_DIR]
+    for variable in ("SYNTHTOOL_GOOGLEAPIS", "SYNTHTOOL_GENERATOR"):
+        local = os.environ.get(variable)
+        if local:
+            paths.append(Path(local).expanduser())
+    return paths
+
+
+def snapshot(paths: Iterable[Path]) -> Snapshot:
+    """Returns the modification time and size of every file at or under
+    ``paths``, skipping hidden directories such as .git."""
+    files = {}
+    for path in paths:
+        if path.is_file():
+            stat = path.stat()
+            files[str(path)] = (stat.st_mtime_ns, stat.st_size)
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(str(path)):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for filename in filenames:
+                file = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                files[file] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def changed_files(before: Snapshot, after: Snapshot) -> List[str]:
+    return sorted(
+        file for file in set(before) | set(after) if before.get(file) != after.get(file)
+    )
+
+
+def _log_affected_apis(changed: Sequence[str]) -> None:
+    """Logs the APIs that the changes to a local googleapis affect, going by
+    the proto index of its working tree."""
+    from synthtool.gcp import proto_index
+
+    local = os.environ.get("SYNTHTOOL_GOOGLEAPIS")
+    if not local:
+        return
+    googleapis = Path(local).expanduser().resolve()
+    paths = []
+    for file in changed:
+        try:
+            paths.append(Path(file).resolve().relative_to(googleapis).as_posix())
+        except ValueError:
+            pass
+    if not paths:
+        return
+
+    try:
+        index = proto_index.load_working_tree(googleapis)
+    except subprocess.CalledProcessError:
+        # Not a git checkout, it can't be indexed.
+        return
+    affected = index.affected(paths)
+    if affected:
+        apis = ", ".join(
+            f"{service} {version}" for service, version in sorted(affected)
+        )
+        log.info(f"The changes affect {apis}.")
+
+
+def _run(execute: Callable[[], None], extra_args: Sequence[str], outfile: str) -> bool:
+    """Runs the synth in a context of its own, and returns whether it
+    succeeded. Its failures are logged, not raised, to keep watching."""
+    with context.SynthContext(extra_args=extra_args) as synth_context:
+        with context.activate(synth_context):
+            metadata.register_exit_hook(outfile=outfile)
+            try:
+                execute()
+            except (Exception, SystemExit):
+                log.exception("The synth failed, waiting for changes.")
+                return False
+            synth_context.succeeded = True
+    return True
+
+
+def watch(
+    execute: Callable[[], None],
+    paths: Sequence[Path],
+    extra_args: Sequence[str] = (),
+    outfile: str = "synth.metadata",
+    interval: float = None,
+    max_runs: Optional[int] = None,
+) -> None:
+    """Calls execute() now, and again whenever a file under ``paths`` changes.
+
+    Args:
+        execute: Runs the synth.
+        paths: The files and directories to watch.
+        extra_args: The synth's extra arguments.
+        outfile: Where each run writes its metadata.
+        interval: How often to check for changes, by default INTERVAL
+            (SYNTHTOOL_WATCH_INTERVAL).
+        max_runs: Stop after this many runs, by default never.
+    """
+    if interval is None:
+        interval = INTERVAL
+
+    runs = 0
+    while True:
+        before = snapshot(paths)
+        start = time.monotonic()
+        succeeded = _run(execute, extra_args, outfile)
+        runs += 1
+        if succeeded:
+            log.success(f"Synthesized in {time.monotonic() - start:.1f}s.")
+        if max_runs is not None and runs >= max_runs:
+            return
+
+        log.info(f"Watching {len(before)} files for changes.")
+        current = before
+        while current == before:
+            time.sleep(interval)
+            current = snapshot(paths)
+
+        # Let editors and checkouts finish writing before running again.
+        while True:
+            time.sleep(interval)
+            latest = snapshot(paths)
+            if latest == current:
+                break
+            current = latest
+
+        changed = changed_files(before, current)
+        shown = ", ".join(changed[:3]) + (", ..." if len(changed) > 3 else "")
+        log.info(f"{len(changed)} files changed: {shown}")
+        _log_affected_apis(changed)
@@ -0,0 +1,134 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The `synthtool` command, and the client of the synthtool daemon.
+
+`synthtool --use-daemon` hands the job to the daemon (see synthtool.daemon)
+from here, before synthtool, its dependencies and its update check are
+imported: that startup is what the daemon saves. This module must only
+import the standard library. Without a daemon, or for any other command,
+synthtool's own CLI is run.
+"""
+
+import array
+import json
+import os
+import pathlib
+import socket
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SOCKET_ENV = "SYNTHTOOL_DAEMON_SOCKET"
+# stdin, stdout and stderr.
+STANDARD_FDS = [0, 1, 2]
+# Commands other than `run`, which the daemon doesn't run.
+_OTHER_COMMANDS = ("batch", "daemon")
+
+
+def get_socket_path() -> pathlib.Path:
+    """Returns the socket of the daemon, SYNTHTOOL_DAEMON_SOCKET by default in
+    the synthtool cache."""
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return pathlib.Path(path)
+    return pathlib.Path.home() / ".cache" / "synthtool" / "daemon.sock"
+
+
+def read_line(connection: socket.socket, received: bytes = b"") -> bytes:
+    while not received.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk:
+            raise ConnectionError("The connection closed before a full message.")
+        received += chunk
+    return received
+
+
+def send(connection: socket.socket, message: Dict[str, Any]) -> None:
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def submit(
+    args: Sequence[str], socket_path: Optional[pathlib.Path] = None
+) -> Optional[int]:
+    """Runs `synthtool args...` in the daemon, from this directory and with
+    this process's environment and stdio.
+
+    Returns:
+        The job's exit code, or None if no daemon is listening or it refused
+        the job; run it locally then.
+    """
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    job = {"cwd": os.getcwd(), "args": list(args), "env": dict(os.environ)}
+    data = json.dumps(job).encode("utf-8") + b"\n"
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except OSError:
+            return None
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        fds = array.array("i", STANDARD_FDS)
+        sent = connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        connection.sendall(data[sent:])
+
+        response = json.loads(read_line(connection).decode("utf-8"))
+
+    if "error" in response:
+        sys.stderr.write(f"The daemon refused the job, {response['error']}.\n")
+        return None
+    return response["exit_code"]
+
+
+def _split(args: List[str]) -> Tuple[List[str], List[str]]:
+    """Splits the command line into options and the extra arguments after
+    "--", if any."""
+    if "--" not in args:
+        return list(args), []
+    separator = args.index("--")
+    return args[:separator], args[separator:]
+
+
+def _daemon_args(args: List[str]) -> Optional[List[str]]:
+    """Returns the arguments of `synthtool run` to send to the daemon, if
+    the command line asks for it."""
+    options, extra_args = _split(args)
+    if "--use-daemon" not in options or "--watch" in options:
+        return None
+    if options and options[0] in _OTHER_COMMANDS:
+        return None
+    if options and options[0] == "run":
+        options = options[1:]
+    return [option for option in options if option != "--use-daemon"] + extra_args
+
+
+def main() -> None:
+    """The entry point of the `synthtool` command."""
+    args = sys.argv[1:]
+    daemon_args = _daemon_args(args)
+    if daemon_args is not None:
+        exit_code = submit(daemon_args)
+        if exit_code is not None:
+            sys.exit(exit_code)
+        # Run locally, without trying the daemon again.
+        options, extra_args = _split(args)
+        options.remove("--use-daemon")
+        sys.argv[1:] = options + extra_args
+
+    from synthtool.__main__ import cli
+
+    cli()
@@ -0,0 +1,81 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from synthtool import cache
+from synthtool import context
+
+
+class GitRepo:
+    """A local git repository, on a master branch, for tests to commit to and
+    clone or index. With ``init=False``, an existing one, such as a clone."""
+
+    def __init__(self, path: Path, init: bool = True) -> None:
+        self.path = path
+        if init:
+            path.mkdir(parents=True, exist_ok=True)
+            self.git("init", "-q")
+            self.git("checkout", "-q", "-b", "master")
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+    def git(self, *args: str) -> str:
+        return subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+            + list(args),
+            cwd=str(self.path),
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout.decode("utf-8")
+
+    def commit(self, message: str = "change", files: Dict[str, str] = None) -> str:
+        """Writes ``files`` (paths relative to the repository, and their
+        contents), commits every change, and returns the new commit."""
+        for name, contents in (files or {}).items():
+            (self.path / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.path / name).write_text(contents)
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", message)
+        return self.head()
+
+    def head(self) -> str:
+        return self.git("rev-parse", "HEAD").strip()
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path_factory, monkeypatch):
+    """Points the synthtool cache at a temporary directory rather than the
+    user's, unless the context sets its own."""
+    cache_dir = tmp_path_factory.mktemp("cache")
+    get_cache_dir = cache.get_cache_dir
+
+    def get_isolated_cache_dir():
+        if context.current().cache_dir is None:
+            return cache_dir
+        return get_cache_dir()
+
+    monkeypatch.setattr(cache, "get_cache_dir", get_isolated_cache_dir)
+    return cache_dir
+
+
+@pytest.fixture
+def git_repo():
+    """Returns GitRepo, to create repositories with."""
+    return GitRepo
@@ -0,0 +1,112 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from synthtool import context
+from synthtool.gcp import artman
+from synthtool.gcp import docker
+
+CONFIG = Path("google/cloud/speech/artman_speech_v1.yaml")
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    """Fakes docker, recording the commands run."""
+    monkeypatch.setattr(artman, "_warm_containers", {})
+    monkeypatch.setattr(artman, "_output_root", None)
+    monkeypatch.setattr(docker, "pull", lambda image: f"{image}@sha256:abc123")
+    monkeypatch.setattr(
+        docker, "inspect", lambda image: {"Config": {"Env": ["ARTMAN_VERSION=1"]}}
+    )
+    commands = []
+
+    def run(args, **kwargs):
+        commands.append(args)
+        return subprocess.CompletedProcess(args, 0, "")
+
+    with mock.patch("synthtool.shell.run", side_effect=run):
+        yield commands
+
+
+def _docker_commands(commands):
+    return [args[:2] for args in commands if args[0] == "docker"]
+
+
+def test_run_starts_a_container_per_run(fake_docker, tmp_path):
+    a = artman.Artman(warm=False)
+    a.run(artman.ARTMAN_IMAGE, tmp_path, CONFIG, "python_gapic")
+    second = a.run(artman.ARTMAN_IMAGE, tmp_path, CONFIG, "python_gapic")
+
+    assert _docker_commands(fake_docker) == [["docker", "run"], ["docker", "run"]]
+    assert fake_docker[-1][-1] == (
+        f"artman --local --config {CONFIG} --output-dir {second} "
+        "generate python_gapic"
+    )
+
+
+def test_runs_are_isolated(fake_docker, tmp_path):
+    a = artman.Artman(warm=False)
+    first = a.run(artman.ARTMAN_IMAGE, tmp_path, CONFIG, "python_gapic")
+    second = a.run(artman.ARTMAN_IMAGE, tmp_path, CONFIG, "python_gapic")
+
+    assert first != second
+    assert first.is_dir() and second.is_dir()
+    assert first.parent == second.parent
+    assert tmp_path not in first.parents
+
+    container_names = [args[args.index("--name") + 1] for args in fake_docker[-2:]]
+    assert container_names[0] != container_names[1]
+
+
+def test_run_reuses_warm_container(fake_docker, tmp_path):
+    a = artman.Artman(warm=True)
+    a.run(artman.ARTMAN_IMAGE, tmp_path, CONFIG, "python_gapic")
+    a.run(artman.ARTMAN_IMAGE, tmp_path, CONFIG, "java_gapic")
+
+    assert _docker_commands(fake_docker) == [
+        ["docker", "run"],
+        ["docker", "exec"],
+        ["docker", "exec"],
+    ]
+    container_name = fake_docker[-1][fake_docker[-1].index("/bin/bash") - 1]
+    assert container_name in fake_docker[-3]
+    user = fake_docker[-1][fake_docker[-1].index("--user") + 1]
+    assert user == f"{os.getuid()}:{os.getgid()}"
+    assert "-d" in fake_docker[-3]
+    assert f"{artman._output_root}:{artman._output_root}" in fake_docker[-3]
+
+    artman.stop_warm_containers()
+
+    assert fake_docker[-1] == ["docker", "rm", "-f", container_name]
+    assert artman._warm_containers == {}
+
+
+def test_warm_containers_stop_with_the_default_context(
+    fake_docker, monkeypatch, tmp_path
+):
+    default = context.SynthContext()
+    monkeypatch.setattr(context, "_default", default)
+    artman.Artman(warm=True).run(artman.ARTMAN_IMAGE, tmp_path, CONFIG, "python")
+    container_name = fake_docker[-1][fake_docker[-1].index("/bin/bash") - 1]
+
+    default.close()
+
+    assert fake_docker[-1] == ["docker", "rm", "-f", container_name]
+    assert not artman._output_root.exists()
@@ -0,0 +1,130 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from synthtool import _async
+from synthtool import metadata
+from synthtool import shell
+from synthtool.gcp import common
+from synthtool.gcp.gapic_microgenerator import GAPICMicrogenerator
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def test_run_async(loop, tmp_path):
+    result = loop.run_until_complete(
+        shell.run_async(
+            [sys.executable, "-c", "import os; print(os.getcwd())"], cwd=tmp_path
+        )
+    )
+    assert result.returncode == 0
+    assert result.stdout.strip() == str(tmp_path)
+
+
+def test_run_async_raises_failures(loop):
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        loop.run_until_complete(
+            shell.run_async([sys.executable, "-c", "print('oops'); exit(3)"])
+        )
+    assert exc.value.returncode == 3
+    assert exc.value.output.strip() == "oops"
+
+    result = loop.run_until_complete(
+        shell.run_async([sys.executable, "-c", "exit(3)"], check=False)
+    )
+    assert result.returncode == 3
+
+
+def test_call_runs_concurrently_and_records_metadata(loop):
+    metadata.reset()
+    both_running = threading.Barrier(2, timeout=5)
+
+    def generate(version):
+        both_running.wait()
+        metadata.add_client_destination(api_name="speech", api_version=version)
+        return version
+
+    async def main():
+        return await asyncio.gather(
+            _async.call(generate, "v1"), _async.call(generate, "v2")
+        )
+
+    assert loop.run_until_complete(main()) == ["v1", "v2"]
+    versions = {d.client.api_version for d in metadata.get().destinations}
+    assert versions == {"v1", "v2"}
+
+
+def test_library_async_wraps_library(loop, monkeypatch):
+    generator = GAPICMicrogenerator(backend="native")
+    calls = []
+
+    def generate_code(service, version, language, **kwargs):
+        calls.append((service, version, language, kwargs))
+        return Path("/genfiles")
+
+    monkeypatch.setattr(generator, "_generate_code", generate_code)
+    result = loop.run_until_complete(
+        generator.py_library_async("speech", "v1", proto_path="google/cloud/speech/v1")
+    )
+
+    assert result == Path("/genfiles")
+    assert calls == [
+        ("speech", "v1", "python", {"proto_path": "google/cloud/speech/v1"})
+    ]
+
+
+def test_library_async_calls_of_an_instance_keep_their_excludes(
+    loop, monkeypatch, tmp_path
+):
+    monkeypatch.chdir(tmp_path)
+    rendered = {}
+
+    class TemplateGroup:
+        def __init__(self, location, excludes):
+            self.name = Path(location).name
+            self.excludes = excludes
+
+        def render(self, **kwargs):
+            rendered[self.name] = list(self.excludes)
+            return tmp_path
+
+    monkeypatch.setattr(common.templates, "TemplateGroup", TemplateGroup)
+    monkeypatch.setattr(common, "_load_repo_metadata", lambda root: None)
+    t = common.CommonTemplates()
+
+    async def main():
+        # Without samples, ruby_library excludes samples/README.md.
+        await asyncio.gather(t.ruby_library_async(), t.py_library_async())
+
+    loop.run_until_complete(main())
+
+    assert rendered == {
+        "ruby_library": ["samples/README.md"],
+        "python_library": [],
+    }
+    assert t.excludes == []
@@ -0,0 +1,85 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from synthtool import metadata
+from synthtool.gcp import batch
+
+
+def test_generate_many_keeps_input_order():
+    metadata.reset()
+    lock = threading.Lock()
+    running = set()
+    most_running = []
+    # Raises BrokenBarrierError unless all three generations run at once.
+    all_running = threading.Barrier(3, timeout=5)
+
+    def generate(service, version, language, delay=0):
+        with lock:
+            running.add(version)
+        try:
+            all_running.wait()
+            with lock:
+                most_running.append(len(running))
+            # Later specs finish first.
+            time.sleep(delay)
+            metadata.add_client_destination(
+                api_name=service, api_version=version, language=language
+            )
+            return Path(f"/genfiles/{service}-{version}")
+        finally:
+            with lock:
+                running.remove(version)
+
+    specs = [
+        batch.GenerationSpec("speech", f"v{i}", "python", {"delay": 0.05 * (3 - i)})
+        for i in range(3)
+    ]
+    results = batch.generate_many(generate, specs, max_workers=3)
+
+    assert max(most_running) == 3
+    assert not running
+    assert results == [Path(f"/genfiles/speech-v{i}") for i in range(3)]
+    versions = [d.client.api_version for d in metadata.get().destinations]
+    assert versions == ["v0", "v1", "v2"]
+
+
+def test_generate_many_raises_failures():
+    metadata.reset()
+
+    def generate(service, version, language):
+        if version == "v2":
+            raise FileNotFoundError(version)
+        return Path(version)
+
+    specs = [batch.GenerationSpec("speech", v, "python") for v in ("v1", "v2")]
+    with pytest.raises(FileNotFoundError):
+        batch.generate_many(generate, specs)
+
+
+def test_capture():
+    metadata.reset()
+    metadata.add_git_source(name="before")
+
+    with metadata.capture() as captured:
+        metadata.add_git_source(name="captured")
+
+    assert [s.git.name for s in metadata.get().sources] == ["before"]
+    metadata.merge(captured)
+    assert [s.git.name for s in metadata.get().sources] == ["before", "captured"]
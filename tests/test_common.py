@@ -12,7 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from synthtool.gcp.common import decamelize
+import os
+
+from synthtool import _tracked_paths
+from synthtool import transforms
+from synthtool.gcp.common import CommonTemplates, decamelize
 
 
 def test_converts_camel_to_title():
@@ -29,3 +33,18 @@ def test_handles_acronym():
 def test_handles_empty_string():
     assert decamelize(None) == ""
     assert decamelize("") == ""
+
+
+def test_render_into_destination_moves_nothing(tmp_path):
+    cwd = os.getcwd()
+    os.chdir(str(tmp_path))
+    try:
+        result = CommonTemplates(destination=tmp_path).py_library()
+        rendered = sorted(tmp_path.rglob("*"))
+
+        assert result not in _tracked_paths.get()
+        # Synthfiles written for temporary directories still move the result.
+        assert not transforms.move([result])
+        assert sorted(tmp_path.rglob("*")) == rendered
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,100 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import json
+import subprocess
+import sys
+
+from synthtool import __main__
+from synthtool import _tracked_paths
+from synthtool import cache
+from synthtool import context
+from synthtool import metadata
+from synthtool import tmp
+
+
+def test_contexts_are_isolated(tmp_path):
+    metadata.reset()
+    first = context.SynthContext(extra_args=["--first"], cache_dir=tmp_path / "a")
+    second = context.SynthContext(extra_args=["--second"])
+
+    with context.activate(first):
+        metadata.add_client_destination(api_name="speech")
+        _tracked_paths.add(tmp_path)
+        assert __main__.extra_args() == ["--first"]
+        assert cache.get_cache_dir() == tmp_path / "a"
+        with context.activate(second):
+            assert __main__.extra_args() == ["--second"]
+            assert not metadata.get().destinations
+        assert context.current() is first
+
+    assert context.current() is context.default()
+    assert [d.client.api_name for d in first.metadata.destinations] == ["speech"]
+    assert first.tracked_paths == [tmp_path]
+    assert not metadata.get().destinations
+
+
+def test_close_runs_exit_hooks_and_removes_tempdirs(tmp_path):
+    outfile = tmp_path / "synth.metadata"
+
+    with context.SynthContext() as ctx:
+        with context.activate(ctx):
+            metadata.add_client_destination(api_name="speech")
+            metadata.register_exit_hook(outfile=str(outfile))
+            tempdir = tmp.tmpdir()
+        assert tempdir.exists()
+        assert not outfile.exists()
+
+    assert not tempdir.exists()
+    written = json.loads(outfile.read_text())
+    assert written["destinations"] == [{"client": {"apiName": "speech"}}]
+
+
+def test_bind_carries_the_context_to_threads():
+    ctx = context.SynthContext()
+
+    def add(version):
+        metadata.add_client_destination(api_name="speech", api_version=version)
+        return context.current()
+
+    with context.activate(ctx):
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            used = list(executor.map(context.bind(add), [f"v{i}" for i in range(20)]))
+
+    assert all(current is ctx for current in used)
+    assert len(ctx.metadata.destinations) == 20
+
+
+def test_default_context_closes_without_logging(tmp_path):
+    # Logs to a stream closed before exit, like pytest's captured output.
+    script = (
+        "import logging\n"
+        "from synthtool import log, metadata, tmp\n"
+        "stream = open('log.txt', 'w')\n"
+        "log.logger.addHandler(logging.StreamHandler(stream))\n"
+        "metadata.register_exit_hook(outfile='synth.metadata')\n"
+        "tmp.tmpdir()\n"
+        "stream.close()\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=str(tmp_path),
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+    )
+
+    assert result.returncode == 0
+    assert (tmp_path / "synth.metadata").exists()
+    assert "Logging error" not in result.stderr
@@ -0,0 +1,156 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+import synthtool_client
+
+SYNTH = """
+import os
+import sys
+
+from synthtool import metadata
+from synthtool.__main__ import extra_args
+
+metadata.add_client_destination(api_name="speech")
+print("pid", os.getpid(), "args", " ".join(extra_args()))
+sys.exit(int(os.environ.get("EXIT_CODE", "0")))
+"""
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    path = tmp_path / "daemon.sock"
+    monkeypatch.setenv("SYNTHTOOL_DAEMON_SOCKET", str(path))
+    # The daemon preloads the templates, caching their variables under ~/.cache.
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    server = subprocess.Popen([sys.executable, "-m", "synthtool", "daemon"])
+    try:
+        for _ in range(100):
+            if path.exists():
+                break
+            time.sleep(0.1)
+        yield path
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait(10)
+    assert not path.exists()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    (tmp_path / "repo").mkdir()
+    (tmp_path / "repo" / "synth.py").write_text(SYNTH)
+    return tmp_path / "repo"
+
+
+# Where synthtool_client is, whether or not it's installed.
+CLIENT_DIR = os.path.dirname(os.path.abspath(synthtool_client.__file__))
+# What the `synthtool` command runs.
+CLIENT = [sys.executable, "-c", "import synthtool_client; synthtool_client.main()"]
+
+
+def _run(repo, *args, command=CLIENT, **env):
+    return subprocess.run(
+        [*command, "--use-daemon", *args],
+        cwd=str(repo),
+        env={**os.environ, "PYTHONPATH": CLIENT_DIR, **env},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+    )
+
+
+def _pid(output):
+    return int(re.search(r"pid (\d+)", output).group(1))
+
+
+def test_runs_in_the_daemon(socket_path, repo):
+    first = _run(repo, "synth.py", "--", "--foo")
+    second = _run(repo, "synth.py", "--", "--foo")
+
+    assert first.returncode == 0, first.stdout
+    # Each job runs in a child of the daemon, with the client's stdio.
+    assert "args --foo" in first.stdout
+    assert _pid(first.stdout) != _pid(second.stdout)
+    written = json.loads((repo / "synth.metadata").read_text())
+    assert written["destinations"] == [{"client": {"apiName": "speech"}}]
+
+
+def test_exit_code_is_returned(socket_path, repo):
+    result = _run(repo, EXIT_CODE="3")
+    assert result.returncode == 3
+
+
+def test_jobs_close_the_default_context(socket_path, repo):
+    (repo / "synth.py").write_text(
+        "from pathlib import Path\n"
+        "from synthtool import context, tmp\n"
+        "with context.activate(context.default()):\n"
+        "    Path('tmpdir.txt').write_text(str(tmp.tmpdir()))\n"
+    )
+    result = _run(repo)
+
+    assert result.returncode == 0, result.stdout
+    assert not os.path.exists((repo / "tmpdir.txt").read_text())
+
+
+def test_mismatched_settings_run_locally(socket_path, repo):
+    result = _run(repo, SYNTHTOOL_GENERATION_CACHE="0")
+
+    assert result.returncode == 0, result.stdout
+    assert "refused the job" in result.stdout
+    assert "args" in result.stdout
+
+
+def test_python_m_synthtool_uses_the_daemon(socket_path, repo):
+    result = _run(repo, command=[sys.executable, "-m", "synthtool"])
+
+    assert result.returncode == 0, result.stdout
+    assert "args" in result.stdout
+
+
+def test_client_does_not_import_synthtool(socket_path, repo):
+    check = (
+        "import atexit, sys, synthtool_client\n"
+        "atexit.register(lambda: print('imported', 'synthtool' in sys.modules))\n"
+        "synthtool_client.main()\n"
+    )
+    result = _run(repo, command=[sys.executable, "-c", check])
+
+    assert result.returncode == 0, result.stdout
+    assert "imported False" in result.stdout
+
+
+def test_daemon_args():
+    assert synthtool_client._daemon_args(["--use-daemon", "--", "--use-daemon"]) == [
+        "--",
+        "--use-daemon",
+    ]
+    assert synthtool_client._daemon_args(["run", "--use-daemon", "s.py"]) == ["s.py"]
+    assert synthtool_client._daemon_args(["s.py", "--", "--use-daemon"]) is None
+    assert synthtool_client._daemon_args(["--use-daemon", "--watch"]) is None
+    assert synthtool_client._daemon_args(["batch", "--use-daemon"]) is None
+
+
+def test_submit_without_daemon(tmp_path):
+    assert synthtool_client.submit(["synth.py"], tmp_path / "missing.sock") is None
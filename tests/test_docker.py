@@ -0,0 +1,77 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import subprocess
+from unittest import mock
+
+import pytest
+
+from synthtool import cache
+from synthtool.gcp import docker
+
+IMAGE = "googleapis/artman:latest"
+DIGEST = "googleapis/artman@sha256:abc123"
+
+
+@pytest.fixture
+def fake_docker(monkeypatch, tmp_path):
+    """Fakes the docker CLI with a single image, which appears once pulled."""
+    monkeypatch.setattr(cache, "get_cache_dir", lambda: tmp_path)
+    monkeypatch.setattr(docker, "_inspected", {})
+    present = set()
+
+    def run(args, **kwargs):
+        if args[:2] == ["docker", "pull"]:
+            present.add(args[2])
+            return subprocess.CompletedProcess(args, 0, "")
+        if args[:3] == ["docker", "image", "inspect"]:
+            if args[3] not in present:
+                return subprocess.CompletedProcess(args, 1, "No such image")
+            info = [{"Id": "sha256:def456", "RepoDigests": [DIGEST]}]
+            return subprocess.CompletedProcess(args, 0, json.dumps(info))
+        raise AssertionError(f"Unexpected command {args}")
+
+    with mock.patch("synthtool.shell.run", side_effect=run) as shell_run:
+        yield shell_run
+
+
+def _pulls(shell_run):
+    return [c for c in shell_run.call_args_list if c[0][0][:2] == ["docker", "pull"]]
+
+
+def test_pull(fake_docker):
+    assert docker.pull(IMAGE) == DIGEST
+    assert len(_pulls(fake_docker)) == 1
+    assert docker.cached_digest(IMAGE) == DIGEST
+
+
+def test_pull_skipped_within_ttl(fake_docker, monkeypatch):
+    docker.pull(IMAGE)
+    # A new process only has the on-disk cache.
+    monkeypatch.setattr(docker, "_inspected", {})
+
+    assert docker.pull(IMAGE) == DIGEST
+    assert len(_pulls(fake_docker)) == 1
+
+    assert docker.pull(IMAGE, ttl=0) == DIGEST
+    assert len(_pulls(fake_docker)) == 2
+
+
+def test_pull_pinned_digest(fake_docker):
+    docker.pull(DIGEST)
+    assert len(_pulls(fake_docker)) == 1
+
+    docker.pull(DIGEST)
+    assert len(_pulls(fake_docker)) == 1
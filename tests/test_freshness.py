@@ -0,0 +1,216 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+
+from synthtool import __main__
+from synthtool import context
+from synthtool import freshness
+from synthtool import lock
+from synthtool import metadata
+from synthtool import shell
+from synthtool.gcp import docker
+
+REMOTE = "https://github.com/googleapis/googleapis.git"
+IMAGE = "gcr.io/gapic-images/gapic-generator-python"
+
+
+@pytest.fixture
+def synth(monkeypatch, tmp_path):
+    """A synth.py run a minute ago, with a git, generator and template source."""
+    monkeypatch.delenv("SYNTHTOOL_GOOGLEAPIS", raising=False)
+    monkeypatch.delenv("SYNTHTOOL_GENERATOR", raising=False)
+    remote_sha = {"sha": "abc123"}
+    run = shell.run
+
+    def fake_run(args, **kwargs):
+        if args[:2] == ["git", "ls-remote"]:
+            return subprocess.CompletedProcess(
+                args, 0, f"{remote_sha['sha']}\trefs/heads/master\n"
+            )
+        return run(args, **kwargs)
+
+    monkeypatch.setattr(shell, "run", fake_run)
+    monkeypatch.setattr(
+        docker,
+        "cached_digest",
+        lambda image: f"{IMAGE}@sha256:def456" if image == f"{IMAGE}:latest" else None,
+    )
+
+    metadata.reset()
+    metadata.add_git_source(name="googleapis", remote=REMOTE, sha="abc123")
+    metadata.add_generator_source(
+        name="gapic-generator-python",
+        version="latest",
+        docker_image=f"{IMAGE}@sha256:def456",
+    )
+    metadata.add_template_source(name="python_library", version=__main__.VERSION)
+
+    synth_file = tmp_path / "synth.py"
+    synth_file.write_text("")
+    os.utime(str(synth_file), (0, 0))
+    metadata_file = tmp_path / "synth.metadata"
+    metadata.get().synth_succeeded = True
+    metadata.write(str(metadata_file))
+    metadata.reset()
+
+    return synth_file, metadata_file, remote_sha
+
+
+def test_unchanged(synth):
+    synth_file, metadata_file, _ = synth
+    unchanged, reason = freshness.check(str(synth_file), str(metadata_file))
+    assert unchanged
+    assert "none of the 3 sources" in reason
+
+
+def test_git_source_moved(synth):
+    synth_file, metadata_file, remote_sha = synth
+    remote_sha["sha"] = "fed321"
+    unchanged, reason = freshness.check(str(synth_file), str(metadata_file))
+    assert not unchanged
+    assert reason == "googleapis moved from abc123"
+
+
+def test_image_not_resolved_recently(synth, monkeypatch):
+    synth_file, metadata_file, _ = synth
+    monkeypatch.setattr(docker, "cached_digest", lambda image: None)
+    unchanged, reason = freshness.check(str(synth_file), str(metadata_file))
+    assert not unchanged
+    assert "wasn't resolved recently" in reason
+
+
+def test_failed_run(synth, tmp_path):
+    synth_file, _, _ = synth
+    synth_file.write_text(
+        "from synthtool import metadata\n"
+        "metadata.add_template_source(name='python_library', version='1')\n"
+        "raise RuntimeError('oops')\n"
+    )
+    os.utime(str(synth_file), (0, 0))
+    metadata_file = tmp_path / "failed.metadata"
+
+    with context.SynthContext() as synth_context:
+        with context.activate(synth_context):
+            metadata.register_exit_hook(outfile=str(metadata_file))
+            with pytest.raises(RuntimeError):
+                __main__.execute(str(synth_file))
+
+    unchanged, reason = freshness.check(str(synth_file), str(metadata_file))
+    assert not unchanged
+    assert reason == f"the run that wrote {metadata_file} failed"
+
+
+def test_locked_sources(synth, monkeypatch, tmp_path_factory):
+    synth_file, metadata_file, remote_sha = synth
+    lock_file = tmp_path_factory.mktemp("lock") / "synth.lock"
+    lock_file.write_text(
+        json.dumps(
+            {
+                "git": {REMOTE: {"master": "abc123"}},
+                "images": {f"{IMAGE}:latest": f"{IMAGE}@sha256:def456"},
+            }
+        )
+    )
+    lock.configure(str(lock_file), lock.LOCKED)
+    try:
+        # What upstream moved to doesn't matter, nor what was resolved lately.
+        remote_sha["sha"] = "fed321"
+        monkeypatch.setattr(docker, "cached_digest", lambda image: None)
+        assert freshness.check(str(synth_file), str(metadata_file))[0]
+
+        # But what the lock pins does.
+        lock_file.write_text(
+            json.dumps(
+                {
+                    "git": {REMOTE: {"master": "abc123"}},
+                    "images": {f"{IMAGE}:latest": f"{IMAGE}@sha256:aaa000"},
+                }
+            )
+        )
+        lock.configure(str(lock_file), lock.LOCKED)
+        unchanged, reason = freshness.check(str(synth_file), str(metadata_file))
+        assert not unchanged
+        assert reason == f"{IMAGE}:latest moved from {IMAGE}@sha256:def456"
+    finally:
+        lock.configure(str(lock_file), lock.OFF)
+
+
+def test_synth_file_changed(synth):
+    synth_file, metadata_file, _ = synth
+    synth_file.write_text("print('changed')")
+    assert freshness.check(str(synth_file), str(metadata_file))[0] is False
+
+
+def test_repo_files_changed(synth, monkeypatch, git_repo):
+    synth_file, metadata_file, _ = synth
+    repo = git_repo(synth_file.parent)
+    monkeypatch.setenv("GIT_COMMITTER_DATE", "1000000000 +0000")
+    repo.commit("synth")
+    assert freshness.check(str(synth_file), str(metadata_file))[0]
+
+    # A sample added since, which templates read.
+    sample = synth_file.parent / "samples" / "quickstart.js"
+    sample.parent.mkdir()
+    sample.write_text("// sample")
+    written = metadata_file.stat().st_mtime
+    os.utime(str(sample), (written + 10, written + 10))
+    unchanged, reason = freshness.check(str(synth_file), str(metadata_file))
+    assert not unchanged
+    assert reason == f"{synth_file.parent} changed since {metadata_file} was written"
+
+    # Then committed, checkouts don't keep its mtime.
+    monkeypatch.setenv("GIT_COMMITTER_DATE", "1000000100 +0000")
+    repo.commit("sample")
+    os.utime(str(sample), (0, 0))
+    assert not freshness.check(str(synth_file), str(metadata_file))[0]
+
+
+def test_output_of_the_last_run_is_unchanged(synth, git_repo):
+    synth_file, metadata_file, _ = synth
+    git_repo(synth_file.parent).commit("synth")
+    output = synth_file.parent / "README.md"
+    output.write_text("generated")
+    os.utime(str(output), (0, 0))
+
+    assert freshness.check(str(synth_file), str(metadata_file))[0]
+
+
+def test_local_googleapis(synth, monkeypatch):
+    synth_file, metadata_file, _ = synth
+    monkeypatch.setenv("SYNTHTOOL_GOOGLEAPIS", "/googleapis")
+    assert freshness.check(str(synth_file), str(metadata_file))[0] is False
+
+
+def test_main_skips_unchanged(synth, monkeypatch):
+    synth_file, metadata_file, _ = synth
+    synth_file.write_text("raise AssertionError('executed')")
+    os.utime(str(synth_file), (0, 0))
+    monkeypatch.setattr(metadata, "register_exit_hook", lambda **kwargs: None)
+
+    result = CliRunner().invoke(
+        __main__.main,
+        [str(synth_file), "--metadata", str(metadata_file), "--skip-if-unchanged"],
+    )
+    assert result.exit_code == 0
+
+    result = CliRunner().invoke(
+        __main__.main, [str(synth_file), "--metadata", str(metadata_file)]
+    )
+    assert "executed" in str(result.exception)
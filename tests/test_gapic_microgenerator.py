@@ -0,0 +1,141 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import sys
+from unittest import mock
+
+import pytest
+
+from synthtool import cache
+from synthtool import metadata
+from synthtool import shell
+from synthtool.gcp import descriptors
+from synthtool.gcp import gapic_microgenerator
+
+# A generator plugin writing a file per proto, listing its messages.
+PLUGIN = f"""#!{sys.executable}
+import sys
+from google.protobuf.compiler import plugin_pb2
+
+request = plugin_pb2.CodeGeneratorRequest.FromString(sys.stdin.buffer.read())
+response = plugin_pb2.CodeGeneratorResponse()
+for proto in request.proto_file:
+    if proto.name in request.file_to_generate:
+        generated = response.file.add()
+        generated.name = proto.name.replace(".proto", ".txt")
+        messages = [message.name for message in proto.message_type]
+        generated.content = request.parameter + "\\n" + "\\n".join(messages)
+sys.stdout.buffer.write(response.SerializeToString())
+"""
+
+
+requires_protoc = pytest.mark.skipif(
+    shutil.which("protoc") is None, reason="protoc is required"
+)
+
+
+@pytest.fixture
+def googleapis(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "get_cache_dir", lambda: tmp_path / "cache")
+    monkeypatch.setattr(descriptors, "_descriptor_sets", {})
+    root = tmp_path / "googleapis"
+    (root / "google/cloud/speech/v1").mkdir(parents=True)
+    (root / "google/cloud/speech/v1/speech.proto").write_text(
+        'syntax = "proto3";\n'
+        "package google.cloud.speech.v1;\n"
+        'import "google/type/audio.proto";\n'
+        "message RecognizeRequest { google.type.Audio audio = 1; }\n"
+    )
+    (root / "google/type").mkdir(parents=True)
+    (root / "google/type/audio.proto").write_text(
+        'syntax = "proto3";\npackage google.type;\nmessage Audio {}\n'
+    )
+    monkeypatch.setattr(gapic_microgenerator, "LOCAL_GOOGLEAPIS", str(root))
+    return root
+
+
+@pytest.fixture
+def plugin(tmp_path):
+    path = tmp_path / "protoc-gen-fake"
+    path.write_text(PLUGIN)
+    path.chmod(0o755)
+    return path
+
+
+@requires_protoc
+def test_native_backend(googleapis, plugin, tmp_path):
+    metadata.reset()
+    gapic = gapic_microgenerator.GAPICMicrogenerator(
+        backend="native", plugins={"python": str(plugin)}
+    )
+
+    output_dir = gapic.py_library(
+        "speech", "v1", output_dir=tmp_path, generator_args={"a": "b"}
+    )
+
+    generated = output_dir / "google/cloud/speech/v1/speech.txt"
+    assert generated.read_text() == "a=b\nRecognizeRequest"
+    client = metadata.get().destinations[0].client
+    assert client.generator == "gapic-generator-python"
+
+
+@requires_protoc
+def test_native_backend_parses_protos_once(googleapis, plugin, tmp_path):
+    gapic = gapic_microgenerator.GAPICMicrogenerator(
+        backend="native", plugins={"python": str(plugin), "go": str(plugin)}
+    )
+
+    def parses():
+        return [
+            args for (args,), _ in run.call_args_list if "--include_imports" in args
+        ]
+
+    with mock.patch("synthtool.shell.run", side_effect=shell.run) as run:
+        python = gapic.py_library("speech", "v1")
+        go = gapic.go_library("speech", "v1")
+        assert len(parses()) == 1
+
+        # The parsed protos are cached on disk too.
+        descriptors._descriptor_sets.clear()
+        gapic.py_library("speech", "v1")
+        assert len(parses()) == 1
+
+        # Changing an import invalidates them.
+        (googleapis / "google/type/audio.proto").write_text(
+            'syntax = "proto3";\npackage google.type;\nmessage Audio { int32 a = 1; }\n'
+        )
+        gapic.py_library("speech", "v1")
+        assert len(parses()) == 2
+
+    for output_dir in (python, go):
+        generated = output_dir / "google/cloud/speech/v1/speech.txt"
+        assert generated.read_text() == "\nRecognizeRequest"
+    # Only the protos in proto_path are generated, not their imports.
+    assert not (python / "google/type").exists()
+
+
+def test_native_backend_requires_a_plugin(monkeypatch, googleapis):
+    monkeypatch.delenv("SYNTHTOOL_GAPIC_GENERATOR_GO", raising=False)
+    with mock.patch("synthtool.shell.run") as shell_run:
+        shell_run.return_value.returncode = 0
+        gapic = gapic_microgenerator.GAPICMicrogenerator(backend="native")
+
+    with pytest.raises(EnvironmentError, match="SYNTHTOOL_GAPIC_GENERATOR_GO"):
+        gapic.go_library("speech", "v1")
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        gapic_microgenerator.GAPICMicrogenerator(backend="podman")
@@ -0,0 +1,155 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import subprocess
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from synthtool import cache
+from synthtool import metadata
+from synthtool.gcp import docker
+from synthtool.gcp import gapic_generator
+from synthtool.gcp import gapic_microgenerator
+from synthtool.gcp import generation_cache
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "get_cache_dir", lambda: tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def googleapis(tmp_path):
+    root = tmp_path / "googleapis"
+    (root / "google/cloud/speech/v1").mkdir(parents=True)
+    (root / "google/cloud/speech/v1/speech.proto").write_text("syntax = 'proto3';")
+    (root / "google/api").mkdir(parents=True)
+    (root / "google/api/annotations.proto").write_text("syntax = 'proto3';")
+    return root
+
+
+def test_hash_tree_changes_with_contents(googleapis):
+    paths = ["google/cloud/speech", "google/api"]
+    before = generation_cache.hash_tree(googleapis, paths)
+    assert generation_cache.hash_tree(googleapis, reversed(paths)) == before
+
+    (googleapis / "google/cloud/speech/v1/speech.proto").write_text("changed")
+    assert generation_cache.hash_tree(googleapis, paths) != before
+
+
+def test_hash_tree_changes_with_names(googleapis):
+    before = generation_cache.hash_tree(googleapis, ["google/api"])
+    (googleapis / "google/api/annotations.proto").rename(
+        googleapis / "google/api/http.proto"
+    )
+    assert generation_cache.hash_tree(googleapis, ["google/api"]) != before
+
+
+def test_store_and_restore(cache_dir, tmp_path):
+    key = generation_cache.make_key(generator="gen", inputs="abc")
+    assert generation_cache.restore(key) is None
+
+    source = tmp_path / "source"
+    (source / "pkg").mkdir(parents=True)
+    (source / "pkg/module.py").write_text("generated")
+    (source / "setup.py").write_text("setup()")
+    generation_cache.store(key, source)
+
+    destination = tmp_path / "destination"
+    destination.mkdir()
+    assert generation_cache.restore(key, destination) == destination
+    assert (destination / "pkg/module.py").read_text() == "generated"
+    assert (destination / "setup.py").read_text() == "setup()"
+    # Nothing but the entry itself is left behind in the cache.
+    assert [path.name for path in (cache_dir / "generated").iterdir()] == [key]
+
+
+def test_make_key_depends_on_every_part():
+    key = generation_cache.make_key(image="a", generator_args=None)
+    assert key == generation_cache.make_key(generator_args=None, image="a")
+    assert key != generation_cache.make_key(image="b", generator_args=None)
+    assert key != generation_cache.make_key(image="a", generator_args={"x": "y"})
+
+
+def test_artman_inputs(googleapis):
+    config_path = Path("google/cloud/speech/artman_speech_v1.yaml")
+    (googleapis / config_path).write_text(
+        "common:\n"
+        "  src_proto_paths:\n"
+        "    - v1\n"
+        "    - ../../devtools/source/v1\n"
+    )
+    (googleapis / "google/cloud/speech/v1/speech.proto").write_text(
+        'import "google/api/annotations.proto";\n'
+        'import "google/cloud/audit/audit_log.proto";\n'
+        'import "google/protobuf/empty.proto";\n'
+    )
+    (googleapis / "google/cloud/audit").mkdir(parents=True)
+    (googleapis / "google/cloud/audit/audit_log.proto").write_text(
+        'import "google/logging/type/log_severity.proto";\n'
+    )
+    (googleapis / "google/logging/type").mkdir(parents=True)
+    (googleapis / "google/logging/type/log_severity.proto").write_text("")
+    (googleapis / "google/logging/type/http_request.proto").write_text("")
+
+    inputs = gapic_generator._artman_inputs(googleapis, config_path)
+
+    # Only the imported protos, not their whole directories.
+    assert inputs == [
+        Path("google/cloud/speech"),
+        Path("google/devtools/source/v1"),
+        Path("google/api/annotations.proto"),
+        Path("google/cloud/audit/audit_log.proto"),
+        Path("google/logging/type/log_severity.proto"),
+    ]
+
+    before = generation_cache.hash_tree(googleapis, inputs)
+    (googleapis / "google/logging/type/log_severity.proto").write_text("changed")
+    after = generation_cache.hash_tree(
+        googleapis, gapic_generator._artman_inputs(googleapis, config_path)
+    )
+    assert after != before
+
+
+def test_microgenerator_restores_cached_output(
+    monkeypatch, cache_dir, googleapis, tmp_path
+):
+    monkeypatch.setattr(gapic_microgenerator, "LOCAL_GOOGLEAPIS", str(googleapis))
+    monkeypatch.setattr(docker, "pull", lambda image: f"{image}@sha256:abc123")
+    generated = []
+
+    def run(args, **kwargs):
+        if args[:2] == ["docker", "run"]:
+            source = re.search(r"source=([^,]+)/,destination=/out", " ".join(args))
+            Path(source.group(1), "client.py").write_text("generated")
+            generated.append(args)
+        return subprocess.CompletedProcess(args, 0, "")
+
+    (tmp_path / "first").mkdir()
+    (tmp_path / "second").mkdir()
+    with mock.patch("synthtool.shell.run", side_effect=run):
+        metadata.reset()
+        gapic = gapic_microgenerator.GAPICMicrogenerator()
+        first = gapic.py_library("speech", "v1", output_dir=tmp_path / "first")
+        second = gapic.py_library("speech", "v1", output_dir=tmp_path / "second")
+
+    assert len(generated) == 1
+    assert (first / "client.py").read_text() == "generated"
+    assert (second / "client.py").read_text() == "generated"
+    destinations = metadata.get().destinations
+    assert [d.client.generation_cache for d in destinations] == ["miss", "hit"]
@@ -16,6 +16,7 @@ from unittest import mock
 
 import pytest
 
+from synthtool import shell
 from synthtool.sources import git
 
 
@@ -67,3 +68,42 @@ Two: 1234
     metadata = git.extract_commit_message_metadata(message)
 
     assert metadata == {"One": "Hello!", "Two": "1234"}
+
+
+def test_clone_pulls_once_per_batch(tmp_path, monkeypatch, git_repo):
+    upstream = git_repo(tmp_path / "upstream")
+    upstream.commit("hello", files={"file.txt": "hello"})
+
+    monkeypatch.setenv(git.BATCH_ID_ENV, "first")
+    git.clone(str(upstream), dest=tmp_path / "cache")
+    with mock.patch("synthtool.shell.run") as run:
+        git.clone(str(upstream), dest=tmp_path / "cache")
+    run.assert_not_called()
+
+    monkeypatch.setenv(git.BATCH_ID_ENV, "second")
+    with mock.patch("synthtool.shell.run", side_effect=shell.run) as run:
+        git.clone(str(upstream), dest=tmp_path / "cache")
+    assert [call[0][0][:2] for call in run.call_args_list] == [
+        ["git", "pull"],
+        ["git", "reset"],
+    ]
+
+
+def test_clone_per_committish_in_batch(tmp_path, monkeypatch, git_repo):
+    upstream = git_repo(tmp_path / "upstream")
+    upstream.commit("hello", files={"file.txt": "hello"})
+    upstream.git("branch", "stable")
+
+    # Outside of a batch, one clone is shared.
+    cache = tmp_path / "cache"
+    assert git.get_clone_path(str(upstream), cache, "origin/stable") == (
+        cache / "upstream"
+    )
+
+    monkeypatch.setenv(git.BATCH_ID_ENV, "batch")
+    master = git.clone(str(upstream), dest=cache)
+    stable = git.clone(str(upstream), dest=cache, committish="origin/stable")
+
+    assert master == cache / "upstream"
+    assert stable == cache / "upstream@origin_stable"
+    assert (stable / "file.txt").read_text() == "hello"
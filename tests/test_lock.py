@@ -0,0 +1,179 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import subprocess
+from unittest import mock
+
+import pytest
+
+from synthtool import lock
+from synthtool import metadata
+from synthtool import shell
+from synthtool.gcp import docker
+from synthtool.sources import git
+
+IMAGE = "googleapis/artman:latest"
+DIGEST = "googleapis/artman@sha256:abc123"
+
+
+@pytest.fixture
+def lock_file(tmp_path):
+    metadata.reset()
+    yield tmp_path / "synth.lock"
+    lock.configure(str(tmp_path / "synth.lock"), lock.OFF)
+
+
+def _commit(upstream, contents):
+    return upstream.commit(contents, files={"file.txt": contents})
+
+
+@pytest.fixture
+def upstream(tmp_path, git_repo):
+    return git_repo(tmp_path / "upstream")
+
+
+def test_clone_records_and_uses_locked_sha(lock_file, upstream, tmp_path, git_repo):
+    first = _commit(upstream, "first")
+    lock.configure(str(lock_file), lock.UPDATE)
+    git.clone(str(upstream), dest=tmp_path / "update")
+    lock.write()
+
+    assert json.loads(lock_file.read_text())["git"] == {
+        str(upstream): {"master": first}
+    }
+
+    # Upstream moves on, but the locked commit is used, without pulling.
+    _commit(upstream, "second")
+    lock.configure(str(lock_file), lock.LOCKED)
+    with mock.patch("synthtool.shell.run", side_effect=shell.run) as run:
+        locked = git.clone(str(upstream), dest=tmp_path / "update")
+        fresh = git.clone(str(upstream), dest=tmp_path / "fresh")
+
+    assert ["git", "pull"] not in [args for (args,), _ in run.call_args_list]
+    for clone in (locked, fresh):
+        assert git_repo(clone, init=False).head() == first
+        assert (clone / "file.txt").read_text() == "first"
+
+
+def test_locked_by_committish(lock_file, upstream, tmp_path, git_repo):
+    first = _commit(upstream, "first")
+    upstream.git("checkout", "-q", "-b", "stable")
+    _commit(upstream, "stable")
+    upstream.git("checkout", "-q", "master")
+    second = _commit(upstream, "second")
+
+    lock.configure(str(lock_file), lock.UPDATE)
+    git.clone(str(upstream), dest=tmp_path / "master")
+    git.clone(str(upstream), dest=tmp_path / "stable", committish="origin/stable")
+    git.clone(str(upstream), dest=tmp_path / "first", committish=first)
+    lock.write()
+
+    entries = json.loads(lock_file.read_text())["git"][str(upstream)]
+    assert entries["master"] == second
+    assert entries[first] == first
+    stable = entries["origin/stable"]
+    assert stable not in (first, second)
+
+    lock.configure(str(lock_file), lock.LOCKED)
+    clone = git.clone(str(upstream), dest=tmp_path / "locked", committish=first)
+    assert git_repo(clone, init=False).head() == first
+    clone = git.clone(
+        str(upstream), dest=tmp_path / "locked", committish="origin/stable"
+    )
+    assert git_repo(clone, init=False).head() == stable
+    with pytest.raises(RuntimeError, match="at v1"):
+        git.clone(str(upstream), dest=tmp_path / "locked", committish="v1")
+
+
+def test_locked_clone_keeps_depth(lock_file, upstream, tmp_path, git_repo):
+    _commit(upstream, "first")
+    second = _commit(upstream, "second")
+    _commit(upstream, "third")
+    # Local paths are always cloned in full, unlike file:// URLs.
+    url = f"file://{upstream}"
+    lock_file.write_text(json.dumps({"git": {url: {"master": second}}}))
+
+    lock.configure(str(lock_file), lock.LOCKED)
+    clone = git.clone(url, dest=tmp_path / "clone", depth=1)
+    clone = git_repo(clone, init=False)
+
+    assert clone.head() == second
+    assert clone.git("rev-list", "--count", "HEAD").strip() == "1"
+
+
+def test_nothing_resolved_keeps_lock_file(lock_file):
+    lock_file.write_text("unchanged")
+    lock.configure(str(lock_file), lock.UPDATE)
+    lock.write()
+
+    assert lock_file.read_text() == "unchanged"
+
+
+def test_locked_requires_entries(lock_file, upstream, tmp_path):
+    lock_file.write_text(json.dumps({"git": {}, "images": {}}))
+    lock.configure(str(lock_file), lock.LOCKED)
+
+    with pytest.raises(RuntimeError, match="--update-lock"):
+        git.clone(str(upstream), dest=tmp_path)
+
+
+def test_locked_requires_lock_file(lock_file):
+    with pytest.raises(FileNotFoundError):
+        lock.configure(str(lock_file), lock.LOCKED)
+
+
+def test_pull_uses_locked_digest(lock_file, monkeypatch):
+    lock_file.write_text(json.dumps({"git": {}, "images": {IMAGE: DIGEST}}))
+    lock.configure(str(lock_file), lock.LOCKED)
+    monkeypatch.setattr(docker, "_inspected", {})
+    present = set()
+
+    def run(args, **kwargs):
+        if args[:2] == ["docker", "pull"]:
+            present.add(args[2])
+            return subprocess.CompletedProcess(args, 0, "")
+        if args[:3] == ["docker", "image", "inspect"] and args[3] in present:
+            info = [{"Id": "sha256:def456", "RepoDigests": [DIGEST]}]
+            return subprocess.CompletedProcess(args, 0, json.dumps(info))
+        return subprocess.CompletedProcess(args, 1, "")
+
+    with mock.patch("synthtool.shell.run", side_effect=run) as shell_run:
+        assert docker.pull(IMAGE) == DIGEST
+        assert docker.pull(IMAGE) == DIGEST
+
+    pulls = [args for (args,), _ in shell_run.call_args_list if args[1] == "pull"]
+    assert pulls == [["docker", "pull", DIGEST]]
+
+
+def test_pull_records_digest_without_pulling(lock_file, monkeypatch, tmp_path):
+    monkeypatch.setattr(docker, "_inspected", {})
+    monkeypatch.setattr(docker, "cached_digest", lambda image, ttl: DIGEST)
+    info = [{"Id": "sha256:def456", "RepoDigests": [DIGEST]}]
+    lock.configure(str(lock_file), lock.UPDATE)
+
+    with mock.patch(
+        "synthtool.shell.run",
+        return_value=subprocess.CompletedProcess([], 0, json.dumps(info)),
+    ) as shell_run:
+        # Resolved recently, and pinned by digest: neither is pulled.
+        assert docker.pull(IMAGE) == DIGEST
+        assert docker.pull(DIGEST) == DIGEST
+    lock.write()
+
+    assert all(args[1] != "pull" for (args,), _ in shell_run.call_args_list)
+    assert json.loads(lock_file.read_text())["images"] == {
+        IMAGE: DIGEST,
+        DIGEST: DIGEST,
+    }
@@ -14,6 +14,7 @@
 
 import json
 
+from synthtool import context
 from synthtool import metadata
 
 
@@ -91,3 +92,27 @@ def test_write(tmpdir):
     data = json.loads(raw)
     assert data
     assert data["updateTime"] is not None
+
+
+def test_exit_hook_records_duration(tmpdir, monkeypatch):
+    clock = iter([100.0, 112.34])
+    monkeypatch.setattr(metadata.time, "monotonic", lambda: next(clock))
+    output_file = tmpdir / "synth.metadata"
+
+    with context.SynthContext() as synth_context:
+        with context.activate(synth_context):
+            metadata.register_exit_hook(outfile=str(output_file))
+            synth_context.succeeded = True
+
+    assert json.loads(output_file.read())["synthDuration"] == 12.3
+
+
+def test_failed_synth_keeps_the_recorded_duration(tmpdir):
+    output_file = tmpdir / "synth.metadata"
+    output_file.write(json.dumps({"synthDuration": 42.0}))
+
+    with context.SynthContext() as synth_context:
+        with context.activate(synth_context):
+            metadata.register_exit_hook(outfile=str(output_file))
+
+    assert json.loads(output_file.read())["synthDuration"] == 42.0
@@ -0,0 +1,271 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+import synthtool.pipeline
+from synthtool import _tracked_paths
+from synthtool import cache
+from synthtool import context
+from synthtool import metadata
+from synthtool import tmp
+from synthtool import transforms
+from synthtool.pipeline import Pipeline
+from synthtool.sources import git
+
+calls = []
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    calls.clear()
+    monkeypatch.setattr(cache, "get_cache_dir", lambda: tmp_path / "cache")
+    monkeypatch.chdir(tmp_path)
+    metadata.reset()
+    return tmp_path
+
+
+def generate(name):
+    calls.append(("generate", name))
+    metadata.add_client_destination(api_name=name, api_version="v1", language="py")
+    return f"{name}-library"
+
+
+def copy(source, destination):
+    calls.append(("copy", source))
+    with open(source) as f:
+        contents = f.read()
+    with open(destination, "w") as f:
+        f.write(contents)
+
+
+def build_pipeline():
+    pipeline = Pipeline()
+    library = pipeline.step(generate, "speech")
+    pipeline.step(
+        copy,
+        "input.txt",
+        "output.txt",
+        inputs=["input.txt"],
+        outputs=["output.txt"],
+        after=[library],
+    )
+    pipeline.step(
+        copy, "output.txt", "final.txt", inputs=["output.txt"], outputs=["final.txt"]
+    )
+    return pipeline
+
+
+def test_results_are_passed_to_dependent_steps():
+    pipeline = Pipeline()
+    library = pipeline.step(generate, "speech")
+    joined = pipeline.step(lambda value: value.upper(), library, name="upper")
+
+    assert joined.dependencies == {library}
+    assert pipeline.run() == {"generate": "speech-library", "upper": "SPEECH-LIBRARY"}
+
+
+def test_independent_steps_run_concurrently():
+    both_running = threading.Barrier(2, timeout=5)
+    pipeline = Pipeline(max_workers=2)
+    pipeline.step(both_running.wait, name="first")
+    pipeline.step(both_running.wait, name="second")
+
+    # Would raise BrokenBarrierError if the steps ran one after the other.
+    pipeline.run()
+
+
+def test_steps_are_ordered_by_the_paths_they_touch():
+    pipeline = build_pipeline()
+    copy_input, copy_output = pipeline.steps[1:]
+
+    assert copy_output.dependencies == {copy_input}
+    assert copy_output.name == "copy-2"
+
+
+def test_duplicate_names_are_rejected():
+    pipeline = Pipeline()
+    pipeline.step(generate, "speech", name="speech")
+    with pytest.raises(ValueError):
+        pipeline.step(generate, "vision", name="speech")
+
+
+def test_unchanged_steps_are_skipped(workdir):
+    (workdir / "input.txt").write_text("hello")
+    build_pipeline().run()
+    calls.clear()
+    metadata.reset()
+
+    build_pipeline().run()
+
+    assert calls == []
+    assert (workdir / "final.txt").read_text() == "hello"
+    # The skipped generator's metadata is recorded again.
+    assert [d.client.api_name for d in metadata.get().destinations] == ["speech"]
+
+
+def test_changed_inputs_rerun_dependent_steps(workdir):
+    (workdir / "input.txt").write_text("hello")
+    build_pipeline().run()
+    calls.clear()
+
+    (workdir / "input.txt").write_text("goodbye")
+    build_pipeline().run()
+
+    assert calls == [("copy", "input.txt"), ("copy", "output.txt")]
+    assert (workdir / "final.txt").read_text() == "goodbye"
+
+
+def test_modified_outputs_are_regenerated(workdir):
+    (workdir / "input.txt").write_text("hello")
+    build_pipeline().run()
+    calls.clear()
+
+    (workdir / "final.txt").write_text("edited")
+    build_pipeline().run()
+
+    assert calls == [("copy", "output.txt")]
+    assert (workdir / "final.txt").read_text() == "hello"
+
+
+def test_unfingerprintable_steps_always_run():
+    for _ in range(2):
+        pipeline = Pipeline()
+        pipeline.step(lambda value: calls.append(value), object(), name="append")
+        pipeline.run()
+
+    assert len(calls) == 2
+
+
+def fetch(destination):
+    calls.append(("fetch", destination))
+    source = cache.get_cache_dir() / "source"
+    (source / "src").mkdir(parents=True, exist_ok=True)
+    (source / "src" / "file.txt").write_text(destination)
+    _tracked_paths.add(source)
+    return source / "src"
+
+
+def test_skipped_steps_track_their_paths_again(workdir):
+    for _ in range(2):
+        with context.SynthContext() as synth_context:
+            with context.activate(synth_context):
+                pipeline = Pipeline()
+                source = pipeline.step(fetch, "generated")
+                pipeline.step(transforms.move, source, outputs=["src"])
+                pipeline.run()
+
+    assert calls == [("fetch", "generated")]
+    assert (workdir / "src" / "file.txt").read_text() == "generated"
+
+
+def test_clone_steps_rerun_on_new_commits(workdir, git_repo):
+    upstream = git_repo(workdir / "upstream")
+
+    def commit(contents):
+        upstream.commit(contents, files={"file.txt": contents})
+
+    def run():
+        pipeline = Pipeline()
+        clone = pipeline.step(git.clone, str(upstream))
+        pipeline.run()
+        return clone
+
+    commit("first")
+    assert not run().skipped
+    assert run().skipped
+
+    commit("second")
+    clone = run()
+    assert not clone.skipped
+    assert (clone.result / "file.txt").read_text() == "second"
+
+
+def test_steps_writing_the_same_outputs_are_skipped(workdir):
+    def build():
+        pipeline = Pipeline()
+        source = pipeline.step(fetch, "generated")
+        pipeline.step(transforms.move, source, "out", outputs=["out"])
+        pipeline.step(
+            transforms.replace, "out/file.txt", "generated", "replaced", outputs=["out"]
+        )
+        return pipeline
+
+    build().run()
+    assert (workdir / "out" / "file.txt").read_text() == "replaced"
+
+    pipeline = build()
+    pipeline.run()
+    assert all(step.skipped for step in pipeline.steps)
+
+    (workdir / "out" / "file.txt").write_text("edited")
+    pipeline = build()
+    pipeline.run()
+    assert [step.skipped for step in pipeline.steps] == [True, False, False]
+    assert (workdir / "out" / "file.txt").read_text() == "replaced"
+
+
+def generate_into_tmpdir(name):
+    calls.append(("generate", name))
+    output = tmp.tmpdir()
+    (output / "src").mkdir()
+    (output / "src" / "file.txt").write_text(name)
+    _tracked_paths.add(output)
+    return output / "src"
+
+
+def test_temporary_results_are_kept(workdir):
+    for _ in range(2):
+        # Like separate synth runs, each removing its temporary directories.
+        with context.SynthContext() as synth_context:
+            with context.activate(synth_context):
+                pipeline = Pipeline()
+                source = pipeline.step(generate_into_tmpdir, "generated")
+                pipeline.step(transforms.move, source, outputs=["src"])
+                pipeline.run()
+
+    assert calls == [("generate", "generated")]
+    assert source.skipped
+    assert (source.result / "file.txt").read_text() == "generated"
+    assert (workdir / "src" / "file.txt").read_text() == "generated"
+
+
+class Generator:
+    def __init__(self, state):
+        self.state = state
+
+    def py_library(self, service, version):
+        calls.append(("py_library", service))
+        return f"{service}-{version}"
+
+
+def test_methods_with_external_state(monkeypatch):
+    monkeypatch.setitem(
+        synthtool.pipeline._EXTERNAL_STATE,
+        Generator.py_library,
+        lambda generator, service, version: generator.state,
+    )
+
+    def run(state):
+        pipeline = Pipeline()
+        step = pipeline.step(Generator(state).py_library, "speech", "v1")
+        pipeline.run()
+        return step
+
+    assert not run("protos").skipped
+    assert run("protos").skipped
+    assert not run("edited protos").skipped
+    assert calls == [("py_library", "speech")] * 2
@@ -0,0 +1,74 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from unittest import mock
+
+import pytest
+
+from synthtool import _project_files
+from synthtool.gcp.common import CommonTemplates
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    _project_files.reset()
+
+
+def test_load_json_missing(tmp_path):
+    assert _project_files.load_json(tmp_path / "missing.json") is None
+
+
+def test_load_json_cached_until_modified(tmp_path):
+    path = tmp_path / ".repo-metadata.json"
+    path.write_text('{"name": "storage"}')
+
+    assert _project_files.load_json(path) == {"name": "storage"}
+
+    with mock.patch("builtins.open", autospec=True) as open_:
+        snapshot = _project_files.load_json(path)
+        open_.assert_not_called()
+
+    # Snapshots are copies, modifying one doesn't affect the next.
+    snapshot["name"] = "modified"
+    assert _project_files.load_json(path) == {"name": "storage"}
+
+    path.write_text('{"name": "bigtable"}')
+    os.utime(path, ns=(0, 0))
+    assert _project_files.load_json(path) == {"name": "bigtable"}
+
+
+def test_load_yaml(tmp_path):
+    path = tmp_path / ".readme-partials.yml"
+    path.write_text("introduction: Hello!\n")
+
+    assert _project_files.load_yaml(path) == {"introduction": "Hello!"}
+
+
+def test_validate(tmp_path):
+    path = tmp_path / ".repo-metadata.json"
+    path.write_text("[]")
+
+    with pytest.raises(RuntimeError):
+        _project_files.load_json(path, validate=_project_files.require_mapping)
+
+
+def test_empty_readme_partials_stop_the_search(tmp_path):
+    (tmp_path / ".readme-partials.yml").write_text("")
+    (tmp_path / ".readme-partials.yaml").write_text("introduction: Hello!\n")
+    metadata = {}
+
+    CommonTemplates()._load_partials(metadata, tmp_path)
+
+    assert metadata == {"partials": None}
@@ -0,0 +1,152 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pathlib import Path
+
+import pytest
+
+from synthtool import cache
+from synthtool.gcp import proto_index
+
+ARTMAN_CONFIG = """\
+common:
+  api_name: {api_name}
+  api_version: {api_version}
+  src_proto_paths:
+    - {api_version}
+"""
+
+
+def _write(root: Path, path: str, contents: str) -> None:
+    (root / path).parent.mkdir(parents=True, exist_ok=True)
+    (root / path).write_text(contents)
+
+
+@pytest.fixture
+def googleapis_repo(monkeypatch, tmp_path, git_repo):
+    monkeypatch.setattr(cache, "get_cache_dir", lambda: tmp_path / "cache")
+    repo = git_repo(tmp_path / "googleapis")
+    root = repo.path
+    _write(root, "google/type/date.proto", "package google.type;\n")
+    for api_name, api_version in [("speech", "v1"), ("speech", "v2"), ("vision", "v1")]:
+        directory = f"google/cloud/{api_name}"
+        _write(
+            root,
+            f"{directory}/artman_{api_name}_{api_version}.yaml",
+            ARTMAN_CONFIG.format(api_name=api_name, api_version=api_version),
+        )
+        _write(
+            root,
+            f"{directory}/{api_version}/{api_name}.proto",
+            f"package google.cloud.{api_name}.{api_version};\n",
+        )
+    _write(
+        root,
+        "google/cloud/vision/v1/vision.proto",
+        'package google.cloud.vision.v1;\nimport "google/type/date.proto";\n',
+    )
+    return repo
+
+
+@pytest.fixture
+def googleapis(googleapis_repo):
+    return googleapis_repo.path
+
+
+def test_build(googleapis_repo, googleapis):
+    googleapis_repo.commit()
+
+    index = proto_index.load(googleapis)
+
+    assert index.protos["google/cloud/vision/v1/vision.proto"] == {
+        "package": "google.cloud.vision.v1",
+        "imports": ["google/type/date.proto"],
+    }
+    assert index.configs["google/cloud/speech/artman_speech_v2.yaml"] == {
+        "api_name": "speech",
+        "api_version": "v2",
+        "proto_dirs": ["google/cloud/speech/v2"],
+    }
+    assert index.apis() == {("speech", "v1"), ("speech", "v2"), ("vision", "v1")}
+
+
+def test_affected_apis(googleapis_repo, googleapis):
+    first = googleapis_repo.commit()
+    proto_index.load(googleapis)
+
+    _write(googleapis, "google/cloud/speech/v2/speech.proto", "package changed;\n")
+    second = googleapis_repo.commit()
+    assert proto_index.affected_apis(googleapis, first, second) == {("speech", "v2")}
+
+    # Changes to imports affect the APIs importing them.
+    _write(googleapis, "google/type/date.proto", "package google.type.changed;\n")
+    third = googleapis_repo.commit()
+    assert proto_index.affected_apis(googleapis, second) == {("vision", "v1")}
+    assert proto_index.affected_apis(googleapis, first, third) == {
+        ("speech", "v2"),
+        ("vision", "v1"),
+    }
+
+
+def test_other_api_files_affect_the_api(googleapis_repo, googleapis):
+    googleapis_repo.commit()
+    index = proto_index.load(googleapis)
+
+    assert index.affected(["google/cloud/speech/v1/speech_gapic.yaml"]) == {
+        ("speech", "v1")
+    }
+    assert index.affected(
+        ["google/cloud/vision/v1/samples/vision_grpc_service_config.json"]
+    ) == {("vision", "v1")}
+    # Next to the artman configurations, such as a service yaml.
+    assert index.affected(["google/cloud/speech/speech_v1.yaml"]) == {
+        ("speech", "v1"),
+        ("speech", "v2"),
+    }
+    assert index.affected(["README.md", "google/cloud/README.md"]) == set()
+
+
+def test_index_updated_incrementally(googleapis_repo, googleapis, monkeypatch):
+    googleapis_repo.commit()
+    proto_index.load(googleapis)
+
+    _write(
+        googleapis,
+        "google/cloud/speech/v1/speech.proto",
+        'package google.cloud.speech.v1;\nimport "google/type/date.proto";\n',
+    )
+    (googleapis / "google/cloud/vision/v1/vision.proto").unlink()
+    head = googleapis_repo.commit()
+
+    def build(googleapis):
+        raise AssertionError("The index should have been updated.")
+
+    monkeypatch.setattr(proto_index, "build", build)
+    index = proto_index.load(googleapis)
+
+    assert index.sha == head
+    assert index.dependents(["google/type/date.proto"]) == {
+        "google/type/date.proto",
+        "google/cloud/speech/v1/speech.proto",
+    }
+
+
+def test_unknown_commit_affects_everything(googleapis_repo, googleapis):
+    googleapis_repo.commit()
+
+    assert proto_index.affected_apis(googleapis, "0" * 40) == {
+        ("speech", "v1"),
+        ("speech", "v2"),
+        ("vision", "v1"),
+    }
@@ -0,0 +1,159 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from synthtool import __main__
+from synthtool import batch
+
+SYNTH = """
+from pathlib import Path
+
+from synthtool import metadata
+from synthtool import tmp
+
+assert tmp.tmpdir().exists()
+metadata.add_client_destination(api_name=Path.cwd().name)
+Path("generated.txt").write_text("generated")
+"""
+
+
+@pytest.fixture
+def repos(tmp_path):
+    for name in ("speech", "vision"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "synth.py").write_text(SYNTH)
+    (tmp_path / "broken").mkdir()
+    (tmp_path / "broken" / "synth.py").write_text("raise RuntimeError('oops')")
+    (tmp_path / "empty").mkdir()
+    return tmp_path
+
+
+def test_run_many(repos):
+    names = ["speech", "broken", "vision", "empty"]
+    cwd = os.getcwd()
+
+    results = batch.run_many([str(repos / name) for name in names], max_workers=2)
+
+    assert os.getcwd() == cwd
+    assert [result.repo for result in results] == [str(repos / n) for n in names]
+    assert [result.status for result in results] == [
+        batch.SUCCEEDED,
+        batch.FAILED,
+        batch.SUCCEEDED,
+        batch.FAILED,
+    ]
+    assert "RuntimeError: oops" in results[1].reason
+    assert "not found" in results[3].reason
+
+    for name in ("speech", "vision"):
+        assert (repos / name / "generated.txt").read_text() == "generated"
+        written = json.loads((repos / name / "synth.metadata").read_text())
+        # Each synth only records its own metadata.
+        assert written["destinations"] == [{"client": {"apiName": name}}]
+
+
+def test_workers_close_their_default_context(tmp_path):
+    (tmp_path / "repo").mkdir()
+    (tmp_path / "repo" / "synth.py").write_text(
+        "from pathlib import Path\n"
+        "from synthtool import context, tmp\n"
+        "with context.activate(context.default()):\n"
+        "    Path('tmpdir.txt').write_text(str(tmp.tmpdir()))\n"
+        "closed = Path('closed.txt').resolve()\n"
+        "context.default().add_exit_hook(lambda: closed.write_text('closed'))\n"
+    )
+
+    results = batch.run_many([str(tmp_path / "repo")], max_workers=1)
+
+    assert results[0].status == batch.SUCCEEDED, results[0].reason
+    assert not os.path.exists((tmp_path / "repo" / "tmpdir.txt").read_text())
+    assert (tmp_path / "repo" / "closed.txt").read_text() == "closed"
+
+
+def test_summarize():
+    results = [
+        batch.RepoResult("speech", batch.SUCCEEDED, 2.0),
+        batch.RepoResult("vision", batch.SKIPPED, 0.5, "unchanged"),
+    ]
+    summary = batch.summarize(results, 2.1)
+
+    assert "speech  succeeded      2.0s" in summary
+    assert summary.splitlines()[-1] == (
+        "1 succeeded, 0 failed, 1 skipped in 2.1s (2.5s of synth time)."
+    )
+
+
+def test_batch_command(repos):
+    runner = CliRunner()
+    result = runner.invoke(
+        __main__.cli, ["batch", "-j", "2", str(repos / "speech"), str(repos / "vision")]
+    )
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(__main__.cli, ["batch", str(repos / "broken")])
+    assert result.exit_code == 1
+
+
+def test_cli_runs_main_by_default(tmp_path):
+    synth_file = tmp_path / "missing.py"
+    result = CliRunner().invoke(
+        __main__.cli, [str(synth_file), "--metadata", str(tmp_path / "synth.metadata")]
+    )
+    # Handled by main(), which exits when the synth file doesn't exist.
+    assert result.exit_code == 1
+
+
+def _write_duration(repo, duration):
+    repo.mkdir()
+    (repo / "synth.metadata").write_text(json.dumps({"synthDuration": duration}))
+
+
+def test_shard_balances_recorded_durations(tmp_path):
+    durations = {"a": 10, "b": 7, "c": 6, "d": 5, "e": 4, "f": 2}
+    for name, duration in durations.items():
+        _write_duration(tmp_path / name, duration)
+    # No recorded duration, counts as the average.
+    (tmp_path / "g").mkdir()
+    repos = [str(tmp_path / name) for name in "gfedcba"]
+
+    shards = [batch.shard(repos, index, 3) for index in (1, 2, 3)]
+
+    assert sorted(sum(shards, [])) == sorted(repos)
+    # Longest first: a, b, c, then g (the average, 5.67), d, e, f; each to
+    # the shard with the least so far.
+    assert [[os.path.basename(repo) for repo in shard] for shard in shards] == [
+        ["e", "a"],
+        ["d", "b"],
+        ["g", "f", "c"],
+    ]
+    # The same inputs always give the same shards.
+    assert batch.shard(list(reversed(repos)), 1, 3) == list(reversed(shards[0]))
+
+
+def test_shard_option(repos):
+    runner = CliRunner()
+    result = runner.invoke(
+        __main__.cli, ["batch", "--shard", "2/2", str(repos / "broken")]
+    )
+    # The only repo goes to the first shard, the second has nothing to run.
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(__main__.cli, ["batch", "--shard", "3/2", "repo"])
+    assert result.exit_code == 2
+    assert "doesn't exist" in result.output
@@ -12,17 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
+import json
 import os
 import stat
+import subprocess
+import sys
+import threading
+import time
 from pathlib import Path
+from unittest import mock
 
+import pytest
+
+from synthtool import cache
 from synthtool.gcp import common
 from synthtool.sources import templates
 
 
+ROOT = Path(__file__).parent.parent
 FIXTURES = Path(__file__).parent / "fixtures"
 NODE_TEMPLATES = Path(__file__).parent.parent / "synthtool/gcp/templates/node_library"
 RUBY_TEMPLATES = Path(__file__).parent.parent / "synthtool/gcp/templates/ruby_library"
+PHP_TEMPLATES = Path(__file__).parent.parent / "synthtool/gcp/templates/php_library"
 
 
 def test_render():
@@ -33,6 +45,157 @@ def test_render():
     assert result.read_text() == "Hello, world!\n"
 
 
+@pytest.fixture
+def render_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "get_cache_dir", lambda: tmp_path)
+    monkeypatch.setattr(templates, "_rendered", {})
+    monkeypatch.setattr(templates, "_variables", {})
+    monkeypatch.setattr(templates, "_environments", {})
+    return tmp_path
+
+
+def test_render_cache_keyed_by_referenced_variables(render_cache):
+    t = templates.Templates(FIXTURES)
+    t.render("example.j2", name="world", unused="a")
+
+    with mock.patch.object(t.env, "get_template", autospec=True) as get_template:
+        # Only the value of `name` is part of the key.
+        result = t.render("example.j2", name="world", unused="b")
+        assert result.read_text() == "Hello, world!\n"
+        get_template.assert_not_called()
+
+    result = t.render("example.j2", name="synthtool", unused="b")
+    assert result.read_text() == "Hello, synthtool!\n"
+
+
+def test_render_cache_persists_to_disk(render_cache, monkeypatch):
+    t = templates.Templates(FIXTURES)
+    t.render("example.j2", name="world")
+
+    # Simulate a new process.
+    monkeypatch.setattr(templates, "_rendered", {})
+    monkeypatch.setattr(templates, "_variables", {})
+
+    with mock.patch.object(t.env, "get_template", autospec=True) as get_template:
+        result = t.render("example.j2", name="world")
+        assert result.read_text() == "Hello, world!\n"
+        get_template.assert_not_called()
+
+
+def test_render_cache_prunes_unused_entries(render_cache, monkeypatch):
+    monkeypatch.setattr(templates, "_pruned", set())
+    t = templates.Templates(FIXTURES)
+    t.render("example.j2", name="world")
+    entries = list((render_cache / "rendered-templates").glob("[!.]*"))
+    assert entries
+    old = time.time() - templates._RENDER_CACHE_MAX_AGE - 60
+    for entry in entries:
+        os.utime(str(entry), (old, old))
+
+    # Simulate a new process, which uses the entries again.
+    monkeypatch.setattr(templates, "_rendered", {})
+    monkeypatch.setattr(templates, "_variables", {})
+    t.render("example.j2", name="world")
+    (render_cache / "rendered-templates" / "unused").write_text("")
+    os.utime(str(render_cache / "rendered-templates" / "unused"), (old, old))
+
+    # Pruned at most once a day.
+    monkeypatch.setattr(templates, "_pruned", set())
+    templates._get_render_cache_dir()
+    assert (render_cache / "rendered-templates" / "unused").exists()
+
+    os.utime(str(render_cache / "rendered-templates" / ".pruned"), (old, old))
+    monkeypatch.setattr(templates, "_pruned", set())
+    templates._get_render_cache_dir()
+    assert not (render_cache / "rendered-templates" / "unused").exists()
+    assert all(entry.exists() for entry in entries)
+
+
+def test_render_precompiled(render_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(templates, "_precompiled_roots", {})
+    templates.compile_templates(
+        FIXTURES / "group", tmp_path / "compiled" / "group", "2019.05.02"
+    )
+    templates.register_precompiled(FIXTURES, tmp_path / "compiled", "2019.05.02")
+    # Forget what compiling learned, as a new process would.
+    monkeypatch.setattr(templates, "_variables", {})
+
+    t = templates.TemplateGroup(FIXTURES / "group")
+    assert isinstance(t.env.loader, templates._PrecompiledLoader)
+
+    with mock.patch.object(t.env, "_parse", autospec=True) as parse:
+        result = t.render(var_a="hello", var_b="world")
+        parse.assert_not_called()
+
+    assert (result / "1.txt").read_text() == "hello\n"
+    assert (result / "subdir" / "2.txt").read_text() == "world\n"
+
+
+def test_render_precompiled_ignores_other_versions(monkeypatch, tmp_path):
+    monkeypatch.setattr(templates, "_precompiled_roots", {})
+    monkeypatch.setattr(templates, "_environments", {})
+    templates.compile_templates(
+        FIXTURES / "group", tmp_path / "compiled" / "group", "2019.05.02"
+    )
+    # Compiled by another version of synthtool.
+    templates.register_precompiled(FIXTURES, tmp_path / "compiled", "1999.01.01")
+
+    t = templates.TemplateGroup(FIXTURES / "group")
+    assert not isinstance(t.env.loader, templates._PrecompiledLoader)
+
+
+def test_setup_precompiles_the_bundled_templates(render_cache, tmp_path):
+    def setup(*args):
+        return subprocess.run(
+            [sys.executable, "setup.py", "-q"] + list(args),
+            cwd=str(ROOT),
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        ).stdout
+
+    # Without importing synthtool, so it must agree with compile_templates.
+    setup("build_py", "--build-lib", str(tmp_path / "build"))
+    built = tmp_path / "build" / "synthtool" / "gcp" / "compiled_templates"
+    common.compile_templates(tmp_path / "compiled")
+
+    expected_dirs = [path.parent for path in (tmp_path / "compiled").glob("**/*.json")]
+    assert len(expected_dirs) == 1 + len(list(ROOT.glob("synthtool/gcp/templates/*/")))
+    for expected_dir in expected_dirs:
+        built_dir = built / expected_dir.relative_to(tmp_path / "compiled")
+        for expected in expected_dir.iterdir():
+            if expected.is_file() and expected.name != "manifest.json":
+                assert (built_dir / expected.name).read_text() == expected.read_text()
+
+        manifest = json.loads((built_dir / "manifest.json").read_text())
+        expected_manifest = json.loads((expected_dir / "manifest.json").read_text())
+        # The version synthtool finds once installed.
+        assert manifest["version"] == setup("--version").strip()
+        manifest["version"] = expected_manifest["version"]
+        assert manifest == expected_manifest
+
+
+def test_preload(render_cache, monkeypatch):
+    monkeypatch.setattr(templates, "_precompiled_roots", {})
+    assert templates.preload(FIXTURES / "group") == 2
+
+    t = templates.TemplateGroup(FIXTURES / "group")
+    with mock.patch.object(t.env, "_parse", autospec=True) as parse:
+        result = t.render(var_a="hello", var_b="world")
+        parse.assert_not_called()
+    assert (result / "1.txt").read_text() == "hello\n"
+
+
+def test_environment_shared_by_location(render_cache):
+    group = templates.TemplateGroup(FIXTURES / "group")
+    another_group = templates.TemplateGroup(FIXTURES / "group")
+    single = templates.Templates(FIXTURES / "group" / ".." / "group")
+
+    assert group.env is another_group.env is single.env
+    assert templates.Templates(FIXTURES).env is not group.env
+
+
 def test_render_group():
     t = templates.TemplateGroup(FIXTURES / "group")
     result = t.render(var_a="hello", var_b="world")
@@ -41,6 +204,103 @@ def test_render_group():
     assert (result / "subdir" / "2.txt").read_text() == "world\n"
 
 
+def test_render_group_copies_static_files():
+    t = templates.TemplateGroup(PHP_TEMPLATES)
+
+    with mock.patch.object(t.env, "get_template", autospec=True) as get_template:
+        result = t.render()
+        get_template.assert_not_called()
+
+    source = PHP_TEMPLATES / "phpunit.xml.dist"
+    copied = result / "phpunit.xml.dist"
+    assert copied.read_bytes() == source.read_bytes()
+    assert copied.stat().st_mode == source.stat().st_mode
+
+
+def test_render_group_into_destination(tmp_path):
+    t = templates.TemplateGroup(FIXTURES / "group")
+    result = t.render_into(tmp_path, var_a="hello", var_b="world")
+
+    assert result == tmp_path
+    assert (tmp_path / "1.txt").read_text() == "hello\n"
+    assert (tmp_path / "subdir" / "2.txt").read_text() == "world\n"
+
+    # Unchanged files are left alone, changed ones are rewritten.
+    os.utime(tmp_path / "1.txt", (0, 0))
+    t.render_into(tmp_path, var_a="hello", var_b="moon")
+
+    assert (tmp_path / "1.txt").stat().st_mtime == 0
+    assert (tmp_path / "subdir" / "2.txt").read_text() == "moon\n"
+
+
+def test_render_group_into_destination_excludes(tmp_path):
+    t = templates.TemplateGroup(FIXTURES / "group", excludes=["subdir/2.txt"])
+    t.render_into(tmp_path, var_a="hello", var_b="world")
+
+    assert (tmp_path / "1.txt").exists()
+    assert not (tmp_path / "subdir" / "2.txt").exists()
+
+
+def test_render_group_many(render_cache, tmp_path):
+    t = templates.TemplateGroup(FIXTURES / "group")
+    targets = [
+        (tmp_path / "a", {"var_a": "hello", "var_b": "world"}),
+        (tmp_path / "b", {"var_a": "hello", "var_b": "moon"}),
+    ]
+
+    with mock.patch.object(
+        t.env, "get_template", wraps=t.env.get_template
+    ) as get_template:
+        results = t.render_many(targets)
+
+    assert results == [tmp_path / "a", tmp_path / "b"]
+    assert (tmp_path / "a" / "1.txt").read_text() == "hello\n"
+    assert (tmp_path / "b" / "1.txt").read_text() == "hello\n"
+    assert (tmp_path / "a" / "subdir" / "2.txt").read_text() == "world\n"
+    assert (tmp_path / "b" / "subdir" / "2.txt").read_text() == "moon\n"
+    # 1.txt came out the same for both targets, so was only rendered once.
+    assert get_template.call_count == 3
+
+
+def test_concurrent_renders_of_a_key_render_once(render_cache):
+    t = templates.Templates(FIXTURES)
+    threads = 8
+    all_started = threading.Barrier(threads, timeout=5)
+    get_template = t.env.get_template
+
+    def slow_get_template(name):
+        time.sleep(0.05)
+        return get_template(name)
+
+    def render():
+        all_started.wait()
+        return templates._render(t.env, "example.j2", {"name": "world"})
+
+    with mock.patch.object(
+        t.env, "get_template", side_effect=slow_get_template
+    ) as get_template_mock:
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(lambda _: render(), range(threads)))
+
+    assert len({text for text, _ in results}) == 1
+    assert get_template_mock.call_count == 1
+
+
+def test_py_library_many(render_cache, tmp_path):
+    common_templates = common.CommonTemplates()
+    results = common_templates.py_library_many(
+        [
+            (tmp_path / "a", {"cov_level": 99}),
+            (tmp_path / "b", {"unit_test_dependencies": ["mock"]}),
+        ]
+    )
+
+    assert results == [tmp_path / "a", tmp_path / "b"]
+    assert "--fail-under=99" in (tmp_path / "a" / "noxfile.py").read_text()
+    assert "mock" in (tmp_path / "b" / "noxfile.py").read_text()
+    assert (tmp_path / "b" / "setup.cfg").exists()
+
+
 def test_render_preserve_mode():
     """
     Test that rendering templates correctly preserve file modes.
@@ -89,6 +349,29 @@ def test_load_samples():
     os.chdir(cwd)
 
 
+def test_scan_sample_cached_until_modified(tmp_path):
+    sample = tmp_path / "quickstart.js"
+    sample.write_text(
+        "// sample-metadata:\n"
+        "//   title: Quickstart\n"
+        "\n"
+        "// [START foo_quickstart]\n"
+        "const foo = 'bar';\n"
+        "// [END foo_quickstart]\n"
+    )
+
+    quickstart, sample_metadata = common._scan_sample(sample)
+    assert quickstart == "const foo = 'bar';\n"
+    assert sample_metadata == {"title": "Quickstart"}
+
+    with mock.patch("builtins.open", autospec=True) as open_:
+        assert common._scan_sample(sample) == (quickstart, sample_metadata)
+        open_.assert_not_called()
+
+    sample.write_text("// [START foo_quickstart]\nconst foo = 'baz';\n")
+    assert common._scan_sample(sample) == ("const foo = 'baz';\n", {})
+
+
 def test_syntax_highlighter():
     t = templates.Templates(NODE_TEMPLATES)
     result = t.render(
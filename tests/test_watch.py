@@ -0,0 +1,175 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+
+from click.testing import CliRunner
+
+from synthtool import __main__
+from synthtool import cache
+from synthtool import context
+from synthtool import metadata
+from synthtool import watch
+from synthtool.gcp import proto_index
+
+
+def test_snapshot_and_changed_files(tmp_path):
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "templates" / "a.j2").write_text("a")
+    (tmp_path / "templates" / ".git").mkdir()
+    (tmp_path / "templates" / ".git" / "HEAD").write_text("ref")
+    (tmp_path / "synth.py").write_text("")
+    paths = [tmp_path / "synth.py", tmp_path / "templates"]
+
+    before = watch.snapshot(paths)
+    assert sorted(before) == [
+        str(tmp_path / "synth.py"),
+        str(tmp_path / "templates" / "a.j2"),
+    ]
+
+    (tmp_path / "templates" / "a.j2").write_text("changed")
+    (tmp_path / "templates" / "b.j2").write_text("b")
+    assert watch.changed_files(before, watch.snapshot(paths)) == [
+        str(tmp_path / "templates" / "a.j2"),
+        str(tmp_path / "templates" / "b.j2"),
+    ]
+
+
+def test_watched_paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("SYNTHTOOL_GOOGLEAPIS", str(tmp_path / "googleapis"))
+    monkeypatch.delenv("SYNTHTOOL_GENERATOR", raising=False)
+
+    paths = watch.watched_paths("synth.py")
+
+    assert str(paths[0]) == "synth.py"
+    assert paths[1].name == "templates"
+    assert paths[2:] == [tmp_path / "googleapis"]
+
+
+def test_watch_runs_in_a_context_of_its_own(tmp_path):
+    outfile = tmp_path / "synth.metadata"
+    contexts = []
+
+    def execute():
+        contexts.append(context.current())
+        metadata.add_git_source(name="run", remote="https://example.com/run.git")
+
+    watch.watch(execute, [tmp_path], outfile=str(outfile), max_runs=1)
+
+    assert contexts[0] is not context.default()
+    recorded = json.loads(outfile.read_text())
+    assert recorded["sources"][0]["git"]["name"] == "run"
+
+
+def test_failing_run_is_reported(tmp_path):
+    def execute():
+        raise RuntimeError("oops")
+
+    outfile = tmp_path / "synth.metadata"
+    assert not watch._run(execute, (), str(outfile))
+    # The metadata is still written, like when a single synth fails.
+    assert outfile.exists()
+
+
+def test_watch_runs_again_on_changes(tmp_path):
+    synth = tmp_path / "synth.py"
+    synth.write_text("runs = 1")
+    seen = []
+
+    def execute():
+        seen.append(synth.read_text())
+
+    watcher = threading.Thread(
+        target=watch.watch,
+        args=(execute, [synth]),
+        kwargs={
+            "outfile": str(tmp_path / "synth.metadata"),
+            "interval": 0.05,
+            "max_runs": 2,
+        },
+    )
+    watcher.start()
+    while not seen:
+        time.sleep(0.01)
+    # Make sure the modification time moves, whatever its resolution.
+    synth.write_text("runs = 2")
+    stat = synth.stat()
+    os.utime(str(synth), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    watcher.join(timeout=10)
+
+    assert not watcher.is_alive()
+    assert seen == ["runs = 1", "runs = 2"]
+
+
+def test_cli_watch(tmp_path, monkeypatch):
+    synth = tmp_path / "synth.py"
+    synth.write_text(
+        "from synthtool import metadata\n"
+        "metadata.add_git_source(name='cli', remote='https://example.com/x.git')\n"
+    )
+    calls = []
+
+    def fake_watch(execute, paths, extra_args, outfile):
+        calls.append((paths, list(extra_args), outfile))
+        with context.SynthContext() as synth_context:
+            with context.activate(synth_context):
+                metadata.register_exit_hook(outfile=outfile)
+                execute()
+
+    monkeypatch.setattr(watch, "watch", fake_watch)
+    outfile = str(tmp_path / "synth.metadata")
+
+    result = CliRunner().invoke(
+        __main__.main,
+        [str(synth), "--metadata", outfile, "--watch", "--", "--foo"],
+    )
+
+    assert result.exit_code == 0, result.output
+    paths, extra_args, written = calls[0]
+    assert paths[0] == synth
+    assert extra_args == ["--foo"]
+    assert written == outfile
+    assert json.loads(open(outfile).read())["sources"][0]["git"]["name"] == "cli"
+
+
+def test_affected_apis_of_uncommitted_edits(tmp_path, monkeypatch, git_repo):
+    monkeypatch.setattr(cache, "get_cache_dir", lambda: tmp_path / "cache")
+    googleapis = tmp_path / "googleapis"
+    (googleapis / "google/cloud/speech/v1").mkdir(parents=True)
+    (googleapis / "google/cloud/speech/artman_speech_v1.yaml").write_text(
+        "common:\n  api_name: speech\n  api_version: v1\n  src_proto_paths:\n"
+        "    - v1\n"
+    )
+    (googleapis / "google/cloud/speech/v1/speech.proto").write_text("")
+    (googleapis / "google/type").mkdir(parents=True)
+    (googleapis / "google/type/date.proto").write_text("")
+    git_repo(googleapis).commit("first")
+    monkeypatch.setenv("SYNTHTOOL_GOOGLEAPIS", str(googleapis))
+    logged = []
+    monkeypatch.setattr(watch.log, "info", logged.append)
+
+    proto_index.load(googleapis)
+
+    # Only the working tree has the import.
+    (googleapis / "google/cloud/speech/v1/speech.proto").write_text(
+        'import "google/type/date.proto";\n'
+    )
+    watch._log_affected_apis([str(googleapis / "google/cloud/speech/v1/speech.proto")])
+    (googleapis / "google/type/date.proto").write_text("changed")
+    watch._log_affected_apis([str(googleapis / "google/type/date.proto")])
+
+    assert logged == ["The changes affect speech v1."] * 2